@@ -0,0 +1,57 @@
+class AdaptiveCadence:
+    # Decides how long a Server waits until its next probe. Healthy hosts back off from base_delay towards max_delay,
+    # a probe with loss or a ping that leaves the recent baseline switches to burst_delay for burst_duration seconds.
+    # A burst also sends its echo requests burst_interval seconds apart (and burst_pings of them, if set), so the
+    # samples of an incident get finer instead of only following each other more closely.
+    # A host that answers nothing for max_failed_cycles cycles in a row is down rather than degraded: its failures stop
+    # re-arming the burst, so it falls back to max_delay until an echo is answered again.
+    # The baseline is an exponentially weighted average of the ping and of its deviation from that average.
+    def __init__(self, base_delay, max_delay=None, burst_delay=1.0, burst_duration=60.0, backoff=1.25, alpha=0.1,
+                 threshold=3.0, min_deviation=5.0, burst_interval=0.2, burst_pings=None,
+                 max_failed_cycles=5):
+        self.base_delay = base_delay
+        self.max_delay = max_delay if max_delay is not None else 4 * base_delay
+        self.burst_delay = min(burst_delay, base_delay)
+        self.burst_duration = burst_duration
+        self.burst_interval = burst_interval  # seconds between the echo requests of a cycle while bursting
+        self.burst_pings = burst_pings  # echo requests of a cycle while bursting, None keeps the server's amount
+        self.backoff = backoff
+        self.alpha = alpha
+        self.threshold = threshold
+        self.min_deviation = min_deviation  # ms, pings closer than this to the baseline are never a deviation
+        self.max_failed_cycles = max_failed_cycles
+        self.failed_cycles = 0  # consecutive cycles without any answered echo
+        self.delay = base_delay
+        self.baseline = None
+        self.deviation = 0.0
+        self.burst_until = 0.0
+        self.bursting = False
+        self.bursts = 0
+
+    def update(self, time_in_sec, avg_ping, loss_rate):
+        failed = avg_ping < 0
+        anomalous = failed or loss_rate > 0
+        if failed:
+            self.failed_cycles += 1
+            if self.failed_cycles > self.max_failed_cycles:
+                anomalous = False
+                self.burst_until = min(self.burst_until, time_in_sec)
+        else:
+            self.failed_cycles = 0
+            if self.baseline is None:
+                self.baseline = avg_ping
+            difference = abs(avg_ping - self.baseline)
+            anomalous = anomalous or difference > max(self.threshold * self.deviation, self.min_deviation)
+            self.deviation += self.alpha * (difference - self.deviation)
+            self.baseline += self.alpha * (avg_ping - self.baseline)
+
+        if anomalous:
+            if time_in_sec >= self.burst_until:
+                self.bursts += 1
+            self.burst_until = time_in_sec + self.burst_duration
+        self.bursting = time_in_sec < self.burst_until
+        if self.bursting:
+            self.delay = self.burst_delay
+        else:
+            self.delay = min(self.max_delay, max(self.base_delay, self.delay * self.backoff))
+        return self.delay
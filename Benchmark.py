@@ -0,0 +1,421 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import Future
+from datetime import datetime
+
+import numpy as np
+
+import BinaryLog
+import PingParser
+from BufferedWriter import BufferedWriter
+from HeatmapData import LogData, create_month_images, load_logs_parallel
+from IcmpProber import PingResult
+from Server import Server
+
+# Offline benchmarks of the hot paths: ping output parsing, the probe cycle of a Server, the BufferedWriter,
+# loading logs into hours and rendering month images, and (if Qt is installed) the live graph updates.
+# Everything runs on synthetic data in a temporary directory, probes are answered by a StubProber.
+# Every component reports throughput, per operation latency percentiles and the peak of traced memory,
+# the results are saved as JSON together with the commit, so a run can be compared to an older one:
+#
+#   python Benchmark.py --hosts 8 --hours 2160 --profile lossy
+#   python Benchmark.py --compare benchmark-1a2b3c4d5e.json
+
+# rtts are base + |normal(0, jitter)| ms, a spike multiplies an rtt by 3-8, loss drops single echos
+# and an outage drops a whole probe
+PROFILES = {
+    "calm": {"base": 12.0, "jitter": 0.8, "spikes": 0.0, "loss": 0.0, "outages": 0.0},
+    "jittery": {"base": 25.0, "jitter": 6.0, "spikes": 0.02, "loss": 0.01, "outages": 0.001},
+    "lossy": {"base": 40.0, "jitter": 3.0, "spikes": 0.01, "loss": 0.08, "outages": 0.01},
+}
+COMPONENTS = ("ping_parse", "collect", "writer", "load", "render", "live_graph")
+AMT_OF_PINGS = 5
+
+
+def synthetic_probes(rng, profile, count, amt_of_pings=AMT_OF_PINGS, base=None):
+    # rtts of count probes as an array of shape (count, amt_of_pings), NaN for lost echos
+    base = profile["base"] if base is None else base
+    rtts = base + np.abs(rng.normal(0, profile["jitter"], (count, amt_of_pings)))
+    spikes = rng.random((count, amt_of_pings)) < profile["spikes"]
+    rtts[spikes] *= rng.uniform(3, 8, int(spikes.sum()))
+    lost = rng.random((count, amt_of_pings)) < profile["loss"]
+    lost[rng.random(count) < profile["outages"]] = True
+    rtts = np.round(rtts, 3)
+    rtts[lost] = np.nan
+    return rtts
+
+
+def probe_summary(rtts):
+    # (avg, min, max, loss rate) of one probe like Server computes them
+    answered = rtts[~np.isnan(rtts)]
+    if len(answered) == 0:
+        return -1.0, -1.0, -1.0, 1.0
+    return (round(float(answered.sum()) / len(answered), 3), float(answered.min()), float(answered.max()),
+            (len(rtts) - len(answered)) / len(rtts))
+
+
+def generate_log(path, hours, interval=5.0, profile="jittery", log_format="text", seed=0, start=None):
+    # writes a log of hours hours with one probe every interval seconds, returns the amount of lines
+    rng = np.random.default_rng(seed)
+    profile = PROFILES[profile]
+    count = int(hours * 3600 / interval)
+    start = time.time() - hours * 3600 if start is None else start
+    times = start + np.arange(count) * interval + rng.uniform(0, 0.01, count)
+    rtts = synthetic_probes(rng, profile, count, base=profile["base"] * rng.uniform(0.5, 2.0))
+    if log_format == "binary":
+        records = np.zeros(count, dtype=BinaryLog.RECORD_DTYPES[BinaryLog.VERSION])
+        records["time"] = times
+        records["rtts"] = np.nan
+        records["rtts"][:, :AMT_OF_PINGS] = rtts
+        for index in range(count):
+            records["avg"][index], records["min"][index], records["max"][index], records["loss"][index] = \
+                probe_summary(rtts[index])
+        with open(path, 'wb') as file:
+            file.write(BinaryLog.header_bytes())
+            file.write(records.tobytes())
+        return count
+
+    with open(path, 'w') as file:
+        for index in range(count):
+            avg_ping, min_ping, max_ping, loss_rate = probe_summary(rtts[index])
+            line = (f"{float(times[index])};{BinaryLog.format_value(avg_ping)};{BinaryLog.format_value(min_ping)};"
+                    f"{BinaryLog.format_value(max_ping)};{loss_rate}")
+            answered = BinaryLog.format_rtts(rtts[index])
+            if answered:
+                line += ";" + answered
+            file.write(line + '\n')
+    return count
+
+
+def ping_output(address, rtts):
+    # what iputils ping prints for a probe
+    lines = [f"PING {address} ({address}) 56(84) bytes of data."]
+    for sequence, rtt in enumerate(rtts, 1):
+        if rtt == rtt:
+            lines.append(f"64 bytes from {address}: icmp_seq={sequence} ttl=57 time={rtt} ms")
+    answered = rtts[~np.isnan(rtts)]
+    lines += ["", f"--- {address} ping statistics ---",
+              f"{len(rtts)} packets transmitted, {len(answered)} received, "
+              f"{round(100 * (len(rtts) - len(answered)) / len(rtts))}% packet loss, time {len(rtts) * 1000}ms"]
+    if len(answered):
+        lines.append(f"rtt min/avg/max/mdev = {answered.min():.3f}/{answered.mean():.3f}/{answered.max():.3f}/"
+                     f"{answered.std():.3f} ms")
+    return "\n".join(lines) + "\n"
+
+
+class StubProber:
+    # answers probes instantly with synthetic rtts, so a probe cycle only costs what the collector itself does
+    def __init__(self, profile="jittery", seed=0, batch=4096):
+        self.profile = PROFILES[profile]
+        self.rng = np.random.default_rng(seed)
+        self.batch = batch
+        self.pending = {}
+
+    def ping(self, address, count, interval=None):
+        pending = self.pending.get((address, count))
+        if pending is None or len(pending) == 0:
+            pending = list(synthetic_probes(self.rng, self.profile, self.batch, count))
+            self.pending[address, count] = pending
+        rtts = pending.pop()
+        return PingResult(count, [float(rtt) for rtt in rtts if rtt == rtt])
+
+    def submit(self, address, count, interval=None):
+        future = Future()
+        future.set_result(self.ping(address, count))
+        return future
+
+
+def timed(operation, count):
+    # calls operation(index) count times, returns the seconds of every call
+    durations = np.empty(count)
+    for index in range(count):
+        started = time.perf_counter()
+        operation(index)
+        durations[index] = time.perf_counter() - started
+    return durations
+
+
+def peak_memory(operation, count):
+    # peak traced memory (bytes) while operation runs count times, measured in a separate pass
+    # because tracing slows every allocation down
+    tracemalloc.start()
+    try:
+        for index in range(count):
+            operation(index)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def summarize(durations, items_per_op=1, peak=None, **extra):
+    total = float(durations.sum())
+    result = {
+        "ops": len(durations),
+        "seconds": total,
+        "ops_per_sec": len(durations) / total if total > 0 else None,
+        "items_per_sec": len(durations) * items_per_op / total if total > 0 else None,
+        "p50_ms": float(np.percentile(durations, 50)) * 1000,
+        "p95_ms": float(np.percentile(durations, 95)) * 1000,
+        "p99_ms": float(np.percentile(durations, 99)) * 1000,
+        "max_ms": float(durations.max()) * 1000,
+        "peak_memory_kib": peak / 1024 if peak is not None else None,
+    }
+    result.update(extra)
+    return result
+
+
+def measure(operation, count, items_per_op=1, memory_count=None, **extra):
+    durations = timed(operation, count)
+    peak = peak_memory(operation, memory_count or min(count, 100))
+    return summarize(durations, items_per_op, peak, **extra)
+
+
+def bench_ping_parse(args, workdir):
+    rng = np.random.default_rng(args.seed)
+    outputs = [ping_output("10.0.0.1", rtts) for rtts in synthetic_probes(rng, PROFILES[args.profile], 2000)]
+    size = sum(len(output) for output in outputs) / len(outputs)
+    return {"ping_parse": measure(lambda index: PingParser.parse(outputs[index % len(outputs)]), args.probes,
+                                  bytes_per_op=size)}
+
+
+def make_servers(args, log_format):
+    return [Server(f"10.0.{host // 256}.{host % 256}", f"host {host}", "#FF0000", "", 5, 400,
+                   amt_of_pings=AMT_OF_PINGS, prober=StubProber(args.profile, args.seed + host), log_format=log_format)
+            for host in range(args.hosts)]
+
+
+def bench_collect(args, workdir):
+    results = {}
+    for log_format in ("text", "binary"):
+        servers = make_servers(args, log_format)
+        try:
+            results[f"collect_{log_format}"] = measure(
+                lambda index: servers[index % len(servers)].collect_network_pings_data(), args.probes)
+        finally:
+            for server in servers:
+                server.writer.close()
+    return results
+
+
+def bench_writer(args, workdir):
+    rng = np.random.default_rng(args.seed)
+    lines = []
+    for rtts in synthetic_probes(rng, PROFILES[args.profile], 2000):
+        avg_ping, min_ping, max_ping, loss_rate = probe_summary(rtts)
+        lines.append(f"{time.time()};{avg_ping};{min_ping};{max_ping};{loss_rate};{BinaryLog.format_rtts(rtts)}")
+    writer = BufferedWriter(os.path.join(workdir, "writer_log.txt"), 4 * 1024, max_age=600)
+    try:
+        write = measure(lambda index: writer.write(lines[index % len(lines)]), args.probes * 10,
+                        bytes_per_op=sum(len(line) + 1 for line in lines) / len(lines))
+
+        def write_and_flush(index):
+            for line in lines[:64]:
+                writer.write(line)
+            writer.flush()
+
+        flush = measure(write_and_flush, max(10, args.probes // 100), items_per_op=64)
+    finally:
+        writer.close()
+    flush["flushed_bytes"] = writer.flushed_bytes
+    return {"writer_write": write, "writer_flush": flush}
+
+
+_generated = {}
+
+
+def generate_logs(args, workdir):
+    # the synthetic logs of load and render, generated once per run
+    if workdir in _generated:
+        return _generated[workdir]
+    paths = []
+    lines = 0
+    suffix = BinaryLog.BINARY_SUFFIX if args.log_format == "binary" else "_log.txt"
+    for host in range(args.hosts):
+        path = os.path.join(workdir, f"10_1_0_{host}{suffix}")
+        lines += generate_log(path, args.hours, args.interval, args.profile, args.log_format, args.seed + host)
+        paths.append(path)
+    _generated[workdir] = paths, lines
+    return paths, lines
+
+
+def remove_rollups(paths):
+    for path in paths:
+        if os.path.exists(path + ".rollup.npz"):
+            os.remove(path + ".rollup.npz")
+
+
+def bench_load(args, workdir):
+    paths, lines = generate_logs(args, workdir)
+    lines_per_log = lines / len(paths)
+
+    def load_uncached(index):
+        remove_rollups(paths[index:index + 1])
+        LogData(paths[index % len(paths)]).ensure_loaded()
+
+    uncached = measure(load_uncached, len(paths), items_per_op=lines_per_log, memory_count=1)
+    cached = measure(lambda index: LogData(paths[index % len(paths)]).ensure_loaded(), len(paths),
+                     items_per_op=lines_per_log, memory_count=1)
+
+    def load_parallel(index):
+        remove_rollups(paths)
+        for _ in load_logs_parallel([LogData(path) for path in paths], args.jobs):
+            pass
+
+    parallel = summarize(timed(load_parallel, 1), items_per_op=lines, jobs=args.jobs or os.cpu_count())
+    return {"load_uncached": uncached, "load_cached": cached, "load_parallel": parallel}
+
+
+def bench_render(args, workdir):
+    paths, _ = generate_logs(args, workdir)
+    log_list = [LogData(path) for path in paths]
+    months = [month_data for log in log_list for year_data in log.years.values()
+              for month_data in year_data.months.values() if month_data.has_data]
+    single = measure(lambda index: months[index % len(months)].create_month_image(), max(len(months), 50))
+    year, month = months[-1].year, months[-1].month
+    batch = measure(lambda index: create_month_images(log_list, year, month), 20, items_per_op=len(log_list))
+    return {"render_month": single, "render_batch": batch}
+
+
+def bench_live_graph(args, workdir):
+    # needs Qt, psutil and safe_exit like main.py, the graph gets stub servers instead of servers.txt
+    try:
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        from PyQt5 import QtWidgets
+        import Collector
+        import main
+    except ImportError as e:
+        print(f"Skipping live_graph: {e}")
+        return {}
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication(sys.argv[:1])
+    with open("servers.txt", 'w'):
+        pass
+    servers = make_servers(args, "text")
+    Collector.SERVERS.extend(servers)
+    graph = main.LiveGraph()
+    graph.resize(1600, 1000)
+    try:
+        def update_graphs(index):
+            servers[index % len(servers)].collect_network_pings_data()
+            graph.update_graphs()
+            app.processEvents()
+
+        for index in range(400 * len(servers)):
+            servers[index % len(servers)].collect_network_pings_data()
+        updates = measure(update_graphs, max(50, args.probes // 10), memory_count=20)
+        utilizations = np.random.default_rng(args.seed).uniform(0, 100, (16, 128))
+
+        def update_cpu_graph(index):
+            graph.cpu_sampler.publish(utilizations[index % len(utilizations)].copy())
+            graph.update_cpu_graph()
+
+        cpu = measure(update_cpu_graph, 500)
+    finally:
+        Collector.SCHEDULER.stop()
+        graph.cpu_timer.stop()
+        graph.cpu_sampler.stop()
+        graph.ping_timer.stop()
+        for server in servers:
+            server.writer.close()
+        del Collector.SERVERS[:]
+    return {"live_graph_update": updates, "live_graph_cpu": cpu}
+
+
+BENCHMARKS = {
+    "ping_parse": bench_ping_parse,
+    "collect": bench_collect,
+    "writer": bench_writer,
+    "load": bench_load,
+    "render": bench_render,
+    "live_graph": bench_live_graph,
+}
+
+
+def git_commit():
+    directory = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=directory, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=directory,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def compare(results, baseline):
+    # throughput and p95 latency relative to the baseline, > 1 is faster for throughput and slower for latency
+    print(f"compared to {baseline.get('commit') or 'unknown commit'}:")
+    for name, result in results["components"].items():
+        old = baseline.get("components", {}).get(name)
+        if old is None:
+            continue
+        ratios = []
+        for key in ("ops_per_sec", "p95_ms", "peak_memory_kib"):
+            if result.get(key) and old.get(key):
+                ratios.append(f"{key} x{result[key] / old[key]:.2f}")
+        print(f"  {name:20} {'  '.join(ratios)}")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the collector, writer, loader and renderer offline.")
+    parser.add_argument("--components", nargs="+", choices=COMPONENTS, default=list(COMPONENTS))
+    parser.add_argument("--hosts", type=int, default=4, help="synthetic servers and logs")
+    parser.add_argument("--hours", type=float, default=24 * 30, help="duration of every synthetic log")
+    parser.add_argument("--interval", type=float, default=5.0, help="seconds between probes in the synthetic logs")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="jittery", help="loss and jitter profile")
+    parser.add_argument("--log-format", choices=["text", "binary"], default="text", help="format of the synthetic logs")
+    parser.add_argument("--probes", type=int, default=5000, help="operations of the per probe benchmarks")
+    parser.add_argument("--jobs", type=int, help="worker processes of the parallel load, default one per cpu")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="where to write the JSON results, default benchmark-<commit>.json")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare with")
+    args = parser.parse_args(argv)
+
+    commit, dirty = git_commit()
+    results = {
+        "commit": commit,
+        "dirty": dirty,
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "parameters": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "components": {},
+    }
+    output = os.path.abspath(args.output or f"benchmark-{(commit or 'unknown')[:10]}.json")
+    previous_directory = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="statmonitor-benchmark-") as workdir:
+        # Server writes its logs into the working directory
+        os.chdir(workdir)
+        try:
+            for component in args.components:
+                started = time.perf_counter()
+                component_results = BENCHMARKS[component](args, workdir)
+                for name, result in component_results.items():
+                    results["components"][name] = result
+                    print(f"{name:20} {result['ops_per_sec'] or 0:12,.1f} ops/s  {result['items_per_sec'] or 0:14,.1f} "
+                          f"items/s  p50 {result['p50_ms']:9.3f} ms  p95 {result['p95_ms']:9.3f} ms  "
+                          f"p99 {result['p99_ms']:9.3f} ms  peak {result['peak_memory_kib'] or 0:10,.0f} KiB")
+                print(f"  ({component} took {time.perf_counter() - started:.1f}s)")
+        finally:
+            os.chdir(previous_directory)
+
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f"Results written to {output}")
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            compare(results, json.load(file))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,216 @@
+import argparse
+import functools
+import os
+import struct
+import sys
+
+import numpy as np
+
+from LogCompression import open_log, is_compressed
+
+# File layout: a 16 byte header followed by fixed width little endian records.
+# Version 2 records carry the round trip time of every answered echo, NaN padded to the rtt count of the file.
+# That count follows from the record size of the header, new logs get at least RECORD_RTTS.
+MAGIC = b"NSMLOG"
+VERSION = 2
+RECORD_RTTS = 8
+HEADER = struct.Struct("<6sHHHI")  # magic, version, record size, reserved, reserved
+RECORDS = {
+    1: struct.Struct("<dffff"),                    # time, avg, min, max, loss rate
+    2: struct.Struct(f"<dffff{RECORD_RTTS}f"),     # ... and the rtts
+}
+RECORD_DTYPES = {
+    1: np.dtype([("time", "<f8"), ("avg", "<f4"), ("min", "<f4"), ("max", "<f4"), ("loss", "<f4")]),
+    2: np.dtype([("time", "<f8"), ("avg", "<f4"), ("min", "<f4"), ("max", "<f4"), ("loss", "<f4"),
+                 ("rtts", "<f4", (RECORD_RTTS,))]),
+}
+RECORD = RECORDS[VERSION]
+RECORD_DTYPE = RECORD_DTYPES[VERSION]
+BINARY_SUFFIX = "_log.bin"
+TEXT_SUFFIX = "_log.txt"
+
+
+class BinaryLogError(ValueError):
+    pass
+
+
+@functools.lru_cache(maxsize=None)
+def record_struct(version=VERSION, rtt_count=RECORD_RTTS):
+    if version == 1:
+        return RECORDS[1]
+    return struct.Struct(f"<dffff{rtt_count}f")
+
+
+@functools.lru_cache(maxsize=None)
+def record_dtype(version=VERSION, rtt_count=RECORD_RTTS):
+    if version == 1:
+        return RECORD_DTYPES[1]
+    return np.dtype(RECORD_DTYPES[1].descr + [("rtts", "<f4", (rtt_count,))])
+
+
+def header_bytes(version=VERSION, rtt_count=RECORD_RTTS):
+    return HEADER.pack(MAGIC, version, record_struct(version, rtt_count).size, 0, 0)
+
+
+def pack_record(time_in_sec, avg_ping, min_ping, max_ping, loss_rate, rtts=(), version=VERSION, rtt_count=RECORD_RTTS):
+    if version == 1:
+        return RECORDS[1].pack(time_in_sec, avg_ping, min_ping, max_ping, loss_rate)
+    if len(rtts) > rtt_count:
+        raise BinaryLogError(f"{len(rtts)} rtts don't fit a record of {rtt_count}")
+    rtts = list(rtts) + [float("nan")] * (rtt_count - len(rtts))
+    return record_struct(2, rtt_count).pack(time_in_sec, avg_ping, min_ping, max_ping, loss_rate, *rtts)
+
+
+def is_binary_log(path):
+    try:
+        with open_log(path) as file:
+            return file.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def read_header(file):
+    # (version, rtt count) of the log, the rtt count of version 1 logs is 0
+    name = getattr(file, 'name', 'log')
+    data = file.read(HEADER.size)
+    if len(data) < HEADER.size:
+        raise BinaryLogError(f"{name}: truncated header")
+    magic, version, record_size, _, _ = HEADER.unpack(data)
+    if magic != MAGIC:
+        raise BinaryLogError(f"{name}: not a binary log")
+    base_size = RECORDS[1].size
+    if version == 1 and record_size == base_size:
+        return 1, 0
+    if version == 2 and record_size > base_size and (record_size - base_size) % 4 == 0:
+        return 2, (record_size - base_size) // 4
+    raise BinaryLogError(f"{name}: unsupported version {version} (record size {record_size})")
+
+
+def file_format(path):
+    # (version, rtt count) of an existing binary log, None if there is none yet that records could be appended to
+    try:
+        with open(path, 'rb') as file:
+            if not file.read(1):
+                return None
+            file.seek(0)
+            return read_header(file)
+    except OSError:
+        return None
+
+
+def read_records(path):
+    # memory maps the records as a read only structured array, a partially written last record is ignored.
+    # compressed logs are read into memory instead
+    if is_compressed(path):
+        with open_log(path) as file:
+            dtype = record_dtype(*read_header(file))
+            data = file.read()
+        return np.frombuffer(data, dtype=dtype, count=len(data) // dtype.itemsize)
+    with open(path, 'rb') as file:
+        dtype = record_dtype(*read_header(file))
+    count = (os.path.getsize(path) - HEADER.size) // dtype.itemsize
+    if count <= 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=HEADER.size, shape=(count,))
+
+
+def parse_text_line(line):
+    # (time, avg, min, max, loss rate, rtts), lines without the optional sixth field have no rtts
+    parts = line.strip().split(';')
+    if len(parts) not in (5, 6):
+        return None
+    try:
+        rtts = [float(rtt) for rtt in parts[5].split(',') if rtt] if len(parts) == 6 else []
+        return float(parts[0]), float(parts[1]), float(parts[2]), float(parts[3]), float(parts[4]), rtts
+    except ValueError:
+        return None
+
+
+def format_rtts(rtts):
+    return ",".join(str(np.float32(rtt)) for rtt in rtts if rtt == rtt)
+
+
+def format_value(value):
+    value = float(value)
+    if value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def format_float32(value):
+    # the shortest text that reads back as the same float32, whole numbers without a fraction like format_value
+    value = np.float32(value)
+    if float(value).is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def format_text_line(record):
+    # every value but the time is stored as float32, their shortest representation gives back the original text
+    line = (f"{float(record['time'])};{format_float32(record['avg'])};{format_float32(record['min'])};"
+            f"{format_float32(record['max'])};{str(np.float32(record['loss']))}")
+    if "rtts" in record.dtype.names:
+        rtts = format_rtts(record['rtts'])
+        if rtts:
+            line += ";" + rtts
+    return line
+
+
+def text_to_binary(source, destination):
+    # the records hold as many rtts as the longest line of the source, so none are lost
+    rtt_count = RECORD_RTTS
+    with open(source, 'r') as text_file:
+        for line in text_file:
+            values = parse_text_line(line)
+            if values is not None:
+                rtt_count = max(rtt_count, len(values[5]))
+    count = 0
+    with open(source, 'r') as text_file, open(destination, 'wb') as binary_file:
+        binary_file.write(header_bytes(VERSION, rtt_count))
+        for line in text_file:
+            values = parse_text_line(line)
+            if values is None:
+                continue
+            binary_file.write(pack_record(*values, rtt_count=rtt_count))
+            count += 1
+    return count
+
+
+def binary_to_text(source, destination):
+    records = read_records(source)
+    with open(destination, 'w') as text_file:
+        for record in records:
+            text_file.write(format_text_line(record) + '\n')
+    return len(records)
+
+
+def default_destination(source):
+    if source.endswith(TEXT_SUFFIX):
+        return source[:-len(TEXT_SUFFIX)] + BINARY_SUFFIX
+    if source.endswith(BINARY_SUFFIX):
+        return source[:-len(BINARY_SUFFIX)] + TEXT_SUFFIX
+    raise BinaryLogError(f"{source}: cannot derive the output name, pass it explicitly")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Convert between text (_log.txt) and binary (_log.bin) ping logs.")
+    parser.add_argument("direction", choices=["to-binary", "to-text"])
+    parser.add_argument("source")
+    parser.add_argument("destination", nargs="?")
+    args = parser.parse_args(argv)
+
+    try:
+        destination = args.destination or default_destination(args.source)
+        if args.direction == "to-binary":
+            count = text_to_binary(args.source, destination)
+        else:
+            count = binary_to_text(args.source, destination)
+    except (OSError, BinaryLogError) as e:
+        print(f"Conversion failed: {e}")
+        return 1
+    print(f"Converted {count} records: {args.source} -> {destination}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
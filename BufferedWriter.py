@@ -1,25 +1,192 @@
+import os
+import queue
+import threading
+import time
+
+from Profiler import PROFILER
+
+FLUSH_CHECK_INTERVAL_IN_SEC = 1.0
+
+
+class FlushThread:
+    # The one background thread that does the disk I/O of every BufferedWriter.
+    # Chunks are written in the order they were handed over, so lines of a file never get reordered.
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.writers = []
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, name="buffered-writer")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def register(self, writer):
+        with self.lock:
+            self.writers.append(writer)
+
+    def unregister(self, writer):
+        with self.lock:
+            if writer in self.writers:
+                self.writers.remove(writer)
+
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    def submit(self, writer, data, done=None, closing=False):
+        self.queue.put((writer, data, done, closing))
+
+    def run(self):
+        # a failing chunk or writer is reported and skipped, the thread keeps serving every other writer
+        # and whoever waits for a flush is always released
+        while True:
+            try:
+                writer, data, done, closing = self.queue.get(timeout=FLUSH_CHECK_INTERVAL_IN_SEC)
+            except queue.Empty:
+                pass
+            else:
+                try:
+                    writer.write_to_disk(data, force_sync=done is not None, closing=closing)
+                except Exception as e:
+                    print(f"[Buffered Writer] writing {writer.filename} failed with error: {e}")
+                finally:
+                    if done is not None:
+                        done.set()
+
+            # age based flushes and batched fsyncs
+            now = time.monotonic()
+            with self.lock:
+                writers = list(self.writers)
+            for writer in writers:
+                try:
+                    writer.check_age(now)
+                    writer.sync_if_due(now)
+                except Exception as e:
+                    print(f"[Buffered Writer] flushing {writer.filename} failed with error: {e}")
+
+
+_flush_thread = None
+_flush_thread_lock = threading.Lock()
+
+
+def get_flush_thread():
+    global _flush_thread
+    with _flush_thread_lock:
+        if _flush_thread is None:
+            _flush_thread = FlushThread()
+        return _flush_thread
+
 
 class BufferedWriter:
-    def __init__(self, filename, buffer_size=1024 * 1024):
+    # write() only appends to a buffer under a lock, full or old buffers are handed to the FlushThread.
+    # max_age (seconds) bounds how long a line may wait in the buffer, fsync_interval (seconds) enables
+    # fsync batching: at most one fsync per interval, plus one on every explicit flush()/close().
+    # In binary mode write() takes bytes records as they are, header is written first into an empty file.
+    def __init__(self, filename, buffer_size=1024 * 1024, max_age=None, fsync_interval=None, binary=False, header=None):
         self.filename = filename
+        self.binary = binary
+        self.header = header
         self.buffer_size = buffer_size
+        self.max_age = max_age
+        self.fsync_interval = fsync_interval
         self.buffer = []
         self.current_buffer_size = 0
+        self.oldest_line_time = None
+        self.lock = threading.Lock()
+        # only touched by the FlushThread
+        self.file = None
+        self.unsynced = False
+        self.last_sync_time = time.monotonic()
+        # statistics of the chunks that reached the file
+        self.flush_count = 0
+        self.flushed_bytes = 0
+        self.flush_seconds = 0.0
+        self.flush_thread = get_flush_thread()
+        self.flush_thread.register(self)
 
     def write(self, line):
-        line += '\n'
-        self.buffer.append(line)
-        self.current_buffer_size += len(line)
-        if self.current_buffer_size >= self.buffer_size:
-            self.flush()
+        if not self.binary:
+            line += '\n'
+        with self.lock:
+            if self.oldest_line_time is None:
+                self.oldest_line_time = time.monotonic()
+            self.buffer.append(line)
+            self.current_buffer_size += len(line)
+            if self.current_buffer_size >= self.buffer_size:
+                self.hand_over()
 
-    def flush(self):
-        print("[Buffered Writer] flushed "+self.filename)
-        with open(self.filename, 'a') as file:
-            file.write(''.join(self.buffer))
+    def hand_over(self, done=None, closing=False):
+        # called with the lock held, so chunks reach the queue in the order they were written
+        try:
+            data = (b'' if self.binary else '').join(self.buffer)
+        except TypeError:
+            # a line of the wrong type would fail every later flush as well, so it's reported and dropped
+            kind = (bytes, bytearray) if self.binary else str
+            print(f"[Buffered Writer] dropping lines of the wrong type written to {self.filename}")
+            data = (b'' if self.binary else '').join(line for line in self.buffer if isinstance(line, kind))
         self.buffer = []
         self.current_buffer_size = 0
+        self.oldest_line_time = None
+        self.flush_thread.submit(self, data, done, closing)
+
+    def flush(self):
+        # blocks until everything written so far reached the file
+        done = threading.Event()
+        with self.lock:
+            self.hand_over(done)
+        done.wait()
 
     def close(self):
-        if self.buffer:
-            self.flush()
\ No newline at end of file
+        done = threading.Event()
+        with self.lock:
+            self.hand_over(done, closing=True)
+        done.wait()
+        self.flush_thread.unregister(self)
+
+    def check_age(self, now):
+        if self.max_age is None:
+            return
+        with self.lock:
+            if self.oldest_line_time is not None and now - self.oldest_line_time >= self.max_age:
+                self.hand_over()
+
+    def write_to_disk(self, data, force_sync=False, closing=False):
+        started = time.perf_counter()
+        try:
+            if data:
+                if self.file is None:
+                    self.file = open(self.filename, 'ab' if self.binary else 'a')
+                    if self.header is not None and self.file.tell() == 0:
+                        self.file.write(self.header)
+                self.file.write(data)
+                self.file.flush()
+                self.unsynced = True
+                self.flush_count += 1
+                self.flushed_bytes += len(data)
+            if force_sync:
+                self.sync()
+        except OSError as e:
+            print(f"[Buffered Writer] writing {self.filename} failed with error: {e}")
+        finally:
+            # a closed writer never keeps its file open, whatever went wrong before
+            if closing and self.file is not None:
+                try:
+                    self.file.close()
+                except OSError as e:
+                    print(f"[Buffered Writer] closing {self.filename} failed with error: {e}")
+                self.file = None
+            elapsed = time.perf_counter() - started
+            self.flush_seconds += elapsed
+            if PROFILER.enabled:
+                PROFILER.record("flush", elapsed)
+
+    def sync_if_due(self, now):
+        if self.fsync_interval is not None and now - self.last_sync_time >= self.fsync_interval:
+            try:
+                self.sync()
+            except OSError as e:
+                print(f"[Buffered Writer] syncing {self.filename} failed with error: {e}")
+
+    def sync(self):
+        if self.fsync_interval is not None and self.unsynced and self.file is not None:
+            os.fsync(self.file.fileno())
+            self.unsynced = False
+        self.last_sync_time = time.monotonic()
@@ -0,0 +1,196 @@
+import argparse
+import os
+import signal
+import sys
+import threading
+
+from AdaptiveCadence import AdaptiveCadence
+from BufferedWriter import get_flush_thread
+from LogCompression import available_methods
+from MetricsExporter import MetricsExporter
+from Server import Server
+from SharedSamples import SharedSamplesPublisher, SharedSamplesError, DEFAULT_NAME
+from ProbeScheduler import ProbeScheduler
+from Profiler import PROFILER
+from QueryServer import QueryServer
+
+# The probing side of the monitor: reads servers.txt, probes every server and writes the logs.
+# Nothing in here imports Qt, so it also runs as a headless daemon (python Collector.py) on boxes without a display.
+
+PING_PLOT_ELEMENT_COUNT = 400
+# probe cycles in flight at once. a cycle lasts about amt_of_pings seconds, so this bounds the probes per second
+PROBE_CONCURRENCY = 512
+SHUTDOWN_TIMEOUT_IN_SEC = 10.0
+SERVERS = []
+SCHEDULER = ProbeScheduler(PROBE_CONCURRENCY)
+LOG_FORMAT = "text"
+# keyword arguments of the AdaptiveCadence of every server, None probes every server at its fixed delay
+CADENCE = None
+# keyword arguments of the PartitionedWriter of every server, None writes one log file per server
+PARTITIONS = None
+# the SharedSamplesPublisher, if the samples are published to other processes
+SHARED_SAMPLES = None
+
+
+# Validates whether a line follows the format: STRING;STRING;STRING;Number.
+def is_valid_server_entry(line):
+
+    parts = line.strip().split(';')
+    if len(parts) != 4:
+        return False
+    if not all(isinstance(part, str) for part in parts[:-1]):
+        return False
+    if not parts[-1].isdigit():
+        return False
+    return True
+
+
+def add_server(line):
+    print(f"Adding server: {line}")
+    parts = line.strip().split(';')
+    cadence = AdaptiveCadence(int(parts[3]), **CADENCE) if CADENCE is not None else None
+    server = Server(parts[0], parts[1], parts[2], "", int(parts[3]), PING_PLOT_ELEMENT_COUNT, log_format=LOG_FORMAT,
+                    cadence=cadence, partitions=PARTITIONS)
+    SERVERS.append(server)
+    SCHEDULER.add_server(server)
+
+
+def set_default_servers(servers_file='servers.txt'):
+    default_servers = [
+        "google.com;google.com;#FF0000;5",
+    ]
+    with open(servers_file, 'w') as f:
+        for server in default_servers:
+            f.write(server + '\n')
+    print("Default servers set.")
+
+
+def process_servers_file(servers_file='servers.txt'):
+    try:
+        if os.path.exists(servers_file):
+            with open(servers_file, 'r') as f:
+                for line in f:
+                    if is_valid_server_entry(line):
+                        add_server(line)
+                    else:
+                        print(f"Invalid server entry: {line}")
+        else:
+            set_default_servers(servers_file)
+    except Exception as e:
+        print(f"Encountered an error: {e}")
+        set_default_servers(servers_file)
+
+
+def publish_samples(name):
+    # the latest PING_PLOT_ELEMENT_COUNT samples of every server go to the shared memory segment name,
+    # returns False if another running process publishes under that name
+    global SHARED_SAMPLES
+    try:
+        SHARED_SAMPLES = SharedSamplesPublisher(SERVERS, PING_PLOT_ELEMENT_COUNT, name)
+    except SharedSamplesError as e:
+        print(f"Not publishing samples: {e}")
+        return False
+    print(f"Publishing samples to shared memory {name}")
+    return True
+
+
+def shutdown(timeout=None):
+    # stops probing and gets every buffered line onto the disk
+    SCHEDULER.stop(timeout)
+    for server in SERVERS:
+        server.writer.close()
+    if SHARED_SAMPLES is not None:
+        SHARED_SAMPLES.close()
+
+
+def main(argv):
+    global LOG_FORMAT, CADENCE, PARTITIONS
+    parser = argparse.ArgumentParser(description="Probe the servers of servers.txt and write their logs, without a GUI.")
+    parser.add_argument("--servers", default="servers.txt", help="server list, one IP;NAME;COLOR;DELAY per line")
+    parser.add_argument("--log-format", choices=["text", "binary"], default="text", help="format of new log files")
+    parser.add_argument("--query-port", type=int, help="serve the query API and /metrics on localhost at this port")
+    parser.add_argument("--query-socket", help="serve the query API on this unix socket")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="back off on healthy servers and probe in bursts when loss or ping deviate")
+    parser.add_argument("--max-delay", type=float, help="longest delay of a healthy server, default 4x its delay")
+    parser.add_argument("--burst-delay", type=float, default=1.0, help="delay while bursting")
+    parser.add_argument("--burst-duration", type=float, default=60.0, help="seconds a burst lasts after a deviation")
+    parser.add_argument("--burst-interval", type=float, default=0.2,
+                        help="seconds between the echo requests of a cycle while bursting")
+    parser.add_argument("--burst-pings", type=int, help="echo requests of a cycle while bursting, default the usual")
+    parser.add_argument("--max-failed-cycles", type=int, default=5,
+                        help="cycles without any answer that still burst, later ones back off until a host answers")
+    parser.add_argument("--max-pps", type=float, help="echo requests per second of all servers together")
+    parser.add_argument("--concurrency", type=int, default=PROBE_CONCURRENCY,
+                        help="probe cycles in flight at once (ping processes, if the ping binary is used)")
+    parser.add_argument("--partition", choices=["month", "day"],
+                        help="write one log file per month or day into a directory per server")
+    parser.add_argument("--compress", choices=available_methods() + ["none"], default="gzip",
+                        help="compression of closed partitions")
+    parser.add_argument("--retention-days", type=int, help="delete partitions that ended more than this many days ago")
+    parser.add_argument("--shared-memory", nargs="?", const=DEFAULT_NAME, metavar="NAME",
+                        help="publish the latest samples in a shared memory segment for local viewers")
+    parser.add_argument("--profile", action="store_true",
+                        help="time the hot stages, SIGUSR1 writes a summary (like STATMONITOR_PROFILE=1)")
+    parser.add_argument("--profile-window", type=float,
+                        help="seconds of stack samples taken after every summary, 0 takes none")
+    # cProfile only sees the thread it's enabled on, only main.py runs it (on its gui thread)
+    parser.add_argument("--profile-mode", choices=["sample"], help="stack samples of every thread")
+    args = parser.parse_args(argv)
+    LOG_FORMAT = args.log_format
+    PROFILER.configure(enabled=True if args.profile else None, window=args.profile_window, mode=args.profile_mode)
+    if PROFILER.mode != "sample":
+        print(f"[Profiler] mode {PROFILER.mode} isn't available in the collector, sampling stacks instead")
+        PROFILER.configure(mode="sample")
+    if PROFILER.enabled:
+        PROFILER.install_signal_handler()
+    if args.partition is not None:
+        PARTITIONS = {"granularity": args.partition, "compression": None if args.compress == "none" else args.compress,
+                      "retention_days": args.retention_days}
+    if args.adaptive:
+        CADENCE = {"max_delay": args.max_delay, "burst_delay": args.burst_delay, "burst_duration": args.burst_duration,
+                   "burst_interval": args.burst_interval, "burst_pings": args.burst_pings,
+                   "max_failed_cycles": args.max_failed_cycles}
+    SCHEDULER.set_packet_budget(args.max_pps)
+    SCHEDULER.concurrency = max(1, args.concurrency)
+
+    stop_requested = threading.Event()
+
+    def request_stop(signum, frame):
+        stop_requested.set()
+
+    for name in ("SIGINT", "SIGTERM", "SIGHUP", "SIGBREAK"):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), request_stop)
+
+    process_servers_file(args.servers)
+    if not SERVERS:
+        print("No servers to probe")
+        return 1
+    if args.shared_memory is not None:
+        if not publish_samples(args.shared_memory):
+            return 1
+    query_server = None
+    if args.query_port is not None or args.query_socket is not None:
+        query_server = QueryServer(SERVERS, port=args.query_port, unix_path=args.query_socket)
+        query_server.add_route("/metrics", MetricsExporter(SERVERS, SCHEDULER, get_flush_thread()).handle_metrics)
+        try:
+            query_server.start()
+            print(f"Query API listening on {query_server.address()}")
+        except OSError as e:
+            print(e)
+            return 1
+    SCHEDULER.start()
+    print(f"Probing {len(SERVERS)} servers")
+    # a timeout keeps the main thread responsive to signals on every platform
+    while not stop_requested.wait(1.0):
+        pass
+    print("Shutdown signal received")
+    if query_server is not None:
+        query_server.stop()
+    shutdown(SHUTDOWN_TIMEOUT_IN_SEC)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,64 @@
+import threading
+
+import numpy as np
+import psutil
+
+DEFAULT_INTERVAL_IN_SEC = 0.1
+DEFAULT_STABILITY = 0.92
+
+
+class CpuSampler:
+    # Samples the utilization (%) of every core on a background thread and keeps a rolling average:
+    # average = stability * average + (1 - stability) * sample, computed for all cores at once.
+    # Every update publishes a new read only array instead of changing the old one, so a reader always
+    # gets a complete sample from latest. history_length > 0 also keeps the last averages of every core.
+    def __init__(self, interval=DEFAULT_INTERVAL_IN_SEC, stability=DEFAULT_STABILITY, history_length=0):
+        self.interval = interval
+        self.stability = stability
+        self.history_length = history_length
+        self.latest = np.zeros(0)
+        self.sequence = 0  # incremented with every published average
+        self.history = None
+        self.history_count = 0
+        self.history_lock = threading.Lock()
+        self.stop_requested = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="cpu-sampler")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stop_requested.set()
+
+    def run(self):
+        # the first call only starts psutil's measurement, like before it seeds the average
+        self.publish(np.array(psutil.cpu_percent(percpu=True), dtype=np.float64))
+        while not self.stop_requested.wait(self.interval):
+            sample = np.array(psutil.cpu_percent(percpu=True), dtype=np.float64)
+            average = self.latest
+            if len(average) == len(sample):
+                sample = self.stability * average + (1 - self.stability) * sample
+            self.publish(sample)
+
+    def publish(self, average):
+        average.setflags(write=False)
+        if self.history_length > 0:
+            with self.history_lock:
+                if self.history is None or self.history.shape[1] != len(average):
+                    self.history = np.zeros((self.history_length, len(average)))
+                    self.history_count = 0
+                self.history[self.history_count % self.history_length] = average
+                self.history_count += 1
+        self.latest = average
+        self.sequence += 1
+
+    def history_view(self):
+        # copy of the kept averages, oldest first, shape (samples, cores)
+        with self.history_lock:
+            if self.history is None:
+                return np.zeros((0, len(self.latest)))
+            if self.history_count <= self.history_length:
+                return self.history[:self.history_count].copy()
+            return np.roll(self.history, -(self.history_count % self.history_length), axis=0)
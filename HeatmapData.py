@@ -0,0 +1,905 @@
+import json
+import multiprocessing
+import os
+import re
+import threading
+import time
+import warnings
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import BinaryLog
+from LogCompression import open_log, is_compressed
+from PartitionedLog import list_partitions, is_partition_directory
+from RttSketch import SketchColumn, bucket_indices, BUCKET_COUNT
+
+pattern = re.compile(r'.*_log\.(txt|bin)$')
+LOAD_CHUNK_LINES = 1 << 16
+LOAD_CHUNK_BYTES = 4 << 20
+ROLLUP_SUFFIX = ".rollup.npz"
+ROLLUP_VERSION = 2
+EPOCH = datetime(1970, 1, 1)
+PERCENTILES = (0.5, 0.95, 0.99)
+NO_KEYS = np.empty(0, dtype=np.int64)
+
+logs = {}
+
+class LogData:
+    # Only the file name is known up front, the hours are loaded (from the rollup cache) on first access
+    # and the Day/Hour objects of a month are only created when the month is looked at.
+    def __init__(self, filename):
+        self.filename = filename
+        self.hours = None  # (keys, average jitters, average packetloss rates, amounts of data points) in file order
+        self.sketches = None  # SketchColumn with the rtts of every hour
+        self.month_hours = {}  # (year, month) -> (hours, sketches) of the months looked at, until they're unloaded
+        self.loaded_years = None
+        self.rollup = None  # kept by follow() to continue parsing where it stopped
+        self.lock = threading.Lock()
+
+    @property
+    def years(self):
+        self.ensure_loaded()
+        return self.loaded_years
+
+    @property
+    def is_loaded(self):
+        return self.loaded_years is not None
+
+    def ensure_loaded(self):
+        with self.lock:
+            if self.loaded_years is None:
+                self.set_hours(*read_log_hours(self.filename))
+
+    def apply_loaded(self, hours, sketch_arrays):
+        # takes the result of read_log_hours from a worker process, unless the log got loaded meanwhile
+        with self.lock:
+            if self.loaded_years is None:
+                self.set_hours(hours, sketch_arrays)
+
+    def set_hours(self, hours, sketch_arrays):
+        # called with the lock held
+        self.hours = hours
+        self.sketches = SketchColumn(*sketch_arrays)
+        months_since_epoch, _, _ = hour_key_fields(self.hours[0])
+        self.loaded_years = add_months(self, {}, np.unique(months_since_epoch).tolist())
+
+    def follow(self):
+        # parses what was appended to the log since it was loaded, returns the keys of the hours that changed
+        with self.lock:
+            if self.loaded_years is None:
+                return NO_KEYS
+            try:
+                stat = os.stat(self.filename)
+            except OSError:
+                return NO_KEYS
+            if self.rollup is None:
+                self.rollup = HourRollup.load(self.filename + ROLLUP_SUFFIX)
+            if self.rollup is not None and self.rollup.file_id == [stat.st_ino, stat.st_size, stat.st_mtime_ns]:
+                return NO_KEYS
+            self.rollup, tail_hours, tail_sketches = load_rollup(self.filename, rollup=self.rollup)
+            rollup_hours = (self.rollup.keys, self.rollup.average_jitters, self.rollup.average_packetloss_rates,
+                            self.rollup.amounts_of_data_points)
+            hours = tuple(np.concatenate(pair) for pair in zip(rollup_hours, tail_hours))
+            changed = changed_keys(self.hours, hours)
+            self.hours = hours
+            self.sketches = self.rollup.sketches.concatenate(tail_sketches)
+            months_since_epoch, _, _ = hour_key_fields(changed)
+            changed_months = np.unique(months_since_epoch).tolist()
+            for month_since_epoch in changed_months:
+                self.month_hours.pop((1970 + month_since_epoch // 12, month_since_epoch % 12 + 1), None)
+            self.loaded_years = add_months(self, self.loaded_years, changed_months)
+            return changed
+
+    def hours_for(self, year, month=None):
+        # (hours, sketches) that contain every hour of the year or month, in file order.
+        # the hours of a month are a copy cut out of the whole log, kept until the month is unloaded
+        self.ensure_loaded()
+        with self.lock:
+            if month is None:
+                return self.hours, self.sketches
+            if (year, month) not in self.month_hours:
+                keys = self.hours[0]
+                first_key = (datetime(year, month, 1) - EPOCH) // timedelta(hours=1)
+                end_key = (datetime(year + month // 12, month % 12 + 1, 1) - EPOCH) // timedelta(hours=1)
+                indices = np.flatnonzero((keys >= first_key) & (keys < end_key))
+                self.month_hours[year, month] = (tuple(column[indices] for column in self.hours),
+                                                 self.sketches.take(indices))
+            return self.month_hours[year, month]
+
+    def unload_month(self, year, month):
+        with self.lock:
+            self.month_hours.pop((year, month), None)
+
+class PartitionedLogData:
+    # A directory of month or day partitions written by a PartitionedWriter. The years and months with data are
+    # known from the file names, the hours of a month are only read from its own partitions when it is looked at.
+    def __init__(self, directory):
+        self.filename = directory
+        self.loaded_years = None
+        self.month_hours = {}  # (year, month) -> (hours, sketches)
+        self.rollups = {}  # path -> HourRollup of the partitions read so far
+        self.followed = None  # path, size and mtime of the newest partition when follow() looked at it
+        self.lock = threading.Lock()
+
+    @property
+    def years(self):
+        self.ensure_loaded()
+        return self.loaded_years
+
+    @property
+    def is_loaded(self):
+        return self.loaded_years is not None
+
+    def ensure_loaded(self):
+        with self.lock:
+            if self.loaded_years is not None:
+                return
+            partitions = list_partitions(self.filename)
+            self.loaded_years = add_months(self, {}, [(p.year - 1970) * 12 + p.month - 1 for p in partitions])
+
+    def hours_for(self, year, month=None):
+        loaded = [self.load_month(year, month) for month in ([month] if month is not None else range(1, 13))]
+        return concatenate_hours(loaded)
+
+    def load_month(self, year, month):
+        with self.lock:
+            if (year, month) not in self.month_hours:
+                self.month_hours[year, month] = self.read_month(year, month, list_partitions(self.filename))
+            return self.month_hours[year, month]
+
+    def read_month(self, year, month, partitions):
+        # called with the lock held
+        loaded = []
+        for partition in partitions:
+            if partition.year != year or partition.month != month:
+                continue
+            rollup, tail_hours, tail_sketches = load_rollup(partition.path, rollup=self.rollups.get(partition.path))
+            self.rollups[partition.path] = rollup
+            loaded.append(((rollup.keys, rollup.average_jitters, rollup.average_packetloss_rates,
+                            rollup.amounts_of_data_points), rollup.sketches))
+            loaded.append((tail_hours, tail_sketches))
+            # nothing is appended to a partition once a newer one exists, so its last hour is complete
+            if partition is not partitions[-1] and rollup.partial_hour is not None:
+                loaded.append(close_partial_hour(rollup.partial_hour))
+        return concatenate_hours(loaded)
+
+    def follow(self):
+        # rereads the loaded months of the two newest partitions (the one written to and the one closed last)
+        # once the newest partition changed, the rollups make that parse only what was appended
+        with self.lock:
+            if self.loaded_years is None:
+                return NO_KEYS
+            partitions = list_partitions(self.filename)
+            if not partitions:
+                return NO_KEYS
+            try:
+                stat = os.stat(partitions[-1].path)
+            except OSError:
+                return NO_KEYS
+            followed = (partitions[-1].path, stat.st_size, stat.st_mtime_ns)
+            if followed == self.followed:
+                return NO_KEYS
+            self.followed = followed
+            # compressed and removed partitions are gone under their old paths
+            paths = {partition.path for partition in partitions}
+            self.rollups = {path: rollup for path, rollup in self.rollups.items() if path in paths}
+            self.loaded_years = add_months(self, self.loaded_years,
+                                           [(p.year - 1970) * 12 + p.month - 1 for p in partitions[-2:]])
+            changed = [NO_KEYS]
+            for year, month in {(partition.year, partition.month) for partition in partitions[-2:]}:
+                if (year, month) in self.month_hours:
+                    hours = self.read_month(year, month, partitions)
+                    changed.append(changed_keys(self.month_hours[year, month][0], hours[0]))
+                    self.month_hours[year, month] = hours
+            return np.concatenate(changed)
+
+    def unload_month(self, year, month):
+        with self.lock:
+            self.month_hours.pop((year, month), None)
+
+def add_months(log, years, months_since_epoch):
+    # marks the months as having data, returns years or a copy of it with the new years
+    for month_since_epoch in months_since_epoch:
+        year, month = 1970 + month_since_epoch // 12, month_since_epoch % 12 + 1
+        if year not in years:
+            # a copy, so threads iterating over the years never see it change
+            years = dict(years)
+            years[year] = Year(year, log)
+        years[year].months[month].has_data = True
+    return years
+
+def changed_keys(old_hours, new_hours):
+    # the keys of the hours from the first position where the hours differ on. hours are only ever appended,
+    # apart from those closed by an unterminated last line, which are replaced once the line is complete
+    count = min(len(old_hours[0]), len(new_hours[0]))
+    differs = np.zeros(count, dtype=bool)
+    for old, new in zip(old_hours, new_hours):
+        differs |= old[:count] != new[:count]
+    first = np.flatnonzero(differs)
+    start = int(first[0]) if len(first) else count
+    return np.union1d(old_hours[0][start:], new_hours[0][start:])
+
+def follow_log(log, month_images=None):
+    # takes the new lines of a log into its Hour objects and the cached images of its months,
+    # returns the (year, month) of the months that changed
+    keys = log.follow()
+    months_since_epoch, _, _ = hour_key_fields(keys)
+    changed = []
+    for month_since_epoch in np.unique(months_since_epoch).tolist():
+        year, month = 1970 + month_since_epoch // 12, month_since_epoch % 12 + 1
+        month_keys = keys[months_since_epoch == month_since_epoch]
+        month_data = log.years[year].months[month]
+        month_data.refresh_hours(month_keys)
+        if month_images is not None:
+            month_images.refresh(log, month_data, month_keys)
+        changed.append((year, month))
+    return changed
+
+class Year:
+    def __init__(self, year, log=None):
+        self.year = year
+        self.log = log
+        self.months = {
+            1: Month(31, log, year, 1),
+            2: Month(29 if self.is_leap_year() else 28, log, year, 2),
+            3: Month(31, log, year, 3),
+            4: Month(30, log, year, 4),
+            5: Month(31, log, year, 5),
+            6: Month(30, log, year, 6),
+            7: Month(31, log, year, 7),
+            8: Month(31, log, year, 8),
+            9: Month(30, log, year, 9),
+            10: Month(31, log, year, 10),
+            11: Month(30, log, year, 11),
+            12: Month(31, log, year, 12)
+        }
+
+    def is_leap_year(self):
+        return self.year % 4 == 0 and (self.year % 100 != 0 or self.year % 400 == 0)
+
+    def create_month_images(self):
+        # renders all twelve months in one go, returns {month: image}
+        dense = dense_hours(self.log.hours_for(self.year)[0] if self.log is not None else None, self.year)
+        images = Month.colorize(Month.score_hours(*dense))
+        return {month: images[month - 1, :data.amt_of_days].transpose(1, 0, 2) for month, data in self.months.items()}
+
+class Month:
+    def __init__(self, days, log=None, year=None, month=None):
+        self.amt_of_days = days
+        self.log = log
+        self.year = year
+        self.month = month
+        self.has_data = False
+        self.loaded_days = None
+
+    @property
+    def days(self):
+        days = self.loaded_days
+        if days is None:
+            days = self.load_days()
+        return days
+
+    def load_days(self):
+        days = {}
+        if self.log is not None and self.has_data:
+            (keys, average_jitters, average_packetloss_rates, amounts_of_data_points), sketches = \
+                self.log.hours_for(self.year, self.month)
+            first_key = (datetime(self.year, self.month, 1) - EPOCH) // timedelta(hours=1)
+            # later hours with the same key replace earlier ones, like they did when the log was read line by line
+            for index in np.flatnonzero((keys >= first_key) & (keys < first_key + self.amt_of_days * 24)).tolist():
+                day, hour = divmod(int(keys[index]) - first_key, 24)
+                if day + 1 not in days:
+                    days[day + 1] = Day()
+                days[day + 1].hours[hour] = create_hour(index, average_jitters, average_packetloss_rates,
+                                                        amounts_of_data_points, sketches)
+        self.loaded_days = days
+        return days
+
+    def refresh_hours(self, keys):
+        # replaces the Hour objects of the given hour keys, if the days are loaded at all
+        days = self.loaded_days
+        if days is None or self.log is None:
+            return
+        (all_keys, average_jitters, average_packetloss_rates, amounts_of_data_points), sketches = \
+            self.log.hours_for(self.year, self.month)
+        first_key = (datetime(self.year, self.month, 1) - EPOCH) // timedelta(hours=1)
+        for key in keys.tolist():
+            day, hour = divmod(key - first_key, 24)
+            if not 0 <= day < self.amt_of_days:
+                continue
+            indices = np.flatnonzero(all_keys == key)
+            if len(indices) == 0:
+                if day + 1 in days:
+                    days[day + 1].hours.pop(hour, None)
+                continue
+            if day + 1 not in days:
+                days[day + 1] = Day()
+            days[day + 1].hours[hour] = create_hour(int(indices[-1]), average_jitters, average_packetloss_rates,
+                                                    amounts_of_data_points, sketches)
+
+    def unload(self):
+        self.loaded_days = None
+        if self.log is not None:
+            self.log.unload_month(self.year, self.month)
+
+    def dense_hours(self):
+        # (jitter, packetloss, amount of data points, valid) arrays of shape (32, 24), indexed by [day, hour]
+        hours = self.log.hours_for(self.year, self.month)[0] if self.log is not None and self.has_data else None
+        dense = dense_hours(hours, self.year, self.month)
+        return tuple(array[0] for array in dense)
+
+    def create_month_image(self):
+        # image[hour, i] shows the day with key i, just like the hover info looks it up
+        image = self.colorize(self.score_hours(*self.dense_hours()))
+        return image[:self.amt_of_days].transpose(1, 0, 2)
+
+    @staticmethod
+    def score_hour(hour):
+        if hour.amount_of_data_points < 50:
+            return -1
+        if hour.average_packetloss_rate == 0 and hour.average_jitter < 1.0:
+            return 0
+        return ((hour.average_jitter / 12) * 100) + ((hour.average_packetloss_rate / 0.05) * 100)   # return min((hour.average_jitter / 20) * 100 + (hour.average_packetloss_rate / 0.1) * 100, 100)
+
+    @staticmethod
+    def score_hours(jitter, packetloss, amounts_of_data_points, valid):
+        # score_hour for whole arrays, hours without data score -1 as well
+        scores = ((jitter / 12) * 100) + ((packetloss / 0.05) * 100)
+        scores = np.where((packetloss == 0) & (jitter < 1.0), 0.0, scores)
+        return np.where(~valid | (amounts_of_data_points < 50), -1.0, scores)
+
+    @staticmethod
+    def colorize(scores):
+        # black without enough data, green for a perfect hour, green to red with growing scores
+        multiplier = np.clip(scores, 0, 100)
+        image = np.empty(scores.shape + (4,), dtype=np.uint8)
+        image[..., 0] = (multiplier * 2.55).astype(np.uint8)
+        image[..., 1] = (220 - (2.2 * multiplier)).astype(np.uint8)
+        image[..., 2] = 0
+        image[..., 3] = 255
+        image[scores == 0] = [0, 255, 0, 255]
+        image[scores == -1] = [0, 0, 0, 255]
+        return image
+
+class MonthImageCache:
+    # size bounded LRU of rendered month images, a month whose image is evicted also drops its Day/Hour objects
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.images = OrderedDict()
+        self.lock = threading.Lock()
+
+    def refresh(self, log, month_data, keys):
+        # recolors the pixels of the given hour keys in the cached image of the month, if there is one
+        with self.lock:
+            entry = self.images.get((log.filename, month_data.year, month_data.month))
+        if entry is None:
+            return
+        image = entry[0]
+        (all_keys, average_jitters, average_packetloss_rates, amounts), _ = log.hours_for(month_data.year, month_data.month)
+        jitter = np.zeros(len(keys))
+        packetloss = np.zeros(len(keys))
+        amounts_of_data_points = np.zeros(len(keys), dtype=np.int64)
+        valid = np.zeros(len(keys), dtype=bool)
+        for position, key in enumerate(keys.tolist()):
+            indices = np.flatnonzero(all_keys == key)
+            if len(indices):
+                index = indices[-1]
+                jitter[position] = average_jitters[index]
+                packetloss[position] = average_packetloss_rates[index]
+                amounts_of_data_points[position] = amounts[index]
+                valid[position] = True
+        colors = Month.colorize(Month.score_hours(jitter, packetloss, amounts_of_data_points, valid))
+        _, day_of_month, hour_of_day = hour_key_fields(keys)
+        # like create_month_image, column i of the image is the day with key i
+        inside = day_of_month < month_data.amt_of_days
+        image[hour_of_day[inside], day_of_month[inside]] = colors[inside]
+
+    def get(self, log, year, month):
+        key = (log.filename, year, month)
+        with self.lock:
+            if key in self.images:
+                self.images.move_to_end(key)
+                return self.images[key][0]
+        month_data = log.years[year].months[month]
+        image = month_data.create_month_image()
+        with self.lock:
+            self.images[key] = (image, month_data)
+            self.images.move_to_end(key)
+            while len(self.images) > self.capacity:
+                _, (_, evicted_month) = self.images.popitem(last=False)
+                if evicted_month is not month_data:
+                    evicted_month.unload()
+        return image
+
+def hour_key_fields(keys):
+    # (months since the epoch, day of the month, hour of the day) of local hour keys
+    hours = keys.astype('datetime64[h]')
+    days = hours.astype('datetime64[D]')
+    months = days.astype('datetime64[M]')
+    day_of_month = (days - months.astype('datetime64[D]')).astype(np.int64) + 1
+    hour_of_day = (hours - days.astype('datetime64[h]')).astype(np.int64)
+    return months.astype(np.int64), day_of_month, hour_of_day
+
+
+def dense_hours(hours, year, month=None):
+    # scatters the hours of one month (or all months of a year) into arrays of shape (months, 32, 24):
+    # jitter, packetloss, amount of data points and whether the hour has data at all
+    month_count = 12 if month is None else 1
+    jitter = np.zeros((month_count, 32, 24))
+    packetloss = np.zeros((month_count, 32, 24))
+    amounts_of_data_points = np.zeros((month_count, 32, 24), dtype=np.int64)
+    valid = np.zeros((month_count, 32, 24), dtype=bool)
+    if hours is None or len(hours[0]) == 0:
+        return jitter, packetloss, amounts_of_data_points, valid
+
+    keys, average_jitters, average_packetloss_rates, amounts = hours
+    months_since_epoch, day_of_month, hour_of_day = hour_key_fields(keys)
+    first_month = (year - 1970) * 12 + (0 if month is None else month - 1)
+    month_index = months_since_epoch - first_month
+    selected = np.flatnonzero((month_index >= 0) & (month_index < month_count))
+    # a later hour with the same key replaces an earlier one
+    cells = (month_index[selected] * 32 + day_of_month[selected]) * 24 + hour_of_day[selected]
+    _, last = np.unique(cells[::-1], return_index=True)
+    selected = selected[len(selected) - 1 - last]
+    index = (month_index[selected], day_of_month[selected], hour_of_day[selected])
+    jitter[index] = average_jitters[selected]
+    packetloss[index] = average_packetloss_rates[selected]
+    amounts_of_data_points[index] = amounts[selected]
+    valid[index] = True
+    return jitter, packetloss, amounts_of_data_points, valid
+
+
+def create_month_images(log_list, year, month):
+    # renders the same month of many logs in one go, returns the images in the order of log_list
+    if not log_list:
+        return []
+    dense = [dense_hours(log.hours_for(year, month)[0] if year in log.years else None, year, month) for log in log_list]
+    dense = [np.concatenate(arrays) for arrays in zip(*dense)]
+    amt_of_days = Year(year).months[month].amt_of_days
+    images = Month.colorize(Month.score_hours(*dense))
+    return [image[:amt_of_days].transpose(1, 0, 2) for image in images]
+
+
+def create_hour(index, average_jitters, average_packetloss_rates, amounts_of_data_points, sketches):
+    percentiles = None
+    if sketches is not None and len(sketches.row(index)[0]):
+        percentiles = sketches.quantiles(index, PERCENTILES)
+    return Hour(float(average_jitters[index]), float(average_packetloss_rates[index]),
+                int(amounts_of_data_points[index]), percentiles)
+
+
+class Day:
+    def __init__(self):
+        self.hours = {}
+
+class Hour:
+    def __init__(self, average_jitter, average_packetloss_rate, amount_of_data_points, percentiles=None):
+        self.average_jitter = average_jitter
+        self.average_packetloss_rate = average_packetloss_rate
+        self.amount_of_data_points = amount_of_data_points
+        self.percentiles = percentiles  # rtt (p50, p95, p99) of the hour, if the log has per packet rtts
+
+
+
+def find_logs(directory=""):
+    # single file logs and directories of partitioned logs
+    found = []
+    for filename in sorted(os.listdir(directory or os.getcwd())):
+        filepath = os.path.join(directory, filename)
+        if pattern.match(filename) or is_partition_directory(filepath):
+            found.append(filepath)
+    return found
+
+def open_log_data(filepath):
+    if os.path.isdir(filepath):
+        return PartitionedLogData(filepath)
+    return LogData(filepath)
+
+def load_all_logs(directory=""):
+    # only indexes the logs, they are loaded when first looked at
+    for filepath in find_logs(directory):
+        logs[filepath] = open_log_data(filepath)
+
+def load_log(filepath):
+    if filepath not in logs:
+        logs[filepath] = open_log_data(filepath)
+    logs[filepath].ensure_loaded()
+
+def load_logs_parallel(log_list, jobs=None):
+    # parses the single file logs in worker processes and yields every log of log_list once it is loaded,
+    # in the order they finish. partitioned logs only list their files here, their months are read when looked at
+    single_file_logs = []
+    for log in log_list:
+        if isinstance(log, LogData) and not log.is_loaded:
+            single_file_logs.append(log)
+        else:
+            log.ensure_loaded()
+            yield log
+    if not single_file_logs:
+        return
+    # spawned workers, the viewer runs Qt and timer threads that a forked child would inherit in whatever state they were
+    workers = max(1, min(jobs or os.cpu_count(), len(single_file_logs)))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = {executor.submit(read_log_hours, log.filename): log for log in single_file_logs}
+        for future in as_completed(futures):
+            log = futures[future]
+            try:
+                log.apply_loaded(*future.result())
+            except Exception as e:
+                print(f"Loading {log.filename} failed with error: {e}")
+                log.apply_loaded(aggregate_hours(*(np.empty(0),) * 5)[0], sketch_arrays(SketchColumn()))
+            yield log
+
+def read_log_hours(filepath):
+    # (keys, average jitters, average packetloss rates, amounts of data points) of every hour of a single file log,
+    # and the arrays of their SketchColumn. only plain arrays, so it can run in a worker process
+    rollup, tail_hours, tail_sketches = load_rollup(filepath)
+    rollup_hours = (rollup.keys, rollup.average_jitters, rollup.average_packetloss_rates, rollup.amounts_of_data_points)
+    hours = tuple(np.concatenate(pair) for pair in zip(rollup_hours, tail_hours))
+    return hours, sketch_arrays(rollup.sketches.concatenate(tail_sketches))
+
+def sketch_arrays(sketches):
+    return sketches.offsets, sketches.buckets, sketches.counts
+
+
+def load_rollup(filepath, use_cache=True, rollup=None):
+    # returns the HourRollup of the log and the hours (and their sketches) closed by an unterminated last line,
+    # which are left out of the rollup until the line is complete. a rollup kept from an earlier call is continued
+    stat = os.stat(filepath)
+    cache_path = filepath + ROLLUP_SUFFIX
+    if rollup is None and use_cache:
+        rollup = HourRollup.load(cache_path)
+    # a compressed log is never appended to, its rollup is either current or rebuilt
+    sealed = is_compressed(filepath)
+    changed = rollup is None or not rollup.can_continue(stat, sealed)
+    if sealed and not changed:
+        return rollup, aggregate_hours(*(np.empty(0),) * 5)[0], SketchColumn()
+    if changed:
+        rollup = HourRollup()
+    offset = rollup.offset
+    tail_hours, tail_sketches = rollup.ingest(filepath)
+    rollup.file_id = [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+    if use_cache and (changed or rollup.offset != offset):
+        rollup.save(cache_path)
+    return rollup, tail_hours, tail_sketches
+
+
+def read_log_chunks(filepath, offset=0):
+    # yields (offset after the chunk, (timestamps, average pings, minimum pings, maximum pings, packetloss rates), rtts)
+    # with float64 arrays, rtts are (row of every rtt, rtt) of the lines that carry them.
+    # a last line without newline is yielded with offset None, it may still be written to.
+    if BinaryLog.is_binary_log(filepath):
+        records = BinaryLog.read_records(filepath)
+        record_size = records.dtype.itemsize
+        first = max(0, offset - BinaryLog.HEADER.size) // record_size
+        for start in range(first, len(records), LOAD_CHUNK_LINES):
+            chunk = records[start:start + LOAD_CHUNK_LINES]
+            end = BinaryLog.HEADER.size + (start + len(chunk)) * record_size
+            rtts = NO_RTTS
+            if "rtts" in records.dtype.names:
+                answered = ~np.isnan(chunk["rtts"])
+                rtts = (np.nonzero(answered)[0], chunk["rtts"][answered].astype(np.float64))
+            yield end, tuple(chunk[name].astype(np.float64) for name in ("time", "avg", "min", "max", "loss")), rtts
+        return
+
+    with open_log(filepath) as file:
+        file.seek(offset)
+        pending = b''
+        while True:
+            data = file.read(LOAD_CHUNK_BYTES)
+            if not data:
+                break
+            data = pending + data
+            end = data.rfind(b'\n') + 1
+            pending = data[end:]
+            if end:
+                offset += end
+                yield (offset, *parse_log_lines(data[:end - 1].decode('latin-1').split('\n'),
+                                                data.count(b';', 0, end)))
+        if pending:
+            yield (None, *parse_log_lines([pending.decode('latin-1')]))
+
+
+NO_RTTS = (np.empty(0, dtype=np.int64), np.empty(0))
+
+
+def parse_log_lines(lines, semicolons=None):
+    # returns (columns, rtts) like read_log_chunks. lines have 5 fields, or 6 with the comma separated rtts.
+    # semicolons is the count of ';' in the lines, if every line has exactly 4 none can carry rtts
+    if semicolons is not None and semicolons == 4 * len(lines):
+        values, kept = load_values(lines)
+        if kept is None:
+            return split_columns(values), NO_RTTS
+
+    heads = []
+    rtt_fields = []
+    for line in lines:
+        count = line.count(';')
+        if count == 4:
+            heads.append(line)
+            rtt_fields.append('')
+        elif count == 5:
+            head, _, rtt_field = line.rpartition(';')
+            heads.append(head)
+            rtt_fields.append(rtt_field.strip())
+    values, kept = load_values(heads)
+    if kept is not None:
+        rtt_fields = [rtt_fields[index] for index in kept]
+    return split_columns(values), parse_rtt_fields(rtt_fields)
+
+
+def load_values(lines):
+    # (values of shape (n, 5), indices of the lines that were parsed or None if every line was)
+    with warnings.catch_warnings():
+        # loadtxt warns about chunks that only hold empty lines
+        warnings.simplefilter("ignore", UserWarning)
+        try:
+            values = np.loadtxt(lines, delimiter=';', dtype=np.float64, comments=None, ndmin=2)
+            if values.shape[1] == 5 and len(values) == len(lines):
+                return values, None
+        except ValueError:
+            pass
+    # malformed or empty lines in this chunk, parse the lines with the right field count one by one
+    rows = []
+    kept = []
+    for index, line in enumerate(lines):
+        parts = line.strip().split(';')
+        if len(parts) != 5:
+            continue
+        try:
+            rows.append([float(part) for part in parts])
+        except ValueError:
+            continue
+        kept.append(index)
+    return np.array(rows, dtype=np.float64).reshape(-1, 5), kept
+
+
+def split_columns(values):
+    if values.shape[1] != 5:
+        values = np.empty((0, 5), dtype=np.float64)
+    return values[:, 0], values[:, 1], values[:, 2], values[:, 3], values[:, 4]
+
+
+def parse_rtt_fields(rtt_fields):
+    rows = [index for index, field in enumerate(rtt_fields) if field]
+    if not rows:
+        return NO_RTTS
+    fields = [rtt_fields[index] for index in rows]
+    try:
+        rtts = np.array(','.join(fields).split(','), dtype=np.float64)
+        counts = [field.count(',') + 1 for field in fields]
+    except ValueError:
+        # a broken field only loses its own rtts
+        rtts, counts = [], []
+        for field in fields:
+            try:
+                values = [float(rtt) for rtt in field.split(',')]
+            except ValueError:
+                values = []
+            rtts.extend(values)
+            counts.append(len(values))
+        rtts = np.array(rtts, dtype=np.float64)
+    rows = np.repeat(np.array(rows, dtype=np.int64), counts)
+    valid = np.isfinite(rtts) & (rtts >= 0)
+    return rows[valid], rtts[valid]
+
+
+class PartialHour:
+    # accumulated stats of the hour that is still open at the end of the parsed data
+    def __init__(self, key, amount_of_data_points, invalid_data_points, accumulated_jitter, accumulated_packetloss,
+                 sketch=None):
+        self.key = key
+        self.amount_of_data_points = amount_of_data_points
+        self.invalid_data_points = invalid_data_points
+        self.accumulated_jitter = accumulated_jitter
+        self.accumulated_packetloss = accumulated_packetloss
+        self.sketch = sketch if sketch is not None else []  # RttSketch.encode() of the rtts so far
+
+
+def local_hour_keys(timestamps):
+    # hours since the epoch in local wall clock time, the utc offset is looked up once per quarter hour
+    seconds = np.floor(timestamps).astype(np.int64)
+    slots, inverse = np.unique(seconds // 900, return_inverse=True)
+    offsets = np.array([local_utc_offset(int(slot) * 900) for slot in slots], dtype=np.int64)
+    return (seconds + offsets[inverse.reshape(-1)]) // 3600
+
+
+_utc_offset_cache = {}
+
+
+def local_utc_offset(timestamp):
+    offset = _utc_offset_cache.get(timestamp)
+    if offset is None:
+        local = datetime.fromtimestamp(timestamp)
+        offset = int((local - EPOCH).total_seconds()) - timestamp
+        _utc_offset_cache[timestamp] = offset
+    return offset
+
+
+def hour_key_to_datetime(key):
+    return EPOCH + timedelta(hours=int(key))
+
+
+def aggregate_hours(timestamps, average_pings, minimum_pings, maximum_pings, packetloss_rates, partial_hour=None,
+                    rtts=NO_RTTS):
+    # Groups consecutive samples of the same local hour like the line by line loader did and returns
+    # ((keys, average jitters, average packetloss rates, amounts of data points) of the closed hours, open PartialHour,
+    # SketchColumn of the closed hours). rtts are (sample index, rtt) pairs like parse_log_lines returns them.
+    # The open hour is carried over as a seed row, so the sums are accumulated in the same order as before.
+    valid = average_pings != -1
+    keys = local_hour_keys(timestamps)
+    jitter = np.where(valid, maximum_pings - minimum_pings, 0.0)
+    points = np.ones(len(keys))
+    invalid = (~valid).astype(np.float64)
+    packetloss = packetloss_rates
+    rtt_rows, rtt_values = rtts
+    seed_sketch = []
+    if partial_hour is not None:
+        keys = np.concatenate(([partial_hour.key], keys))
+        jitter = np.concatenate(([partial_hour.accumulated_jitter], jitter))
+        points = np.concatenate(([partial_hour.amount_of_data_points], points))
+        invalid = np.concatenate(([partial_hour.invalid_data_points], invalid))
+        packetloss = np.concatenate(([partial_hour.accumulated_packetloss], packetloss))
+        rtt_rows = rtt_rows + 1
+        seed_sketch = partial_hour.sketch
+
+    empty = (np.empty(0, dtype=np.int64), np.empty(0), np.empty(0), np.empty(0, dtype=np.int64))
+    if len(keys) == 0:
+        return empty, partial_hour, SketchColumn()
+
+    run_ids = np.concatenate(([0], np.cumsum(keys[1:] != keys[:-1])))
+    run_keys = keys[np.concatenate(([0], np.flatnonzero(keys[1:] != keys[:-1]) + 1))]
+    run_points = np.bincount(run_ids, weights=points)
+    run_invalid = np.bincount(run_ids, weights=invalid)
+    run_jitter = np.bincount(run_ids, weights=jitter)
+    run_packetloss = np.bincount(run_ids, weights=packetloss)
+
+    closed_runs = len(run_keys) - 1
+    sketches, open_sketch = aggregate_sketches(run_ids[rtt_rows], rtt_values, seed_sketch, closed_runs)
+    partial_hour = PartialHour(int(run_keys[-1]), int(run_points[-1]), int(run_invalid[-1]),
+                               float(run_jitter[-1]), float(run_packetloss[-1]), open_sketch)
+    closed = slice(0, closed_runs)
+    average_packetloss_rates = run_packetloss[closed] / run_points[closed]
+    average_jitters = run_jitter[closed] / np.maximum(1, run_points[closed] - run_invalid[closed])
+    hours = (run_keys[closed], average_jitters, average_packetloss_rates, run_points[closed].astype(np.int64))
+    return hours, partial_hour, sketches
+
+
+def close_partial_hour(partial_hour):
+    # (hours, sketches) with the one hour of a PartialHour whose log won't get more lines of it
+    points = partial_hour.amount_of_data_points
+    hours = (np.array([partial_hour.key], dtype=np.int64),
+             np.array([partial_hour.accumulated_jitter / max(1, points - partial_hour.invalid_data_points)]),
+             np.array([partial_hour.accumulated_packetloss / points]), np.array([points], dtype=np.int64))
+    sketch = np.array(partial_hour.sketch, dtype=np.int64).reshape(-1, 2)
+    sketches = SketchColumn.from_entries(1, np.zeros(len(sketch), dtype=np.int64), sketch[:, 0], sketch[:, 1])
+    return hours, sketches
+
+
+def concatenate_hours(loaded):
+    # joins [(hours, sketches), ...] in order
+    if not loaded:
+        return aggregate_hours(*(np.empty(0),) * 5)[0], SketchColumn()
+    hours = tuple(np.concatenate(columns) for columns in zip(*(hours for hours, _ in loaded)))
+    sketches = loaded[0][1]
+    for _, more in loaded[1:]:
+        sketches = sketches.concatenate(more)
+    return hours, sketches
+
+
+def aggregate_sketches(runs, rtts, seed_sketch, closed_runs):
+    # bucket counts per run of the rtts, the seed sketch belongs to run 0.
+    # returns the SketchColumn of the closed runs and the encoded sketch of the last, still open, run
+    if len(rtts) == 0 and not seed_sketch:
+        return SketchColumn.empty(closed_runs), []
+    buckets = bucket_indices(rtts)
+    counts = np.ones(len(rtts), dtype=np.int64)
+    if seed_sketch:
+        seed = np.array(seed_sketch, dtype=np.int64).reshape(-1, 2)
+        runs = np.concatenate((np.zeros(len(seed), dtype=np.int64), runs))
+        buckets = np.concatenate((seed[:, 0], buckets))
+        counts = np.concatenate((seed[:, 1], counts))
+    cells, inverse = np.unique(runs * BUCKET_COUNT + buckets, return_inverse=True)
+    cell_counts = np.bincount(inverse.reshape(-1), weights=counts).astype(np.int64)
+    cell_runs, cell_buckets = np.divmod(cells, BUCKET_COUNT)
+    closed = cell_runs < closed_runs
+    sketches = SketchColumn.from_entries(closed_runs, cell_runs[closed], cell_buckets[closed], cell_counts[closed])
+    open_sketch = np.column_stack((cell_buckets[~closed], cell_counts[~closed])).tolist()
+    return sketches, open_sketch
+
+
+class HourRollup:
+    # The closed hours of one log in file order, plus the byte offset and open hour to continue parsing from.
+    # Saved as a sidecar next to the log and only trusted while the log is the same file, grown by appends only.
+    def __init__(self):
+        self.keys = np.empty(0, dtype=np.int64)
+        self.average_jitters = np.empty(0)
+        self.average_packetloss_rates = np.empty(0)
+        self.amounts_of_data_points = np.empty(0, dtype=np.int64)
+        self.sketches = SketchColumn()
+        self.offset = 0
+        self.partial_hour = None
+        self.file_id = None  # inode, size and mtime of the log when it was parsed
+        self.timezone = local_timezone_id()
+
+    def can_continue(self, stat, sealed=False):
+        if self.file_id is None or self.timezone != local_timezone_id():
+            return False
+        inode, size, mtime = self.file_id
+        if sealed:
+            return [stat.st_ino, stat.st_size, stat.st_mtime_ns] == self.file_id
+        if stat.st_ino != inode or stat.st_size < size or stat.st_size < self.offset:
+            return False
+        if stat.st_size == size and stat.st_mtime_ns != mtime:
+            return False
+        return True
+
+    def ingest(self, filepath):
+        tail_hours, tail_sketches = None, SketchColumn()
+        for end, columns, rtts in read_log_chunks(filepath, self.offset):
+            hours, partial_hour, sketches = aggregate_hours(*columns, self.partial_hour, rtts)
+            if end is None:
+                tail_hours, tail_sketches = hours, sketches
+                continue
+            self.append(*hours, sketches)
+            self.partial_hour = partial_hour
+            self.offset = end
+        if tail_hours is None:
+            tail_hours = aggregate_hours(*(np.empty(0),) * 5)[0]
+        return tail_hours, tail_sketches
+
+    def append(self, keys, average_jitters, average_packetloss_rates, amounts_of_data_points, sketches):
+        self.sketches = self.sketches.concatenate(sketches)
+        self.keys = np.concatenate((self.keys, keys))
+        self.average_jitters = np.concatenate((self.average_jitters, average_jitters))
+        self.average_packetloss_rates = np.concatenate((self.average_packetloss_rates, average_packetloss_rates))
+        self.amounts_of_data_points = np.concatenate((self.amounts_of_data_points, amounts_of_data_points))
+
+    def save(self, path):
+        state = {
+            "version": ROLLUP_VERSION,
+            "offset": self.offset,
+            "file_id": self.file_id,
+            "timezone": self.timezone,
+            "partial_hour": vars(self.partial_hour) if self.partial_hour is not None else None,
+        }
+        try:
+            with open(path + ".tmp", 'wb') as file:
+                np.savez(file, keys=self.keys, average_jitters=self.average_jitters,
+                         average_packetloss_rates=self.average_packetloss_rates,
+                         amounts_of_data_points=self.amounts_of_data_points, sketch_offsets=self.sketches.offsets,
+                         sketch_buckets=self.sketches.buckets, sketch_counts=self.sketches.counts,
+                         state=np.array(json.dumps(state)))
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            print(f"Could not write rollup cache {path}: {e}")
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with np.load(path) as data:
+                state = json.loads(str(data["state"]))
+                if state["version"] != ROLLUP_VERSION:
+                    return None
+                rollup = cls()
+                rollup.keys = data["keys"]
+                rollup.average_jitters = data["average_jitters"]
+                rollup.average_packetloss_rates = data["average_packetloss_rates"]
+                rollup.amounts_of_data_points = data["amounts_of_data_points"]
+                rollup.sketches = SketchColumn(data["sketch_offsets"], data["sketch_buckets"], data["sketch_counts"])
+        except (OSError, ValueError, KeyError):
+            return None
+        rollup.offset = state["offset"]
+        rollup.file_id = state["file_id"]
+        rollup.timezone = state["timezone"]
+        if state["partial_hour"] is not None:
+            rollup.partial_hour = PartialHour(**state["partial_hour"])
+        return rollup
+
+
+def local_timezone_id():
+    # hour keys are local time, a rollup made under another timezone can't be continued
+    return [time.timezone, time.altzone, time.daylight, list(time.tzname)]
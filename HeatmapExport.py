@@ -0,0 +1,92 @@
+import argparse
+import os
+import struct
+import sys
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+
+from HeatmapData import find_logs, open_log_data
+
+# Renders heatmap PNGs of every log x month without Qt or a display, one worker process per log file.
+# The images look like the heatmap window: one row per day, one column per hour.
+
+
+def write_png(path, rgba):
+    # rgba: uint8 array of shape (height, width, 4)
+    height, width, _ = rgba.shape
+    rows = np.concatenate((np.zeros((height, 1), dtype=np.uint8), rgba.reshape(height, width * 4)), axis=1)
+
+    def chunk(kind, data):
+        return struct.pack("!I", len(data)) + kind + data + struct.pack("!I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    with open(path, 'wb') as file:
+        file.write(b"\x89PNG\r\n\x1a\n")
+        file.write(chunk(b"IHDR", struct.pack("!IIBBBBB", width, height, 8, 6, 0, 0, 0)))
+        file.write(chunk(b"IDAT", zlib.compress(rows.tobytes(), 6)))
+        file.write(chunk(b"IEND", b""))
+
+
+def month_number(text):
+    # "2026-10" -> months since year 0
+    year, month = text.split('-')
+    return int(year) * 12 + int(month) - 1
+
+
+def export_log(filepath, output_directory, first=None, last=None, scale=16):
+    log = open_log_data(filepath)
+    written = []
+    for year in sorted(log.years.keys()):
+        images = log.years[year].create_month_images()
+        for month, image in images.items():
+            number = year * 12 + month - 1
+            if not log.years[year].months[month].has_data:
+                continue
+            if (first is not None and number < first) or (last is not None and number > last):
+                continue
+            # the month image is indexed [hour, day], the png gets a row per day
+            pixels = image.transpose(1, 0, 2)
+            pixels = np.repeat(np.repeat(pixels, scale, axis=0), scale, axis=1)
+            path = os.path.join(output_directory, f"{Path(filepath).stem}-{year}-{month}.png")
+            write_png(path, pixels)
+            written.append(path)
+    return written
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Export heatmap images of ping logs without a display.")
+    parser.add_argument("logs", nargs="*", help="log files or partition directories, defaults to every log in --directory")
+    parser.add_argument("--directory", default=".", help="where to look for logs")
+    parser.add_argument("--output", default="heatmaps", help="where to write the images")
+    parser.add_argument("--from", dest="first", help="first month to export, YYYY-MM")
+    parser.add_argument("--to", dest="last", help="last month to export, YYYY-MM")
+    parser.add_argument("--scale", type=int, default=16, help="pixels per hour cell")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="worker processes")
+    args = parser.parse_args(argv)
+
+    filepaths = args.logs or find_logs(args.directory)
+    if not filepaths:
+        print("No logs found")
+        return 1
+    first = month_number(args.first) if args.first else None
+    last = month_number(args.last) if args.last else None
+    os.makedirs(args.output, exist_ok=True)
+
+    failed = 0
+    with ProcessPoolExecutor(max_workers=max(1, min(args.jobs, len(filepaths)))) as executor:
+        futures = {executor.submit(export_log, filepath, args.output, first, last, args.scale): filepath
+                   for filepath in filepaths}
+        for future in as_completed(futures):
+            try:
+                written = future.result()
+                print(f"{futures[future]}: {len(written)} images")
+            except Exception as e:
+                print(f"{futures[future]}: export failed with error: {e}")
+                failed += 1
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,202 @@
+import asyncio
+import itertools
+import os
+import platform
+import socket
+import struct
+import subprocess
+import threading
+import time
+
+import PingParser
+from Profiler import PROFILER
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+PING_INTERVAL_IN_SEC = 1.0
+PING_TIMEOUT_IN_SEC = 2.0
+PAYLOAD_SIZE = 56
+
+
+class PingResult:
+    def __init__(self, sent, rtts=None, minimum=-1, average=-1, maximum=-1, lost=None):
+        # rtts holds the round trip time (ms) of every answered echo, if they are known
+        self.sent = sent
+        self.rtts = rtts if rtts is not None else []
+        if rtts:
+            minimum = min(rtts)
+            maximum = max(rtts)
+            average = sum(rtts) / len(rtts)
+        self.minimum = minimum
+        self.average = average
+        self.maximum = maximum
+        self.lost = lost if lost is not None else sent - len(self.rtts)
+
+
+def checksum(data):
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def open_icmp_socket():
+    # unprivileged ICMP datagram sockets first (linux: net.ipv4.ping_group_range), raw sockets second
+    for kind in (socket.SOCK_DGRAM, socket.SOCK_RAW):
+        try:
+            sock = socket.socket(socket.AF_INET, kind, socket.IPPROTO_ICMP)
+        except OSError:
+            continue
+        sock.setblocking(False)
+        return sock, kind
+    return None, None
+
+
+class IcmpProber:
+    # Sends the echo requests of every server from one socket on one asyncio event loop.
+    # Falls back to the ping binary if the OS permits neither datagram nor raw ICMP sockets.
+    def __init__(self, interval=PING_INTERVAL_IN_SEC, timeout=PING_TIMEOUT_IN_SEC):
+        self.interval = interval
+        self.timeout = timeout
+        self.sock, self.socket_kind = open_icmp_socket()
+        self.identifier = os.getpid() & 0xFFFF
+        self.sequence = itertools.count()
+        self.pending = {}
+        self.loop = None
+        self.loop_thread = None
+        self.lock = threading.Lock()
+
+    @property
+    def native(self):
+        return self.sock is not None
+
+    def ping(self, address, count, interval=None):
+        return self.submit(address, count, interval).result()
+
+    def submit(self, address, count, interval=None):
+        # starts a probe cycle on the event loop without waiting for it, returns a concurrent.futures.Future
+        # of its PingResult. any amount of cycles can be in flight at once, the loop waits for all of them.
+        # interval overrides the seconds between the echo requests of this cycle
+        self.ensure_loop()
+        if self.native:
+            coroutine = self.ping_async(address, count, interval)
+        else:
+            coroutine = ping_subprocess(address, count, interval)
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def ensure_loop(self):
+        with self.lock:
+            if self.loop is not None:
+                return
+            self.loop = asyncio.new_event_loop()
+            if self.native:
+                self.loop.add_reader(self.sock.fileno(), self.on_readable)
+            self.loop_thread = threading.Thread(target=self.loop.run_forever)
+            self.loop_thread.daemon = True
+            self.loop_thread.start()
+
+    async def ping_async(self, address, count, interval=None):
+        try:
+            infos = await self.loop.getaddrinfo(address, None, family=socket.AF_INET)
+            ip = infos[0][4][0]
+        except (socket.gaierror, IndexError):
+            return PingResult(count)
+
+        echos = []
+        for i in range(count):
+            if i > 0:
+                await asyncio.sleep(self.interval if interval is None else interval)
+            echos.append(self.loop.create_task(self.echo(ip)))
+        rtts = [rtt for rtt in await asyncio.gather(*echos) if rtt is not None]
+        return PingResult(count, rtts)
+
+    async def echo(self, ip):
+        sequence = next(self.sequence) & 0xFFFF
+        future = self.loop.create_future()
+        self.pending[sequence] = (future, ip)
+        try:
+            sent_at = time.perf_counter()
+            self.sock.sendto(self.build_packet(sequence), (ip, 0))
+            received_at = await asyncio.wait_for(future, self.timeout)
+            return (received_at - sent_at) * 1000
+        except (asyncio.TimeoutError, OSError):
+            return None
+        finally:
+            self.pending.pop(sequence, None)
+
+    def build_packet(self, sequence):
+        payload = struct.pack("!d", time.time()).ljust(PAYLOAD_SIZE, b'\x00')
+        header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, 0, self.identifier, sequence)
+        header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, checksum(header + payload), self.identifier, sequence)
+        return header + payload
+
+    def on_readable(self):
+        while True:
+            try:
+                data, (ip, _) = self.sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+            received_at = time.perf_counter()
+
+            offset = 0
+            if data and data[0] >> 4 == 4:
+                # raw sockets, and the datagram sockets of macOS/BSD, deliver the ip header as well.
+                # an icmp message never starts with version 4 (its type would be 64 to 79)
+                offset = (data[0] & 0x0F) * 4
+            if len(data) < offset + 8:
+                continue
+            icmp_type, _, _, identifier, sequence = struct.unpack("!BBHHH", data[offset:offset + 8])
+            if icmp_type != ICMP_ECHO_REPLY:
+                continue
+            # datagram sockets get their identifier rewritten by the kernel and only see their own replies
+            if self.socket_kind == socket.SOCK_RAW and identifier != self.identifier:
+                continue
+            entry = self.pending.get(sequence)
+            if entry is None:
+                continue
+            future, expected_ip = entry
+            if expected_ip == ip and not future.done():
+                future.set_result(received_at)
+
+
+async def ping_subprocess(address, count, interval=None):
+    # runs the ping binary as a child process of the event loop, so waiting for it blocks no thread.
+    # the windows ping has no interval option, its echo requests are always a second apart
+    try:
+        if platform.system().lower() == 'windows':
+            process = await asyncio.create_subprocess_exec("ping", "-n", str(count), address,
+                                                           stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                                           creationflags=subprocess.CREATE_NO_WINDOW)
+        else:
+            # the C locale keeps the output in the format PingParser knows
+            options = ["-i", str(interval)] if interval is not None else []
+            process = await asyncio.create_subprocess_exec("ping", "-c", str(count), *options, address,
+                                                           stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                                           env=dict(os.environ, LC_ALL="C"))
+        stdout, _ = await process.communicate()
+    except OSError as e:
+        # no answer was seen, a sample of 0% loss would claim the host is healthy
+        print(f"Ping failed with error: {e}")
+        return PingResult(count, lost=count)
+
+    with PROFILER.span("parse"):
+        parsed = PingParser.parse(stdout.decode('latin-1'))
+    lost = parsed.lost if parsed.lost is not None else count - len(parsed.rtts)
+    return PingResult(count, parsed.rtts, minimum=parsed.minimum, average=parsed.average, maximum=parsed.maximum,
+                      lost=lost)
+
+
+_shared_prober = None
+_shared_prober_lock = threading.Lock()
+
+
+def get_prober():
+    global _shared_prober
+    with _shared_prober_lock:
+        if _shared_prober is None:
+            _shared_prober = IcmpProber()
+        return _shared_prober
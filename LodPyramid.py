@@ -0,0 +1,95 @@
+import numpy as np
+
+from RingBuffer import RingBuffer
+
+
+class LevelAccumulator:
+    # the bucket of a level that is still being filled
+    def __init__(self, names):
+        self.names = names
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.start = None
+        self.end = None
+        self.minimum = {}
+        self.maximum = {}
+        self.total = {}
+
+    def add(self, start, end, minimum, maximum, mean):
+        if self.count == 0:
+            self.start = start
+            self.minimum = dict(minimum)
+            self.maximum = dict(maximum)
+            self.total = dict(mean)
+        else:
+            for name in self.names:
+                self.minimum[name] = min(self.minimum[name], minimum[name])
+                self.maximum[name] = max(self.maximum[name], maximum[name])
+                self.total[name] += mean[name]
+        self.end = end
+        self.count += 1
+
+
+class LodPyramid:
+    # Multi resolution min/max/mean levels of a few Server series, maintained while samples arrive.
+    # Level k holds buckets of factor^k samples, so drawing a window costs about the pixel width of the plot
+    # instead of the amount of samples in it. Level 0 are the raw samples, which stay in the Server.
+    def __init__(self, capacity, names, factor=4, min_level_size=64):
+        self.names = names
+        self.factor = factor
+        self.levels = []
+        self.accumulators = []
+        level_capacity = capacity // factor + 1
+        while level_capacity >= min_level_size:
+            columns = [("start", np.float64), ("end", np.float64)]
+            for name in names:
+                columns += [(name + "_min", np.float32), (name + "_max", np.float32), (name + "_mean", np.float32)]
+            self.levels.append(RingBuffer(level_capacity, columns))
+            self.accumulators.append(LevelAccumulator(names))
+            level_capacity = level_capacity // factor + 1
+
+    def append(self, time, **values):
+        start, end, minimum, maximum, mean = time, time, values, values, values
+        for level, accumulator in zip(self.levels, self.accumulators):
+            accumulator.add(start, end, minimum, maximum, mean)
+            if accumulator.count < self.factor:
+                return
+            # the bucket is complete, store it and hand it to the next level
+            start, end = accumulator.start, accumulator.end
+            minimum, maximum = accumulator.minimum, accumulator.maximum
+            mean = {name: accumulator.total[name] / accumulator.count for name in self.names}
+            row = {"start": start, "end": end}
+            for name in self.names:
+                row[name + "_min"] = minimum[name]
+                row[name + "_max"] = maximum[name]
+                row[name + "_mean"] = mean[name]
+            level.append(**row)
+            accumulator.reset()
+
+    def curve(self, name, time_data, values, x_min, x_max, max_points):
+        # (x, y) to draw values between x_min and x_max with at most about max_points points.
+        # Above level 0 every bucket becomes a min and a max point, so spikes stay visible.
+        first, last = np.searchsorted(time_data, (x_min, x_max), side='left')
+        first, last = max(0, first - 1), min(len(time_data), last + 1)
+        level_index = 0
+        visible = last - first
+        while visible > max_points and level_index < len(self.levels):
+            level_index += 1
+            visible //= self.factor
+        if level_index == 0:
+            return time_data[first:last], values[first:last]
+
+        level = self.levels[level_index - 1]
+        starts, ends, minimums, maximums = level.views("start", "end", name + "_min", name + "_max")
+        if len(starts) == 0:
+            return time_data[first:last], values[first:last]
+        bucket_first, bucket_last = np.searchsorted(starts, (x_min, x_max), side='left')
+        bucket_first, bucket_last = max(0, bucket_first - 1), min(len(starts), bucket_last + 1)
+        # the raw samples that aren't part of a complete bucket yet are drawn as they are
+        tail = max(first, np.searchsorted(time_data, ends[-1], side='right'))
+        x = np.concatenate((np.repeat(starts[bucket_first:bucket_last], 2), time_data[tail:last]))
+        y = np.concatenate((np.column_stack((minimums[bucket_first:bucket_last], maximums[bucket_first:bucket_last])).ravel(),
+                            values[tail:last]))
+        return x, y
@@ -0,0 +1,53 @@
+import gzip
+import os
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Closed log partitions are compressed with gzip, or zstd if the zstandard package is installed.
+# Readers open any log through open_log and don't need to care whether it is compressed.
+COMPRESSED_SUFFIXES = {".gz": "gzip", ".zst": "zstd"}
+SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+
+
+def available_methods():
+    return ["gzip", "zstd"] if zstandard is not None else ["gzip"]
+
+
+def is_compressed(path):
+    return os.path.splitext(path)[1] in COMPRESSED_SUFFIXES
+
+
+def open_log(path):
+    # binary file object with the (decompressed) content of a log
+    suffix = os.path.splitext(path)[1]
+    if suffix == ".gz":
+        return gzip.open(path, 'rb')
+    if suffix == ".zst":
+        if zstandard is None:
+            raise OSError(f"{path}: reading zstd logs needs the zstandard package")
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    return open(path, 'rb')
+
+
+def compress(path, method="gzip"):
+    # replaces path by its compressed version and returns the new path, the original is only removed
+    # once the compressed file is complete
+    destination = path + SUFFIXES[method]
+    with open(path, 'rb') as source, open(destination + ".tmp", 'wb') as target:
+        if method == "zstd":
+            if zstandard is None:
+                raise OSError("zstd compression needs the zstandard package")
+            zstandard.ZstdCompressor(level=10).copy_stream(source, target)
+        else:
+            with gzip.GzipFile(fileobj=target, mode='wb', compresslevel=6, mtime=0) as compressed:
+                while True:
+                    data = source.read(1024 * 1024)
+                    if not data:
+                        break
+                    compressed.write(data)
+    os.replace(destination + ".tmp", destination)
+    os.remove(path)
+    return destination
@@ -1,21 +1,28 @@
 import os
-import re
 import sys
-import time
-from datetime import datetime, timezone
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import pyqtgraph as pg
 from PyQt5 import QtGui, QtCore
-from PyQt5.QtCore import Qt, QRectF
+from PyQt5.QtCore import Qt, QRectF, QObject, pyqtSignal
 from PyQt5.QtGui import QFont, QBrush, QColor, QIcon, QScreen
 from PyQt5.QtWidgets import QApplication, QVBoxLayout, QWidget, QPushButton, QLabel, QMainWindow, QGridLayout, QFrame, \
     QGraphicsRectItem, QAction, QToolBar
-import numpy as np
+
+import BinaryLog
+from HeatmapData import logs, load_all_logs, load_logs_parallel, follow_log, MonthImageCache
 
 
 directory = ""
-pattern = re.compile(r'.*_log\.txt$')
+MONTH_IMAGE_CACHE_SIZE = 64
+# worker processes that parse the logs at startup
+LOAD_JOBS = os.cpu_count()
+# draw whichever log finishes loading first, instead of waiting for the first one in the list
+SHOW_FIRST_LOADED = True
+# how often the logs are checked for new lines (their hours and cached month images are updated), 0 never checks
+FOLLOW_INTERVAL_IN_MS = 5000
 
 selected_log = -1
 selected_year = -1
@@ -62,13 +69,8 @@ class MainWindow(QMainWindow):
         self.plot_widget.setMouseEnabled(x=False, y=False)
         self.plot_widget.showGrid(x=True, y=True)
 
-        self.image_item = None
-        global selected_log, selected_year, selected_month, logs
-        for key in logs.keys():
-            selected_log = key
-            break
-        self.set_latest_data_point_as_selection()
-        self.draw_month()
+        # the logs are loaded in the background, the first one is drawn by on_log_loaded
+        self.image_item = pg.ImageItem()
         self.plot_widget.addItem(self.image_item)
 
         grid_layout = QGridLayout()
@@ -113,6 +115,29 @@ class MainWindow(QMainWindow):
         save_action.setShortcut(Qt.ALT + Qt.Key_C)
         self.addAction(save_action)
 
+        self.follow_timer = QtCore.QTimer()
+        self.follow_timer.timeout.connect(self.follow_logs)
+        if FOLLOW_INTERVAL_IN_MS > 0:
+            self.follow_timer.start(FOLLOW_INTERVAL_IN_MS)
+
+    def follow_logs(self):
+        # only the changed hours are recolored in the cached images, the shown one just needs to be set again
+        for key in loaded_log_keys():
+            changed = follow_log(logs[key], month_images)
+            if key == selected_log and (selected_year, selected_month) in changed:
+                self.image_item.setImage(image=month_images.get(logs[key], selected_year, selected_month))
+
+    def on_log_loaded(self, key, done, total):
+        global selected_log
+        if done < total:
+            self.setWindowTitle(f"Log Heatmap (loading {done}/{total})")
+        else:
+            self.setWindowTitle("Log Heatmap")
+        if selected_log == -1 and (SHOW_FIRST_LOADED or key == next(iter(logs))):
+            selected_log = key
+            self.set_latest_data_point_as_selection()
+            self.draw_month()
+
     def saveScreenshot(self):
         if selected_log != -1 and selected_year != -1 and selected_month != -1:
             filepath = os.path.join(directory, f"{Path(logs[selected_log].filename).stem}-{selected_year}-{selected_month}.png")
@@ -133,7 +158,10 @@ class MainWindow(QMainWindow):
             if hovered_day in logs[selected_log].years[selected_year].months[selected_month].days and hovered_hour in logs[selected_log].years[selected_year].months[selected_month].days[hovered_day].hours:
                 hour_data = logs[selected_log].years[selected_year].months[selected_month].days[hovered_day].hours[hovered_hour]
                 score = logs[selected_log].years[selected_year].months[selected_month].score_hour(logs[selected_log].years[selected_year].months[selected_month].days[hovered_day].hours[hovered_hour]) * -1
-                self.info_label.setText(f"jitter: {hour_data.average_jitter:<3.1f}  loss: {hour_data.average_packetloss_rate:<3.3f}  score: {score:<3.0f}")
+                text = f"jitter: {hour_data.average_jitter:<3.1f}  loss: {hour_data.average_packetloss_rate:<3.3f}  score: {score:<3.0f}"
+                if hour_data.percentiles is not None:
+                    text += "  p50/p95/p99: {:.1f}/{:.1f}/{:.1f}".format(*hour_data.percentiles)
+                self.info_label.setText(text)
             else:
                 self.info_label.setText("")
 
@@ -162,7 +190,7 @@ class MainWindow(QMainWindow):
 
     def get_next_key(self):
         global selected_log
-        keys = list(logs.keys())
+        keys = loaded_log_keys()
         try:
             current_index = keys.index(selected_log)
             next_index = (current_index + 1) % len(keys)
@@ -172,7 +200,7 @@ class MainWindow(QMainWindow):
 
     def get_previous_key(self):
         global selected_log
-        keys = list(logs.keys())
+        keys = loaded_log_keys()
         try:
             current_index = keys.index(selected_log)
             previous_index = (current_index - 1) % len(keys)
@@ -192,7 +220,7 @@ class MainWindow(QMainWindow):
 
         latest_month_with_data = 0
         for key in logs[selected_log].years[latest_year].months.keys():
-            if len(logs[selected_log].years[latest_year].months[key].days) > 0 and key > latest_month_with_data:
+            if logs[selected_log].years[latest_year].months[key].has_data and key > latest_month_with_data:
                 latest_month_with_data = key
         selected_year = latest_year
         selected_month = latest_month_with_data
@@ -250,158 +278,60 @@ class MainWindow(QMainWindow):
             print("selected log or selected year does not exist")
             return
 
-        if logs[selected_log].years[selected_year].months[selected_month].image_data is None:
-            logs[selected_log].years[selected_year].months[selected_month].create_month_image()
-
-        if MainWindow.instance.image_item is None:
-            MainWindow.instance.image_item = pg.ImageItem(image=logs[selected_log].years[selected_year].months[selected_month].image_data)
-        else:
-            MainWindow.instance.image_item.setImage(image=logs[selected_log].years[selected_year].months[selected_month].image_data)
+        image_data = month_images.get(logs[selected_log], selected_year, selected_month)
+        MainWindow.instance.image_item.setImage(image=image_data)
         MainWindow.instance.plot_widget.getAxis('left').setTicks(
             [[(i, str(i)) for i in range(logs[selected_log].years[selected_year].months[selected_month].amt_of_days)]])
         label_text = selected_log
-        if ip_name_dict[logs[selected_log].filename] is not None:
+        if ip_name_dict.get(logs[selected_log].filename) is not None:
             label_text = ip_name_dict[logs[selected_log].filename]
         self.file_label.setText(label_text)
         self.time_label.setText(f"{str(selected_year)} {self.month_number_to_name(selected_month)}")
         self.info_label.setText("")
+        prefetcher.submit(prefetch_around, selected_log, selected_year, selected_month)
 
 
-logs = {}
 ip_name_dict = {}
+month_images = MonthImageCache(MONTH_IMAGE_CACHE_SIZE)
+prefetcher = ThreadPoolExecutor(max_workers=1)
 
-class LogData:
-    def __init__(self, filename):
-        self.filename = filename
-        self.years = {}
-
-class Year:
-    def __init__(self, year):
-        self.year = year
-        self.months = {
-            1: Month(31),
-            2: Month(29 if self.is_leap_year() else 28),
-            3: Month(31),
-            4: Month(30),
-            5: Month(31),
-            6: Month(30),
-            7: Month(31),
-            8: Month(31),
-            9: Month(30),
-            10: Month(31),
-            11: Month(30),
-            12: Month(31)
-        }
 
-    def is_leap_year(self):
-        return self.year % 4 == 0 and (self.year % 100 != 0 or self.year % 400 == 0)
-
-class Month:
-    def __init__(self, days):
-        self.amt_of_days = days
-        self.days = {}
-        self.image_data = None
-
-    def create_month_image(self):
-        data = np.zeros((24, self.amt_of_days, 4), dtype=np.uint8)
-        for i in range(self.amt_of_days):
-            for j in range(24):
-                multiplier = -1
-                if i in self.days and j in self.days[i].hours:
-                    multiplier = self.score_hour(self.days[i].hours[j])
-                if multiplier == -1:
-                    data[j, i] = [0, 0, 0, 255]
-                elif multiplier == 0:
-                    data[j, i] = [0, 255, 0, 255]
-                else:
-                    multiplier = min(100, multiplier)
-                    data[j, i] = [multiplier * 2.55, 220 - (2.2 * multiplier), 0, 255]
-        self.image_data = data
+class LogLoader(QObject):
+    # loads the logs with load_logs_parallel on a background thread, loaded is emitted (in the gui thread)
+    # with the key of every log that is ready and the progress
+    loaded = pyqtSignal(str, int, int)
 
+    def start(self):
+        thread = threading.Thread(target=self.run, name="log-loader")
+        thread.daemon = True
+        thread.start()
 
-    @staticmethod
-    def score_hour(hour):
-        if hour.amount_of_data_points < 50:
-            return -1
-        if hour.average_packetloss_rate == 0 and hour.average_jitter < 1.0:
-            return 0
-        return ((hour.average_jitter / 12) * 100) + ((hour.average_packetloss_rate / 0.05) * 100)   # return min((hour.average_jitter / 20) * 100 + (hour.average_packetloss_rate / 0.1) * 100, 100)
+    def run(self):
+        log_list = list(logs.values())
+        for done, log in enumerate(load_logs_parallel(log_list, LOAD_JOBS), 1):
+            self.loaded.emit(log.filename, done, len(log_list))
 
-class Day:
-    def __init__(self):
-        self.hours = {}
-
-class Hour:
-    def __init__(self, average_jitter, average_packetloss_rate, amount_of_data_points):
-        self.average_jitter = average_jitter
-        self.average_packetloss_rate = average_packetloss_rate
-        self.amount_of_data_points = amount_of_data_points
-
-
-
-def load_all_logs():
-    for filename in os.listdir(os.getcwd()):
-        if pattern.match(filename):
-            filepath = os.path.join(directory, filename)
-            load_log(filepath)
-
-def load_log(filepath):
-    #print(filepath)
-    with open(filepath, 'r') as file:
-        datetime_of_timestamp = None
-        amount_of_data_points = 0
-        accumulated_jitter = 0
-        accumulated_packetloss = 0.0
-        invalid_data_points = 0
-
-        for line in file:
-            parts = line.strip().split(';')
-            if len(parts) == 5:
-                try:
-                    # parse out the values of this line
-                    timestamp = float(parts[0])
-                    average_ping = int(parts[1])
-                    minimum_ping = int(parts[2])
-                    maximum_ping = int(parts[3])
-                    packetloss_rate = float(parts[4])
-
-                    #Add the values to the data of the current hour
-                    datetime_of_packet = datetime.fromtimestamp(timestamp)
-                    if datetime_of_timestamp is None: # if this is the first line in this file
-                        datetime_of_timestamp = datetime_of_packet
-                    if not (datetime_of_timestamp.year == datetime_of_packet.year #  if we are starting a new hour then send the accumulated data away, reset the hour stats and start a new one
-                        and datetime_of_timestamp.month == datetime_of_packet.month
-                        and datetime_of_timestamp.day == datetime_of_packet.day
-                        and datetime_of_timestamp.hour == datetime_of_packet.hour):
-
-                        average_packetloss_rate = accumulated_packetloss / amount_of_data_points
-                        average_jitter = accumulated_jitter / max(1, (amount_of_data_points - invalid_data_points))
-                        add_processed_hour(filepath, datetime_of_timestamp, average_jitter, average_packetloss_rate, amount_of_data_points)
-                        amount_of_data_points = 0
-                        accumulated_jitter = 0
-                        accumulated_packetloss = 0.0
-                        datetime_of_timestamp = datetime_of_packet
-                        invalid_data_points = 0
-                    # add the data of the current line
-                    if average_ping != -1:
-                        accumulated_jitter += (maximum_ping - minimum_ping)
-                    else:
-                        invalid_data_points += 1
-                    amount_of_data_points += 1
-                    accumulated_packetloss += packetloss_rate
-                except ValueError:
-                    continue
-
-def add_processed_hour(filepath, datetime, average_jitter, average_packetloss_rate, amount_of_data_points):
-    # add the stats of this hour to the tree of years, months, days
-    #print(f"{datetime.year}:{datetime.month}:{datetime.day}:{datetime.hour}: [{amount_of_data_points}, {average_jitter}, {average_packetloss_rate}]")
-    if filepath not in logs:
-        logs[filepath] = LogData(filepath)
-    if datetime.year not in logs[filepath].years:
-        logs[filepath].years[datetime.year] = Year(datetime.year)
-    if datetime.day not in logs[filepath].years[datetime.year].months[datetime.month].days:
-        logs[filepath].years[datetime.year].months[datetime.month].days[datetime.day] = Day()
-    logs[filepath].years[datetime.year].months[datetime.month].days[datetime.day].hours[datetime.hour] = Hour(average_jitter, average_packetloss_rate, amount_of_data_points)
+
+def loaded_log_keys():
+    # logs that are still loading are skipped by the log buttons
+    return [key for key, log in logs.items() if log.is_loaded]
+
+
+def prefetch_around(log_key, year, month):
+    # renders the months the previous/next buttons lead to in the background, so they show up instantly
+    keys = loaded_log_keys()
+    index = keys.index(log_key)
+    log = logs[log_key]
+    for target_year, target_month in ((year, month + 1), (year, month - 1)):
+        if target_month > 12:
+            target_year, target_month = min(filter(lambda x: x > year, log.years.keys()), default=None), 1
+        elif target_month < 1:
+            target_year, target_month = max(filter(lambda x: x < year, log.years.keys()), default=None), 12
+        if target_year in log.years:
+            month_images.get(log, target_year, target_month)
+    for neighbour in {keys[(index + 1) % len(keys)], keys[(index - 1) % len(keys)]}:
+        if year in logs[neighbour].years:
+            month_images.get(logs[neighbour], year, month)
 
 
 def parse_servertxt_file(file_path):
@@ -414,7 +344,10 @@ def parse_servertxt_file(file_path):
                 if len(parts) >= 2:
                     ip_part = parts[0]
                     name_part = parts[1]
-                    processed_ip = ip_part.replace('.', '_') + '_log.txt'
+                    processed_ip = ip_part.replace('.', '_')
+                    result_dict[processed_ip + '_log.txt'] = name_part
+                    result_dict[processed_ip + BinaryLog.BINARY_SUFFIX] = name_part
+                    # the directory of a partitioned log
                     result_dict[processed_ip] = name_part
                 else:
                     print(f"Skipping malformed line: {line}")
@@ -429,9 +362,12 @@ def parse_servertxt_file(file_path):
 
 
 if __name__ == '__main__':
-    load_all_logs()
+    load_all_logs(directory)
     ip_name_dict = parse_servertxt_file('servers.txt')
     app = QApplication(sys.argv)
     window = MainWindow()
     window.show()
+    loader = LogLoader()
+    loader.loaded.connect(window.on_log_loaded)
+    loader.start()
     sys.exit(app.exec_())
@@ -0,0 +1,163 @@
+import threading
+
+import numpy as np
+
+# Prometheus text exposition (version 0.0.4) of the probe results and of the collector itself, served at /metrics
+# by the QueryServer. The lines of a server are rendered once per new sample and cached, a scrape only joins
+# the cached lines and renders the handful of self metrics, so frequent scrapes of many servers stay cheap.
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+PREFIX = "statmonitor_"
+RTT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000)
+
+SERVER_FAMILIES = (
+    ("ping_avg_milliseconds", "gauge", "Average round trip time of the last probe"),
+    ("ping_min_milliseconds", "gauge", "Minimum round trip time of the last probe"),
+    ("ping_max_milliseconds", "gauge", "Maximum round trip time of the last probe"),
+    ("jitter_milliseconds", "gauge", "Difference between maximum and minimum round trip time of the last probe"),
+    ("rfc3550_jitter_milliseconds", "gauge", "RFC 3550 interarrival jitter of the answered echos"),
+    ("packet_loss_ratio", "gauge", "Share of lost echo requests of the last probe"),
+    ("last_success_timestamp_seconds", "gauge", "Time of the last probe with at least one answer"),
+    ("probes_total", "counter", "Probes since the collector started"),
+    ("ping_rtt_milliseconds", "histogram", "Average round trip time per probe"),
+)
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_number(value):
+    if value != value:
+        return "NaN"
+    return repr(float(value))
+
+
+class ServerMetrics:
+    # the cumulative state of one server and its rendered lines, keyed by family name
+    def __init__(self, server):
+        self.server = server
+        self.labels = f'host="{escape_label(server.address)}",description="{escape_label(server.description)}"'
+        self.sequence = None
+        self.last_time = -np.inf
+        self.probes = 0
+        self.last_success = np.nan
+        self.bucket_counts = np.zeros(len(RTT_BUCKETS) + 1, dtype=np.int64)
+        self.rtt_sum = 0.0
+        self.rtt_count = 0
+        self.lines = {name: "" for name, _, _ in SERVER_FAMILIES}
+
+    def update(self):
+        sequence = self.server.sequence
+        if sequence == self.sequence:
+            return
+        self.sequence = sequence
+        time_data, avg, minimum, maximum, jitter, loss, rfc_jitter = self.server.samples.views(
+            "time", "avg", "min", "max", "jitter", "loss", "rfc_jitter")
+        # samples are selected by time instead of sequence, a sample that is appended meanwhile is picked up next time
+        first = np.searchsorted(time_data, self.last_time, side='right')
+        if first == len(time_data):
+            return
+        self.last_time = time_data[-1]
+        self.probes += len(time_data) - first
+        new_avg = avg[first:]
+        answered = new_avg >= 0
+        if answered.any():
+            self.last_success = time_data[first:][answered][-1]
+            rtts = new_avg[answered]
+            self.bucket_counts += np.bincount(np.searchsorted(RTT_BUCKETS, rtts, side='left'),
+                                              minlength=len(self.bucket_counts))
+            self.rtt_sum += float(rtts.sum())
+            self.rtt_count += len(rtts)
+        self.render(avg[-1], minimum[-1], maximum[-1], jitter[-1], loss[-1] / 100, rfc_jitter[-1])
+
+    def render(self, avg, minimum, maximum, jitter, loss_ratio, rfc_jitter):
+        labels = self.labels
+        # a probe without any answer is stored with -1 round trip times
+        rtt_values = (avg, minimum, maximum, jitter) if avg >= 0 else (np.nan,) * 4
+        for name, value in zip(("ping_avg_milliseconds", "ping_min_milliseconds", "ping_max_milliseconds",
+                                "jitter_milliseconds"), rtt_values):
+            self.lines[name] = f"{PREFIX}{name}{{{labels}}} {format_number(value)}\n"
+        self.lines["rfc3550_jitter_milliseconds"] = \
+            f"{PREFIX}rfc3550_jitter_milliseconds{{{labels}}} {format_number(rfc_jitter)}\n"
+        self.lines["packet_loss_ratio"] = f"{PREFIX}packet_loss_ratio{{{labels}}} {format_number(loss_ratio)}\n"
+        self.lines["last_success_timestamp_seconds"] = \
+            f"{PREFIX}last_success_timestamp_seconds{{{labels}}} {format_number(self.last_success)}\n"
+        self.lines["probes_total"] = f"{PREFIX}probes_total{{{labels}}} {self.probes}\n"
+
+        histogram = []
+        cumulative = np.cumsum(self.bucket_counts)
+        for bound, count in zip(RTT_BUCKETS, cumulative):
+            histogram.append(f'{PREFIX}ping_rtt_milliseconds_bucket{{{labels},le="{bound}"}} {count}\n')
+        histogram.append(f'{PREFIX}ping_rtt_milliseconds_bucket{{{labels},le="+Inf"}} {cumulative[-1]}\n')
+        histogram.append(f"{PREFIX}ping_rtt_milliseconds_sum{{{labels}}} {format_number(self.rtt_sum)}\n")
+        histogram.append(f"{PREFIX}ping_rtt_milliseconds_count{{{labels}}} {self.rtt_count}\n")
+        self.lines["ping_rtt_milliseconds"] = "".join(histogram)
+
+
+class MetricsExporter:
+    def __init__(self, servers, scheduler=None, flush_thread=None):
+        self.servers = servers
+        self.scheduler = scheduler
+        self.flush_thread = flush_thread
+        self.server_metrics = {}
+        self.lock = threading.Lock()
+        self.headers = {name: f"# HELP {PREFIX}{name} {text}\n# TYPE {PREFIX}{name} {kind}\n"
+                        for name, kind, text in SERVER_FAMILIES}
+
+    def handle_metrics(self, query):
+        # QueryServer route
+        return CONTENT_TYPE, self.render().encode()
+
+    def render(self):
+        with self.lock:
+            for server in self.servers:
+                metrics = self.server_metrics.get(server)
+                if metrics is None:
+                    metrics = self.server_metrics[server] = ServerMetrics(server)
+                metrics.update()
+            parts = []
+            for name, _, _ in SERVER_FAMILIES:
+                parts.append(self.headers[name])
+                parts.extend(self.server_metrics[server].lines[name] for server in self.servers)
+        parts.append(self.render_self_metrics())
+        return "".join(parts)
+
+    def render_self_metrics(self):
+        lines = []
+
+        def add(name, kind, text, samples):
+            lines.append(f"# HELP {PREFIX}{name} {text}\n# TYPE {PREFIX}{name} {kind}\n")
+            for labels, value in samples:
+                lines.append(f"{PREFIX}{name}{{{labels}}} {format_number(value)}\n" if labels
+                             else f"{PREFIX}{name} {format_number(value)}\n")
+
+        if self.scheduler is not None:
+            metrics = self.scheduler.get_metrics()
+            add("probe_cycles_total", "counter", "Finished probe cycles", [("", metrics["completed_jobs"])])
+            add("probe_cycle_seconds_total", "counter", "Time spent in probe cycles", [("", metrics["probe_seconds"])])
+            add("probe_overruns_total", "counter", "Probe cycles that took longer than their interval",
+                [("", metrics["overruns"])])
+            add("schedule_lateness_seconds", "gauge", "Delay between the due time and the start of recent probe cycles",
+                [('stat="mean"', metrics["mean_lateness"]), ('stat="p95"', metrics["p95_lateness"]),
+                 ('stat="max"', metrics["max_lateness"])])
+            add("probe_throttled_total", "counter", "Probe cycles that had to wait for the packet budget",
+                [("", metrics["throttled_jobs"])])
+            add("probe_queue_depth", "gauge", "Probe cycles that are due but wait for a worker", [("", metrics["queue_depth"])])
+            add("probe_active_jobs", "gauge", "Probe cycles that are running", [("", metrics["active_jobs"])])
+
+        writers = [server for server in self.servers if getattr(server, "writer", None) is not None]
+        if writers:
+            add("writer_flushes_total", "counter", "Chunks written to the log file",
+                [(self.labels_of(server), server.writer.flush_count) for server in writers])
+            add("writer_flushed_bytes_total", "counter", "Bytes written to the log file",
+                [(self.labels_of(server), server.writer.flushed_bytes) for server in writers])
+            add("writer_flush_seconds_total", "counter", "Time spent writing to the log file",
+                [(self.labels_of(server), server.writer.flush_seconds) for server in writers])
+        if self.flush_thread is not None:
+            add("writer_queue_depth", "gauge", "Chunks waiting for the flush thread", [("", self.flush_thread.queue_depth())])
+        return "".join(lines)
+
+    def labels_of(self, server):
+        metrics = self.server_metrics.get(server)
+        return metrics.labels if metrics is not None else f'host="{escape_label(server.address)}"'
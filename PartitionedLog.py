@@ -0,0 +1,190 @@
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from BufferedWriter import BufferedWriter
+from LogCompression import compress, is_compressed
+
+# A partitioned log is a directory per server (e.g. 10_0_0_1/) with one file per local month or day:
+# 2026-10.log, 2026-10-18.log, or .bin for binary logs. Closed partitions are compressed in the background
+# and partitions older than the retention are deleted, so reading a month only touches that month.
+PARTITION_PATTERN = re.compile(r'^(\d{4})-(\d{2})(?:-(\d{2}))?\.(log|bin)(\.gz|\.zst)?$')
+GRANULARITIES = ("month", "day")
+
+
+class Partition:
+    def __init__(self, directory, filename):
+        self.path = os.path.join(directory, filename)
+        self.filename = filename
+        year, month, day, _, _ = PARTITION_PATTERN.match(filename).groups()
+        self.year = int(year)
+        self.month = int(month)
+        self.day = int(day) if day is not None else None
+        self.key = filename.split('.', 1)[0]
+        self.compressed = is_compressed(filename)
+
+    def end_date(self):
+        # the first local date that isn't part of the partition anymore
+        if self.day is not None:
+            return date(self.year, self.month, self.day) + timedelta(days=1)
+        return date(self.year + self.month // 12, self.month % 12 + 1, 1)
+
+
+def partition_key(time_in_sec, granularity="month"):
+    local = time.localtime(time_in_sec)
+    if granularity == "day":
+        return f"{local.tm_year:04d}-{local.tm_mon:02d}-{local.tm_mday:02d}"
+    return f"{local.tm_year:04d}-{local.tm_mon:02d}"
+
+
+def list_partitions(directory):
+    # partitions sorted by key. if a crash left a partition both plain and compressed, the plain file is used
+    partitions = {}
+    for filename in os.listdir(directory):
+        if PARTITION_PATTERN.match(filename):
+            partition = Partition(directory, filename)
+            known = partitions.get(partition.key)
+            if known is None or (known.compressed and not partition.compressed):
+                partitions[partition.key] = partition
+    return [partitions[key] for key in sorted(partitions)]
+
+
+def is_partition_directory(path):
+    try:
+        return os.path.isdir(path) and any(PARTITION_PATTERN.match(filename) for filename in os.listdir(path))
+    except OSError:
+        return False
+
+
+_maintenance = None
+_maintenance_lock = threading.Lock()
+
+
+def get_maintenance_executor():
+    # one background thread compresses and deletes the partitions of every writer
+    global _maintenance
+    with _maintenance_lock:
+        if _maintenance is None:
+            _maintenance = ThreadPoolExecutor(max_workers=1, thread_name_prefix="log-maintenance")
+        return _maintenance
+
+
+def maintain(directory, current_key, compression=None, retention_days=None):
+    # compresses the closed partitions and removes those that ended more than retention_days ago,
+    # together with the files derived from them (like rollup caches)
+    try:
+        partitions = list_partitions(directory)
+    except OSError as e:
+        print(f"[Partitioned Log] listing {directory} failed with error: {e}")
+        return
+    cutoff = date.today() - timedelta(days=retention_days) if retention_days is not None else None
+    for partition in partitions:
+        try:
+            if cutoff is not None and partition.key != current_key and partition.end_date() <= cutoff:
+                remove_derived_files(directory, partition.filename.split('.', 1)[0] + '.')
+            elif compression is not None and partition.key != current_key and not partition.compressed:
+                compressed = compress(partition.path, compression)
+                remove_derived_files(directory, partition.filename + '.', keep=os.path.basename(compressed))
+        except OSError as e:
+            print(f"[Partitioned Log] maintaining {partition.path} failed with error: {e}")
+
+
+def remove_derived_files(directory, prefix, keep=None):
+    for filename in os.listdir(directory):
+        if filename.startswith(prefix) and filename != keep:
+            os.remove(os.path.join(directory, filename))
+
+
+class PartitionedWriter:
+    # Same interface as BufferedWriter, but every line goes to the partition of its timestamp.
+    # When a line opens a new partition, the previous one is flushed and closed and handed to the maintenance thread.
+    # Partitions only move forward: a line from before the current partition (the clock was set back) is
+    # written to the current one, so a closed partition is never reopened.
+    def __init__(self, directory, granularity="month", binary=False, header=None, compression="gzip",
+                 retention_days=None, buffer_size=4 * 1024, max_age=600):
+        self.directory = directory
+        self.granularity = granularity
+        self.binary = binary
+        self.header = header
+        self.compression = compression
+        self.retention_days = retention_days
+        self.buffer_size = buffer_size
+        self.max_age = max_age
+        self.suffix = ".bin" if binary else ".log"
+        self.key = None
+        self.writer = None
+        self.lock = threading.Lock()
+        # statistics of the partitions that were closed already
+        self.closed_flush_count = 0
+        self.closed_flushed_bytes = 0
+        self.closed_flush_seconds = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def filename(self):
+        # the partition that is currently written to
+        with self.lock:
+            if self.key is None:
+                return None
+            return self.partition_path(self.key)
+
+    def partition_path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def write(self, line, time_in_sec=None):
+        key = partition_key(time.time() if time_in_sec is None else time_in_sec, self.granularity)
+        with self.lock:
+            if self.key is None or key > self.key:
+                self.rotate(key)
+            writer = self.writer
+        writer.write(line)
+
+    def rotate(self, key):
+        # called with the lock held. the first partition continues the newest one of an earlier run
+        if self.key is None:
+            key = max([key] + [partition.key for partition in list_partitions(self.directory)])
+        closed = self.writer
+        self.writer = BufferedWriter(self.partition_path(key), self.buffer_size, max_age=self.max_age, binary=self.binary,
+                                     header=self.header)
+        self.key = key
+        if closed is not None:
+            closed.close()
+            self.closed_flush_count += closed.flush_count
+            self.closed_flushed_bytes += closed.flushed_bytes
+            self.closed_flush_seconds += closed.flush_seconds
+        # compresses the partition just closed, or those left over from earlier runs
+        get_maintenance_executor().submit(maintain, self.directory, key, self.compression, self.retention_days)
+
+    def flush(self):
+        with self.lock:
+            writer = self.writer
+        if writer is not None:
+            writer.flush()
+
+    def close(self):
+        with self.lock:
+            writer = self.writer
+        if writer is not None:
+            writer.close()
+
+    def files_between(self, start, end):
+        # the partition files that can hold lines with start <= time < end
+        first = partition_key(max(0, start), self.granularity)
+        last = partition_key(end, self.granularity) if end != float("inf") else None
+        return [partition.path for partition in list_partitions(self.directory)
+                if partition.key >= first[:len(partition.key)] and (last is None or partition.key <= last[:len(partition.key)])]
+
+    @property
+    def flush_count(self):
+        return self.closed_flush_count + (self.writer.flush_count if self.writer is not None else 0)
+
+    @property
+    def flushed_bytes(self):
+        return self.closed_flushed_bytes + (self.writer.flushed_bytes if self.writer is not None else 0)
+
+    @property
+    def flush_seconds(self):
+        return self.closed_flush_seconds + (self.writer.flush_seconds if self.writer is not None else 0.0)
@@ -0,0 +1,160 @@
+import re
+import sys
+import time
+
+# Parses the output of the ping binaries we fall back to when raw ICMP isn't permitted:
+# iputils and busybox (linux), BSD/macOS and Windows in English and German.
+# All patterns are alternatives of one precompiled expression, so an output is scanned exactly once.
+# Run this module to check the fixtures below and measure the throughput.
+
+# (name, pattern) of everything we take from an output. Group names are prefixed with the name of their pattern.
+PATTERNS = (
+    # one line per answered echo: "time=12.3 ms", "Zeit=12ms", "time<1ms"
+    ("reply", r"\b(?:time|Zeit)(?P<reply_operator>[=<])\s*(?P<reply_rtt>\d+(?:[.,]\d+)?)\s*ms"),
+    # iputils "rtt min/avg/max/mdev = ...", busybox "round-trip min/avg/max = ...", BSD "round-trip min/avg/max/stddev = ..."
+    ("unix_summary", r"(?:rtt|round-trip) min/avg/max(?:/[a-z-]+)? = (?P<unix_summary_minimum>[\d.]+)/"
+                     r"(?P<unix_summary_average>[\d.]+)/(?P<unix_summary_maximum>[\d.]+)"),
+    # "5 packets transmitted, 4 received" (iputils), "5 packets transmitted, 4 packets received" (busybox, BSD)
+    ("unix_count", r"(?P<unix_count_sent>\d+) packets transmitted, (?P<unix_count_received>\d+) (?:packets )?received"),
+    # "Minimum = 1ms, Maximum = 3ms, Average = 2ms" / "Mittelwert = 2ms"
+    ("windows_summary", r"Minimum = (?P<windows_summary_minimum>\d+)ms, Maximum = (?P<windows_summary_maximum>\d+)ms, "
+                        r"(?:Average|Mittelwert) = (?P<windows_summary_average>\d+)ms"),
+    # "Sent = 4, Received = 3, Lost = 1" / "Gesendet = 4, Empfangen = 3, Verloren = 1"
+    ("windows_count", r"(?:Sent|Gesendet) = (?P<windows_count_sent>\d+), (?:Received|Empfangen) = "
+                      r"(?P<windows_count_received>\d+), (?:Lost|Verloren) = (?P<windows_count_lost>\d+)"),
+)
+PATTERN = re.compile("|".join(f"(?P<{name}>{pattern})" for name, pattern in PATTERNS))
+
+
+class ParsedPing:
+    def __init__(self):
+        self.rtts = []
+        self.sent = None
+        self.lost = None
+        self.minimum = -1.0
+        self.average = -1.0
+        self.maximum = -1.0
+
+
+def to_float(text):
+    return float(text.replace(',', '.'))
+
+
+def parse(output):
+    parsed = ParsedPing()
+    for match in PATTERN.finditer(output):
+        kind = match.lastgroup
+        if kind == "reply":
+            parsed.rtts.append(0.0 if match.group("reply_operator") == '<' else to_float(match.group("reply_rtt")))
+        elif kind == "unix_summary" or kind == "windows_summary":
+            parsed.minimum = float(match.group(kind + "_minimum"))
+            parsed.average = float(match.group(kind + "_average"))
+            parsed.maximum = float(match.group(kind + "_maximum"))
+        elif kind == "unix_count":
+            parsed.sent = int(match.group("unix_count_sent"))
+            parsed.lost = parsed.sent - int(match.group("unix_count_received"))
+        elif kind == "windows_count":
+            parsed.sent = int(match.group("windows_count_sent"))
+            parsed.lost = int(match.group("windows_count_lost"))
+    return parsed
+
+
+# output -> (rtts, sent, lost, minimum, average, maximum)
+FIXTURES = {
+    "iputils": ("""PING 10.0.0.1 (10.0.0.1) 56(84) bytes of data.
+64 bytes from 10.0.0.1: icmp_seq=1 ttl=64 time=0.046 ms
+64 bytes from 10.0.0.1: icmp_seq=2 ttl=64 time=0.061 ms
+64 bytes from 10.0.0.1: icmp_seq=4 ttl=64 time=12.3 ms
+
+--- 10.0.0.1 ping statistics ---
+4 packets transmitted, 3 received, 25% packet loss, time 3054ms
+rtt min/avg/max/mdev = 0.046/4.135/12.300/5.775 ms
+""", ([0.046, 0.061, 12.3], 4, 1, 0.046, 4.135, 12.3)),
+    "iputils unreachable": ("""PING 10.255.0.1 (10.255.0.1) 56(84) bytes of data.
+From 10.0.0.2 icmp_seq=1 Destination Host Unreachable
+
+--- 10.255.0.1 ping statistics ---
+5 packets transmitted, 0 received, +1 errors, 100% packet loss, time 4100ms
+""", ([], 5, 5, -1.0, -1.0, -1.0)),
+    "busybox": ("""PING 10.0.0.1 (10.0.0.1): 56 data bytes
+64 bytes from 10.0.0.1: seq=0 ttl=64 time=0.095 ms
+64 bytes from 10.0.0.1: seq=1 ttl=64 time=0.061 ms
+
+--- 10.0.0.1 ping statistics ---
+2 packets transmitted, 2 packets received, 0% packet loss
+round-trip min/avg/max = 0.061/0.078/0.095 ms
+""", ([0.095, 0.061], 2, 0, 0.061, 0.078, 0.095)),
+    "macos": ("""PING 10.0.0.1 (10.0.0.1): 56 data bytes
+64 bytes from 10.0.0.1: icmp_seq=0 ttl=57 time=14.306 ms
+Request timeout for icmp_seq 1
+64 bytes from 10.0.0.1: icmp_seq=2 ttl=57 time=16.011 ms
+
+--- 10.0.0.1 ping statistics ---
+3 packets transmitted, 2 packets received, 33.3% packet loss
+round-trip min/avg/max/stddev = 14.306/15.158/16.011/0.853 ms
+""", ([14.306, 16.011], 3, 1, 14.306, 15.158, 16.011)),
+    "windows english": ("""
+Pinging 10.0.0.1 with 32 bytes of data:
+Reply from 10.0.0.1: bytes=32 time=14ms TTL=57
+Reply from 10.0.0.1: bytes=32 time<1ms TTL=57
+Request timed out.
+Reply from 10.0.0.1: bytes=32 time=16ms TTL=57
+
+Ping statistics for 10.0.0.1:
+    Packets: Sent = 4, Received = 3, Lost = 1 (25% loss),
+Approximate round trip times in milli-seconds:
+    Minimum = 0ms, Maximum = 16ms, Average = 10ms
+""", ([14.0, 0.0, 16.0], 4, 1, 0.0, 10.0, 16.0)),
+    "windows german": ("""
+Ping wird ausgeführt für 10.0.0.1 mit 32 Bytes Daten:
+Antwort von 10.0.0.1: Bytes=32 Zeit=14ms TTL=57
+Antwort von 10.0.0.1: Bytes=32 Zeit=15ms TTL=57
+
+Ping-Statistik für 10.0.0.1:
+    Pakete: Gesendet = 2, Empfangen = 2, Verloren = 0
+    (0% Verlust),
+Ca. Zeitangaben in Millisek.:
+    Minimum = 14ms, Maximum = 15ms, Mittelwert = 14ms
+""", ([14.0, 15.0], 2, 0, 14.0, 14.0, 15.0)),
+    "windows german unreachable": ("""
+Ping wird ausgeführt für 10.255.0.1 mit 32 Bytes Daten:
+Zeitüberschreitung der Anforderung.
+Zeitüberschreitung der Anforderung.
+
+Ping-Statistik für 10.255.0.1:
+    Pakete: Gesendet = 2, Empfangen = 0, Verloren = 2
+    (100% Verlust),
+""", ([], 2, 2, -1.0, -1.0, -1.0)),
+    "no output": ("", ([], None, None, -1.0, -1.0, -1.0)),
+}
+
+
+def check_fixtures():
+    failed = 0
+    for name, (output, expected) in FIXTURES.items():
+        parsed = parse(output)
+        got = (parsed.rtts, parsed.sent, parsed.lost, parsed.minimum, parsed.average, parsed.maximum)
+        if got != expected:
+            print(f"{name}: expected {expected}, got {got}")
+            failed += 1
+    print(f"{len(FIXTURES) - failed}/{len(FIXTURES)} fixtures parsed correctly")
+    return failed
+
+
+def benchmark(seconds=1.0):
+    outputs = [output for output, _ in FIXTURES.values()]
+    size = sum(len(output) for output in outputs)
+    rounds = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        for output in outputs:
+            parse(output)
+        rounds += 1
+    elapsed = time.perf_counter() - started
+    print(f"{rounds * len(outputs) / elapsed:,.0f} outputs/s, {rounds * size / elapsed / 1e6:.1f} MB/s")
+
+
+if __name__ == '__main__':
+    failures = check_fixtures()
+    benchmark()
+    sys.exit(1 if failures else 0)
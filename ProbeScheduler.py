@@ -0,0 +1,222 @@
+import collections
+import heapq
+import itertools
+import random
+import threading
+import time
+
+from Profiler import PROFILER
+
+DEFAULT_CONCURRENCY = 16
+# threads that start cycles and record their results, a cycle in flight doesn't occupy one
+MAX_WORKERS = 16
+LATENESS_WINDOW = 256
+
+
+class ProbeScheduler:
+    # Starts the probe cycles of all servers and records their results on a fixed amount of worker threads.
+    # A cycle runs on the prober's event loop, so the workers never wait for one: the future of a started cycle
+    # hands its result back to the workers once it completes. At most concurrency cycles are in flight at once,
+    # further due jobs wait in the queue until one of them completes.
+    # Jobs wait in a priority queue keyed by their next due time, a server is never probed twice at once.
+    # max_packets_per_second caps the echo requests of all servers together with a token bucket,
+    # a probe that doesn't fit into the budget is postponed until enough tokens have accumulated.
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, jitter=0.1, max_packets_per_second=None):
+        self.concurrency = concurrency
+        self.jitter = jitter
+        self.throttled_jobs = 0
+        self.set_packet_budget(max_packets_per_second)
+        self.servers = []
+        self.queue = []
+        self.completed = collections.deque()  # (due, started, finished, server, future) of the finished cycles
+        self.order = itertools.count()
+        self.condition = threading.Condition()
+        self.workers = []
+        self.running = False
+        self.active_jobs = 0
+        self.lateness = collections.deque(maxlen=LATENESS_WINDOW)
+        self.max_lateness = 0.0
+        self.overruns = 0
+        self.completed_jobs = 0
+        self.probe_seconds = 0.0
+
+    def add_server(self, server):
+        with self.condition:
+            self.servers.append(server)
+            if self.running:
+                self.push(time.time() + random.uniform(0, server.ping_delay), server)
+
+    def start(self):
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+            # spread the first probes evenly across the interval, with a bit of jitter so hosts don't lock step
+            now = time.time()
+            count = len(self.servers)
+            for index, server in enumerate(self.servers):
+                phase = (index / count) * server.ping_delay
+                phase += random.uniform(0, self.jitter * server.ping_delay / max(1, count))
+                self.push(now + phase, server)
+        for i in range(min(self.concurrency, MAX_WORKERS)):
+            worker = threading.Thread(target=self.work, name=f"probe-worker-{i}")
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def stop(self, timeout=None):
+        # no probes are started anymore. with a timeout, waits up to that many seconds for the probes that are
+        # still running to finish and be recorded
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if timeout is not None:
+            deadline = time.time() + timeout
+            for worker in self.workers:
+                worker.join(max(0.0, deadline - time.time()))
+
+    def push(self, due, server):
+        heapq.heappush(self.queue, (due, next(self.order), server))
+        self.condition.notify()
+
+    def work(self):
+        while True:
+            with self.condition:
+                throttled = False
+                completed = None
+                while True:
+                    if self.completed:
+                        completed = self.completed.popleft()
+                        break
+                    if not self.running:
+                        if self.active_jobs == 0:
+                            # wakes the other workers up to return as well
+                            self.condition.notify_all()
+                            return
+                        self.condition.wait()
+                        continue
+                    if self.queue:
+                        wait = self.queue[0][0] - time.time()
+                        if wait <= 0 and self.active_jobs >= self.concurrency:
+                            # the next completed cycle frees a slot
+                            self.condition.wait()
+                            continue
+                        if wait <= 0:
+                            # the earliest due job keeps its place while it waits for the packet budget
+                            wait = self.take_tokens(self.queue[0][2].probe_plan()[0])
+                            if wait <= 0:
+                                break
+                            if not throttled:
+                                throttled = True
+                                self.throttled_jobs += 1
+                        self.condition.wait(wait)
+                    else:
+                        self.condition.wait()
+                if completed is None:
+                    due, _, server = heapq.heappop(self.queue)
+                    self.active_jobs += 1
+
+            if completed is None:
+                self.start_probe(due, server)
+            else:
+                self.finish_probe(*completed)
+
+    def start_probe(self, due, server):
+        started = time.time()
+        try:
+            future = server.start_probe()
+        except Exception as e:
+            print(f"Probing {server.address} failed with error: {e}")
+            self.finish_probe(due, started, time.time(), server, None)
+            return
+        future.add_done_callback(lambda future: self.complete(due, started, server, future))
+
+    def complete(self, due, started, server, future):
+        # called by the prober (on its event loop) when a cycle finished
+        with self.condition:
+            self.completed.append((due, started, time.time(), server, future))
+            self.condition.notify()
+
+    def finish_probe(self, due, started, finished, server, future):
+        if future is not None:
+            if PROFILER.enabled:
+                PROFILER.record("ping", finished - started)
+            try:
+                server.record_probe(started, future.result())
+            except Exception as e:
+                print(f"Probing {server.address} failed with error: {e}")
+
+        with self.condition:
+            self.active_jobs -= 1
+            self.completed_jobs += 1
+            self.record_lateness(started - due)
+            # a cycle that took longer than the delay is followed up immediately, like the old per server loop did
+            time_taken = finished - started
+            self.probe_seconds += time_taken
+            delay = server.next_delay()
+            if time_taken > delay:
+                self.overruns += 1
+                next_due = finished
+            else:
+                next_due = started + delay
+            if self.running:
+                self.push(next_due, server)
+
+    def set_packet_budget(self, max_packets_per_second):
+        # None removes the cap, the bucket starts full
+        self.max_packets_per_second = max_packets_per_second
+        self.tokens = float(max_packets_per_second or 0)
+        self.tokens_refilled = time.time()
+
+    def take_tokens(self, packets):
+        # called with the lock held, returns 0 if the packets fit into the budget or else how long to wait
+        if self.max_packets_per_second is None:
+            return 0
+        now = time.time()
+        capacity = max(self.max_packets_per_second, packets)
+        self.tokens = min(capacity, self.tokens + (now - self.tokens_refilled) * self.max_packets_per_second)
+        self.tokens_refilled = now
+        if self.tokens < packets:
+            return (packets - self.tokens) / self.max_packets_per_second
+        self.tokens -= packets
+        return 0
+
+    def record_lateness(self, lateness):
+        self.lateness.append(lateness)
+        if lateness > self.max_lateness:
+            self.max_lateness = lateness
+
+    def queue_depth(self):
+        # the amount of jobs that are due but wait for a free slot (or the packet budget)
+        now = time.time()
+        with self.condition:
+            return sum(1 for due, _, _ in self.queue if due <= now)
+
+    def get_metrics(self):
+        with self.condition:
+            lateness = sorted(self.lateness)
+            scheduled = len(self.queue)
+            active = self.active_jobs
+            overruns = self.overruns
+            completed = self.completed_jobs
+            throttled = self.throttled_jobs
+            probe_seconds = self.probe_seconds
+            max_lateness = self.max_lateness
+        metrics = {
+            "servers": len(self.servers),
+            "workers": self.concurrency,
+            "active_jobs": active,
+            "scheduled_jobs": scheduled,
+            "queue_depth": self.queue_depth(),
+            "completed_jobs": completed,
+            "probe_seconds": probe_seconds,
+            "overruns": overruns,
+            "throttled_jobs": throttled,
+            "max_lateness": max_lateness,
+            "mean_lateness": 0.0,
+            "p95_lateness": 0.0,
+        }
+        if lateness:
+            metrics["mean_lateness"] = sum(lateness) / len(lateness)
+            metrics["p95_lateness"] = lateness[min(len(lateness) - 1, int(len(lateness) * 0.95))]
+        return metrics
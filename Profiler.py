@@ -0,0 +1,234 @@
+import cProfile
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+
+# Timing spans around the hot stages of the monitor (ping, parse, log writes, flushes, redraws), aggregated
+# into a log2 histogram per stage. Off by default: span() then returns a shared no-op context manager.
+# Enable with STATMONITOR_PROFILE=1 (or Collector.py --profile). SIGUSR1, or Ctrl+Shift+P in the live graph,
+# writes a summary and, for STATMONITOR_PROFILE_WINDOW seconds, a sample of every thread's stack
+# (collapsed stacks, as flamegraph.pl reads them) or a cProfile of the gui thread (STATMONITOR_PROFILE_MODE=cprofile).
+ENV_ENABLED = "STATMONITOR_PROFILE"
+ENV_WINDOW = "STATMONITOR_PROFILE_WINDOW"
+ENV_MODE = "STATMONITOR_PROFILE_MODE"
+ENV_DIRECTORY = "STATMONITOR_PROFILE_DIR"
+MODES = ("sample", "cprofile")
+BUCKET_COUNT = 32  # bucket i counts spans shorter than 2^i microseconds (and not shorter than 2^(i-1))
+SAMPLE_INTERVAL_IN_SEC = 0.005
+
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    __slots__ = ("profiler", "name", "started")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.record(self.name, time.perf_counter() - self.started)
+        return False
+
+
+class Stage:
+    __slots__ = ("count", "total", "maximum", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.buckets = [0] * BUCKET_COUNT
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.maximum:
+            self.maximum = seconds
+        self.buckets[min(BUCKET_COUNT - 1, int(seconds * 1e6).bit_length())] += 1
+
+    def percentile(self, q):
+        # upper bound (seconds) of the bucket that holds the q quantile
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank and count:
+                return min(self.maximum, (1 << index) / 1e6)
+        return self.maximum
+
+
+class Profiler:
+    def __init__(self, enabled=False, window=0.0, mode="sample", directory=""):
+        self.enabled = enabled
+        self.window = window
+        self.mode = mode
+        self.directory = directory
+        self.stages = {}
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.capturing = False
+
+    @classmethod
+    def from_environment(cls):
+        return cls(os.environ.get(ENV_ENABLED, "") not in ("", "0", "off"),
+                   environment_window(),
+                   os.environ.get(ENV_MODE, "sample"),
+                   os.environ.get(ENV_DIRECTORY, ""))
+
+    def configure(self, enabled=None, window=None, mode=None, directory=None):
+        if enabled is not None:
+            self.enabled = enabled
+        if window is not None:
+            self.window = window
+        if mode is not None:
+            self.mode = mode
+        if directory is not None:
+            self.directory = directory
+
+    def span(self, name):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name)
+
+    def record(self, name, seconds):
+        with self.lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = self.stages[name] = Stage()
+            stage.add(seconds)
+
+    def summary(self):
+        with self.lock:
+            stages = {name: (stage.count, stage.total, stage.maximum, list(stage.buckets), stage)
+                      for name, stage in self.stages.items()}
+            elapsed = time.time() - self.started
+        lines = [f"stage span summary over {elapsed:.0f}s, times in ms",
+                 f"{'stage':18} {'count':>9} {'total':>10} {'mean':>9} {'p50<=':>9} {'p95<=':>9} {'p99<=':>9} {'max':>9}"]
+        for name, (count, total, maximum, buckets, stage) in sorted(stages.items(), key=lambda item: -item[1][1]):
+            lines.append(f"{name:18} {count:9d} {total * 1000:10.1f} {total / count * 1000:9.3f} "
+                         f"{stage.percentile(0.5) * 1000:9.3f} {stage.percentile(0.95) * 1000:9.3f} "
+                         f"{stage.percentile(0.99) * 1000:9.3f} {maximum * 1000:9.3f}")
+            used = [index for index, bucket_count in enumerate(buckets) if bucket_count]
+            lines.append("    " + "  ".join(f"<{format_micros(1 << index)}:{buckets[index]}"
+                                            for index in range(used[0], used[-1] + 1)))
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self.lock:
+            self.stages = {}
+            self.started = time.time()
+
+    def output_path(self, suffix):
+        return os.path.join(self.directory, f"profile-{time.strftime('%Y%m%d-%H%M%S')}{suffix}")
+
+    def dump(self, sample=True):
+        # writes the summary and, if a window is configured and sample is set, starts sampling the stacks
+        path = self.output_path(".txt")
+        try:
+            with open(path, 'w') as file:
+                file.write(self.summary())
+            print(f"[Profiler] summary written to {path}")
+        except OSError as e:
+            print(f"[Profiler] writing {path} failed with error: {e}")
+        if sample and self.window > 0 and self.mode == "sample":
+            self.start_sampling(self.window)
+        return path
+
+    def start_sampling(self, seconds):
+        with self.lock:
+            if self.capturing:
+                return
+            self.capturing = True
+        thread = threading.Thread(target=self.sample, args=(seconds,), name="profiler-sampler")
+        thread.daemon = True
+        thread.start()
+
+    def sample(self, seconds, interval=SAMPLE_INTERVAL_IN_SEC):
+        # counts the stacks of every other thread, the result is written as collapsed stacks
+        stacks = Counter()
+        own = threading.get_ident()
+        deadline = time.perf_counter() + seconds
+        try:
+            while time.perf_counter() < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == own:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                        frame = frame.f_back
+                    stacks[";".join([names.get(ident, str(ident))] + stack[::-1])] += 1
+                time.sleep(interval)
+            path = self.output_path(".stacks")
+            with open(path, 'w') as file:
+                for stack, count in stacks.most_common():
+                    file.write(f"{stack} {count}\n")
+            print(f"[Profiler] {sum(stacks.values())} stack samples written to {path}")
+        except OSError as e:
+            print(f"[Profiler] writing stack samples failed with error: {e}")
+        finally:
+            with self.lock:
+                self.capturing = False
+
+    def start_cprofile(self):
+        # profiles the calling thread until finish_cprofile is called on the same thread
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def finish_cprofile(self, profile):
+        profile.disable()
+        path = self.output_path(".pstats")
+        try:
+            profile.dump_stats(path)
+            with open(path + ".txt", 'w') as file:
+                pstats.Stats(profile, stream=file).sort_stats("cumulative").print_stats(60)
+            print(f"[Profiler] cProfile written to {path}")
+        except OSError as e:
+            print(f"[Profiler] writing {path} failed with error: {e}")
+
+    def install_signal_handler(self):
+        # SIGUSR1 dumps the summary, not available on windows
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, lambda signum, frame: self.dump())
+
+
+def format_micros(micros):
+    if micros >= 1000000:
+        return f"{micros // 1000000}s"
+    if micros >= 1000:
+        return f"{micros // 1000}ms"
+    return f"{micros}us"
+
+
+def environment_window():
+    # runs at import, so a bad value falls back to no window instead of stopping the program
+    value = os.environ.get(ENV_WINDOW, "")
+    try:
+        return float(value or 0)
+    except ValueError:
+        print(f"[Profiler] ignoring {ENV_WINDOW}={value!r}, it is not a number of seconds")
+        return 0.0
+
+
+PROFILER = Profiler.from_environment()
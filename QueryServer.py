@@ -0,0 +1,274 @@
+import asyncio
+import json
+import os
+import stat
+import threading
+import time
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+
+import BinaryLog
+from LogCompression import open_log
+from PartitionedLog import PartitionedWriter
+
+# A small HTTP/1.1 server inside the collector process, so dashboards and alerting can read the numbers
+# without parsing log files or scraping the GUI. It runs its own asyncio loop on one thread, bound to
+# localhost or a unix socket. Every answer is JSON except /history, which streams log lines.
+#
+#   GET /hosts                              latest sample of every server
+#   GET /stats?host=IP&window=SECONDS       p50/p95/max ping, loss and jitter over the last window,
+#                                           plus RFC 3550 jitter and rtt percentiles of the current hour
+# Loss is given in percent (loss_percent), unlike the 0-1 ratio of the /metrics packet_loss_ratio.
+#   GET /history?host=IP&start=T&end=T      log lines with start <= time < end (unix seconds), chunked
+#
+# Further routes, like the /metrics of the MetricsExporter, are added with add_route.
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8760
+DEFAULT_WINDOW_IN_SEC = 300
+HISTORY_BLOCK_BYTES = 1024 * 1024
+MAX_HEADER_BYTES = 16 * 1024
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}
+
+
+class QueryError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class QueryServer:
+    def __init__(self, servers, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_path=None):
+        self.servers = servers
+        self.host = host
+        self.port = port
+        self.unix_path = unix_path
+        self.loop = None
+        self.server = None
+        self.thread = None
+        # path -> handler(query), returning (content type, bytes or an iterator of bytes)
+        self.routes = {
+            "/hosts": self.handle_hosts,
+            "/stats": self.handle_stats,
+            "/history": self.handle_history,
+        }
+
+    def add_route(self, path, handler):
+        self.routes[path] = handler
+
+    def start(self):
+        started = threading.Event()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.run, args=(started,), name="query-server")
+        self.thread.daemon = True
+        self.thread.start()
+        started.wait()
+        if self.server is None:
+            raise OSError(f"query server could not listen on {self.address()}")
+
+    def address(self):
+        return self.unix_path if self.unix_path is not None else f"{self.host}:{self.port}"
+
+    def run(self, started):
+        asyncio.set_event_loop(self.loop)
+        try:
+            if self.unix_path is not None:
+                remove_socket(self.unix_path)
+                self.server = self.loop.run_until_complete(asyncio.start_unix_server(self.handle_connection, self.unix_path))
+            else:
+                self.server = self.loop.run_until_complete(asyncio.start_server(self.handle_connection, self.host, self.port))
+        except OSError as e:
+            print(f"[Query Server] listening on {self.address()} failed with error: {e}")
+            started.set()
+            return
+        started.set()
+        self.loop.run_forever()
+
+    def stop(self):
+        if self.loop is None or self.server is None:
+            return
+
+        async def close():
+            self.server.close()
+            await self.server.wait_closed()
+            self.loop.stop()
+
+        asyncio.run_coroutine_threadsafe(close(), self.loop)
+        self.thread.join(5)
+        if self.unix_path is not None:
+            try:
+                remove_socket(self.unix_path)
+            except OSError as e:
+                print(f"[Query Server] removing {self.unix_path} failed with error: {e}")
+
+    async def handle_connection(self, reader, writer):
+        try:
+            try:
+                head = await reader.readuntil(b"\r\n\r\n")
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                return
+            if len(head) > MAX_HEADER_BYTES:
+                return
+            request_line = head.split(b"\r\n", 1)[0].decode('latin-1').split()
+            try:
+                if len(request_line) != 3:
+                    raise QueryError(400, "malformed request line")
+                method, target, _ = request_line
+                if method != "GET":
+                    raise QueryError(405, "only GET is supported")
+                url = urlsplit(target)
+                handler = self.routes.get(url.path)
+                if handler is None:
+                    raise QueryError(404, f"unknown path {url.path}")
+                query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                content_type, body = handler(query)
+            except QueryError as e:
+                await self.respond(writer, e.status, "application/json", json.dumps({"error": str(e)}).encode())
+                return
+            except Exception as e:
+                print(f"[Query Server] {' '.join(request_line)} failed with error: {e!r}")
+                await self.respond(writer, 500, "application/json", json.dumps({"error": str(e)}).encode())
+                return
+            await self.respond(writer, 200, content_type, body)
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        except Exception as e:
+            # e.g. a log that can't be read while /history streams it, the status line has already been sent
+            print(f"[Query Server] answering failed with error: {e!r}")
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, content_type, body):
+        head = f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: {content_type}\r\nConnection: close\r\n"
+        if isinstance(body, bytes):
+            writer.write(f"{head}Content-Length: {len(body)}\r\n\r\n".encode() + body)
+            await writer.drain()
+            return
+        # iterators are streamed with chunked encoding, they read files so they are advanced off the loop
+        writer.write(f"{head}Transfer-Encoding: chunked\r\n\r\n".encode())
+        blocks = iter(body)
+        while True:
+            block = await self.loop.run_in_executor(None, next, blocks, None)
+            if block is None:
+                break
+            if block:
+                writer.write(f"{len(block):x}\r\n".encode() + block + b"\r\n")
+                await writer.drain()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    def find_server(self, query):
+        address = query.get("host")
+        if address is None:
+            raise QueryError(400, "missing parameter host")
+        for server in self.servers:
+            if server.address == address:
+                return server
+        raise QueryError(404, f"unknown host {address}")
+
+    def handle_hosts(self, query):
+        hosts = []
+        for server in self.servers:
+            time_data, avg, minimum, maximum, jitter, loss = server.samples.views("time", "avg", "min", "max", "jitter", "loss")
+            host = {"host": server.address, "description": server.description, "samples": len(time_data),
+                    "interval": server.next_delay(), "last": None}
+            if len(time_data):
+                host["last"] = {"time": float(time_data[-1]), "avg": float(avg[-1]), "min": float(minimum[-1]),
+                                "max": float(maximum[-1]), "jitter": float(jitter[-1]),
+                                "loss_percent": float(loss[-1])}
+            hosts.append(host)
+        return "application/json", json.dumps(hosts).encode()
+
+    def handle_stats(self, query):
+        server = self.find_server(query)
+        window = float_parameter(query, "window", DEFAULT_WINDOW_IN_SEC)
+        time_data, avg, jitter, loss = server.samples.views("time", "avg", "jitter", "loss")
+        first = np.searchsorted(time_data, time.time() - window, side='left')
+        avg, jitter, loss = avg[first:], jitter[first:], loss[first:]
+        stats = {"host": server.address, "window": window, "samples": int(len(avg))}
+        # a failed probe is stored with an average of -1, it counts as loss but not as a round trip time
+        answered = avg[avg >= 0]
+        if len(answered):
+            p50, p95 = np.percentile(answered, (50, 95))
+            stats.update(p50=float(p50), p95=float(p95), max=float(answered.max()))
+        if len(avg):
+            stats.update(loss_percent=float(loss.mean()), jitter=float(jitter.mean()), max_jitter=float(jitter.max()))
+        rfc_jitter = server.samples.last("rfc_jitter")
+        if rfc_jitter is not None:
+            stats["rfc3550_jitter"] = float(rfc_jitter)
+        # a snapshot, the server swaps in a new sketch instead of changing this one
+        sketch = server.sketch
+        if len(sketch):
+            stats["hour_p50"], stats["hour_p95"], stats["hour_p99"] = sketch.quantiles((0.5, 0.95, 0.99))
+        return "application/json", json.dumps(stats).encode()
+
+    def handle_history(self, query):
+        server = self.find_server(query)
+        start = float_parameter(query, "start", 0.0)
+        end = float_parameter(query, "end", float("inf"))
+        return "text/plain", history_blocks(server.writer, start, end)
+
+
+def remove_socket(path):
+    # removes the socket an earlier run left at path, anything but a socket is refused instead of deleted
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise OSError(f"{path} exists and is not a socket")
+    os.remove(path)
+
+
+def float_parameter(query, name, default):
+    if name not in query:
+        return default
+    try:
+        return float(query[name])
+    except ValueError:
+        raise QueryError(400, f"parameter {name} is not a number")
+
+
+def history_blocks(writer, start, end):
+    # yields the lines of a log with start <= time < end in blocks of about HISTORY_BLOCK_BYTES, binary logs as text.
+    # the buffered lines are flushed first, so the answer reaches up to the latest probe
+    writer.flush()
+    if isinstance(writer, PartitionedWriter):
+        filepaths = writer.files_between(start, end)
+    else:
+        filepaths = [writer.filename]
+    for filepath in filepaths:
+        if os.path.exists(filepath):
+            yield from file_history_blocks(filepath, start, end)
+
+
+def file_history_blocks(filepath, start, end):
+    if BinaryLog.is_binary_log(filepath):
+        records = BinaryLog.read_records(filepath)
+        step = HISTORY_BLOCK_BYTES // 64
+        for first in range(0, len(records), step):
+            chunk = records[first:first + step]
+            chunk = chunk[(chunk["time"] >= start) & (chunk["time"] < end)]
+            yield "".join(BinaryLog.format_text_line(record) + '\n' for record in chunk).encode()
+        return
+
+    with open_log(filepath) as file:
+        pending = b''
+        while True:
+            data = file.read(HISTORY_BLOCK_BYTES)
+            if not data:
+                break
+            data = pending + data
+            cut = data.rfind(b'\n') + 1
+            pending = data[cut:]
+            yield b"".join(line + b'\n' for line in data[:cut].split(b'\n')[:-1] if line_in_range(line, start, end))
+        # a last line without newline may still be written to, it is left for the next request
+
+
+def line_in_range(line, start, end):
+    try:
+        return start <= float(line.split(b';', 1)[0]) < end
+    except ValueError:
+        return False
@@ -0,0 +1,72 @@
+import collections
+
+import numpy as np
+
+
+class RingBuffer:
+    # Fixed capacity columns with O(1) appends. Every value is stored twice, at slot and slot + length,
+    # so the current window of a column is always one contiguous slice that can be handed out without copying.
+    # One spare slot keeps the next append from writing into a view that was handed out before it.
+    def __init__(self, capacity, columns):
+        self.capacity = capacity
+        self.length = capacity + 1
+        self.columns = {name: np.zeros(2 * self.length, dtype=dtype) for name, dtype in columns}
+        self.window = (0, 0)
+
+    def __len__(self):
+        return self.window[1]
+
+    def append(self, **values):
+        start, size = self.window
+        slot = (start + size) % self.length
+        for name, value in values.items():
+            column = self.columns[name]
+            column[slot] = value
+            column[slot + self.length] = value
+        # publish the new window in one assignment so readers never see a half updated start/size pair
+        if size < self.capacity:
+            self.window = (start, size + 1)
+        else:
+            self.window = ((start + 1) % self.length, size)
+
+    def view(self, name):
+        return self.views(name)[0]
+
+    def views(self, *names):
+        # views on the same window, so columns read together always line up
+        start, size = self.window
+        views = []
+        for name in names:
+            view = self.columns[name][start:start + size]
+            view.flags.writeable = False
+            views.append(view)
+        return views
+
+    def last(self, name):
+        start, size = self.window
+        if size == 0:
+            return None
+        return self.columns[name][start + size - 1]
+
+
+class WindowMaximum:
+    # Maximum of the last capacity pushed values in amortized O(1): a deque of (index, value) candidates
+    # with decreasing values, older candidates that are smaller than a new value can never be the maximum again.
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.candidates = collections.deque()
+        self.count = 0
+
+    def push(self, value):
+        while self.candidates and self.candidates[-1][1] <= value:
+            self.candidates.pop()
+        self.candidates.append((self.count, value))
+        self.count += 1
+        while self.candidates[0][0] < self.count - self.capacity:
+            self.candidates.popleft()
+
+    def maximum(self, default=0):
+        try:
+            return self.candidates[0][1]
+        except IndexError:
+            return default
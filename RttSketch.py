@@ -0,0 +1,117 @@
+import math
+
+import numpy as np
+
+# DDSketch style quantile sketch of round trip times: logarithmic buckets with a fixed relative accuracy.
+# Sketches of different probes or hours merge by adding their bucket counts, so hourly percentiles
+# can be combined exactly (within the accuracy) instead of averaging averages.
+RELATIVE_ACCURACY = 0.02
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+MIN_RTT = 0.01      # ms, smaller values share the first bucket
+MAX_RTT = 60000.0   # ms, larger values share the last bucket
+INDEX_OFFSET = math.ceil(math.log(MIN_RTT) / LOG_GAMMA)
+BUCKET_COUNT = math.ceil(math.log(MAX_RTT) / LOG_GAMMA) - INDEX_OFFSET + 1
+
+
+def bucket_indices(rtts):
+    rtts = np.maximum(np.asarray(rtts, dtype=np.float64), MIN_RTT)
+    indices = np.ceil(np.log(rtts) / LOG_GAMMA).astype(np.int64) - INDEX_OFFSET
+    return np.clip(indices, 0, BUCKET_COUNT - 1)
+
+
+def bucket_values(indices):
+    # the value every rtt of a bucket is represented by, at most RELATIVE_ACCURACY away from all of them
+    return 2 * GAMMA ** (np.asarray(indices, dtype=np.float64) + INDEX_OFFSET) / (GAMMA + 1)
+
+
+def quantiles(buckets, counts, qs):
+    # quantiles of a sketch given as sorted bucket indices and their counts
+    if len(counts) == 0:
+        return [math.nan] * len(qs)
+    cumulative = np.cumsum(counts)
+    ranks = np.asarray(qs, dtype=np.float64) * (cumulative[-1] - 1)
+    positions = np.searchsorted(cumulative, ranks, side='right')
+    return bucket_values(np.asarray(buckets)[positions]).tolist()
+
+
+class RttSketch:
+    def __init__(self):
+        self.counts = {}  # bucket index -> amount of rtts
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    def add(self, rtts):
+        if len(rtts) == 0:
+            return
+        buckets, counts = np.unique(bucket_indices(rtts), return_counts=True)
+        for bucket, count in zip(buckets.tolist(), counts.tolist()):
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+
+    def copy(self):
+        sketch = RttSketch()
+        sketch.counts = dict(self.counts)
+        return sketch
+
+    def merge(self, other):
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+
+    def quantiles(self, qs):
+        buckets = sorted(self.counts)
+        return quantiles(buckets, [self.counts[bucket] for bucket in buckets], qs)
+
+    def encode(self):
+        # compact form: [[bucket, count], ...] sorted by bucket, used where the sketch is stored as json
+        return [[bucket, self.counts[bucket]] for bucket in sorted(self.counts)]
+
+    @classmethod
+    def decode(cls, pairs):
+        sketch = cls()
+        sketch.counts = {int(bucket): int(count) for bucket, count in pairs}
+        return sketch
+
+
+class SketchColumn:
+    # The sketches of many hours in compressed sparse rows: the buckets and counts of sketch i are
+    # buckets[offsets[i]:offsets[i + 1]] and counts[offsets[i]:offsets[i + 1]]. Hours without rtts have empty rows.
+    def __init__(self, offsets=None, buckets=None, counts=None):
+        self.offsets = offsets if offsets is not None else np.zeros(1, dtype=np.int64)
+        self.buckets = buckets if buckets is not None else np.empty(0, dtype=np.uint16)
+        self.counts = counts if counts is not None else np.empty(0, dtype=np.uint32)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @classmethod
+    def empty(cls, rows):
+        return cls(np.zeros(rows + 1, dtype=np.int64))
+
+    @classmethod
+    def from_entries(cls, rows, row_ids, buckets, counts):
+        # entries have to be sorted by row and bucket
+        offsets = np.zeros(rows + 1, dtype=np.int64)
+        np.cumsum(np.bincount(row_ids, minlength=rows), out=offsets[1:])
+        return cls(offsets, buckets.astype(np.uint16), counts.astype(np.uint32))
+
+    def concatenate(self, other):
+        return SketchColumn(np.concatenate((self.offsets, other.offsets[1:] + self.offsets[-1])),
+                            np.concatenate((self.buckets, other.buckets)),
+                            np.concatenate((self.counts, other.counts)))
+
+    def take(self, indices):
+        # the sketches of the given rows, in that order
+        starts = self.offsets[indices]
+        lengths = self.offsets[indices + 1] - starts
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        positions = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return SketchColumn(offsets, self.buckets[positions], self.counts[positions])
+
+    def row(self, index):
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return self.buckets[start:end], self.counts[start:end]
+
+    def quantiles(self, index, qs):
+        return quantiles(*self.row(index), qs)
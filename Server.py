@@ -1,20 +1,33 @@
-import re
-import subprocess
+import os
 import threading
 import time
-import platform
+import numpy as np
+import BinaryLog
 from BufferedWriter import BufferedWriter
+from HeatmapData import local_hour_keys
+from PartitionedLog import PartitionedWriter, partition_key
+from Profiler import PROFILER
+from IcmpProber import get_prober
+from LodPyramid import LodPyramid
+from RingBuffer import RingBuffer, WindowMaximum
+from RttSketch import RttSketch
+
+SAMPLE_COLUMNS = (
+    ("time", np.float64),
+    ("avg", np.float32),
+    ("min", np.float32),
+    ("max", np.float32),
+    ("jitter", np.float32),
+    ("loss", np.float32),
+    ("rfc_jitter", np.float32),
+)
 
 
 class Server:
-    def __init__(self, address, description, color, path_logfile, ping_delay, element_count, amt_of_pings=5):
+    def __init__(self, address, description, color, path_logfile, ping_delay, element_count, amt_of_pings=5, prober=None, log_format="text", cadence=None, partitions=None):
         self.address = address
         self.description = description
         self.color = color
-        self.time_data = []
-        self.ping_data = []
-        self.loss_data = []
-        self.jitter_data = []
         self.curve = None
         self.jitter_curve = None
         self.packetloss_curve = None
@@ -22,86 +35,156 @@ class Server:
         self.amt_of_pings = amt_of_pings
         self.path_logfile = path_logfile
         self.element_count = element_count
-        self.writer = BufferedWriter(address.replace(".", "_")+"_log.txt", 4 * 1024) #4kB should lead to roughly one save per 10 min
-        self.network_ping_thread = threading.Thread(target=self.collect_network_pings_data)
-        self.network_ping_thread.daemon = True
-        self.network_ping_thread.start()
+        self.samples = RingBuffer(element_count, SAMPLE_COLUMNS)
+        self.lod = LodPyramid(element_count, ("avg", "jitter", "loss"))
+        self.ping_maximum = WindowMaximum(element_count)
+        self.jitter_maximum = WindowMaximum(element_count)
+        # incremented after every new sample, so the ui can tell which curves need redrawing
+        self.sequence = 0
+        # RFC 3550 interarrival jitter over consecutive answered echos, and the rtts of the current local hour
+        # (the hour of the heatmap cell). other threads read the sketch, so it's replaced by a changed copy
+        # with every probe instead of being changed
+        self.rfc_jitter = 0.0
+        self.previous_rtt = None
+        self.sketch = RttSketch()
+        self.sketch_hour = None
+        self.sketch_lock = threading.Lock()
+        self.prober = prober if prober is not None else get_prober()
+        # an AdaptiveCadence to vary the delay between probes, None keeps it at ping_delay
+        self.cadence = cadence
+        # a SharedSlot of the SharedSamplesPublisher, if the samples are published to other processes
+        self.shared_slot = None
+        self.log_format = log_format
+        if partitions is not None:
+            # keyword arguments of a PartitionedWriter: one file per month or day in a directory named after the address
+            binary = log_format == "binary"
+            directory = address.replace(".", "_")
+            if binary:
+                key = partition_key(time.time(), partitions.get("granularity", "month"))
+                self.open_binary_format(os.path.join(directory, key + ".bin"))
+            self.writer = PartitionedWriter(directory, binary=binary,
+                                            header=self.binary_header() if binary else None,
+                                            max_age=600, **partitions)
+        elif log_format == "binary":
+            filename = address.replace(".", "_") + BinaryLog.BINARY_SUFFIX
+            self.open_binary_format(filename)
+            self.writer = BufferedWriter(filename, 4 * 1024, max_age=600, binary=True, header=self.binary_header())
+        else:
+            self.writer = BufferedWriter(address.replace(".", "_")+"_log.txt", 4 * 1024, max_age=600) #4kB should lead to roughly one save per 10 min
+
+    def open_binary_format(self, path):
+        # records are appended in the format of an existing log, new logs hold the rtts of the longest probe cycle
+        longest = self.amt_of_pings
+        if self.cadence is not None and self.cadence.burst_pings:
+            longest = max(longest, self.cadence.burst_pings)
+        self.binary_version, self.rtt_count = (BinaryLog.file_format(path)
+                                               or (BinaryLog.VERSION, max(BinaryLog.RECORD_RTTS, longest)))
+        if self.binary_version > 1 and self.rtt_count < longest:
+            print(f"{path} holds {self.rtt_count} rtts per record, the rest of a cycle of {longest} echos isn't logged")
+
+    def binary_header(self):
+        return BinaryLog.header_bytes(self.binary_version, self.rtt_count)
+
+    # read only views on the latest element_count samples, oldest first
+    @property
+    def time_data(self):
+        return self.samples.view("time")
+
+    @property
+    def ping_data(self):
+        return self.samples.view("avg")
+
+    @property
+    def jitter_data(self):
+        return self.samples.view("jitter")
+
+    @property
+    def loss_data(self):
+        return self.samples.view("loss")
+
+    def probe_plan(self):
+        # (echo requests, seconds between them or None for the prober's default) of the next probe cycle
+        if self.cadence is not None and self.cadence.bursting:
+            return self.cadence.burst_pings or self.amt_of_pings, self.cadence.burst_interval
+        return self.amt_of_pings, None
+
+    def next_delay(self):
+        # seconds between the start of the last probe and the next one
+        if self.cadence is None:
+            return self.ping_delay
+        return self.cadence.delay
 
     def get_maximum_in_data(self):
-        maximum = 0
-        for i in range(len(self.ping_data)):
-            if self.ping_data[i] > maximum:
-                maximum = self.ping_data[i]
-            if self.loss_data[i] > maximum:
-                maximum = self.loss_data[i]
-        return maximum
+        if len(self.samples) == 0:
+            return 0
+        return max(0, self.ping_data.max(), self.loss_data.max())
 
     def collect_network_pings_data(self):
-        while True:
-            time_in_sec = time.time()
-            try:  # "-c", self.amt_of_pings
-                # obtain data
-                output = None
-                if platform.system().lower() == 'windows':
-                    output = subprocess.run(["ping", "-n", str(self.amt_of_pings), self.address], capture_output=True,
-                                            text=True,
-                                            universal_newlines=True,
-                                            creationflags=subprocess.CREATE_NO_WINDOW,
-                                            encoding='latin-1')
-                else:
-                    output = subprocess.run(["ping", "-c", str(self.amt_of_pings), self.address], capture_output=True,
-                                            text=True,
-                                            universal_newlines=True,
-                                            encoding='latin-1')
-
-                # extract data
-                min_ping = -1
-                max_ping = -1
-                avg_ping = -1
-                lost_packets = 0
-                loss_rate = 0.0
-                for line in output.stdout.split("\n"):
-                    #print(line)
-                    if "Lost =" in line:
-                        lost_packets = int(line.split("Lost = ")[-1].split(" ")[0])
-                    elif "Verloren =" in line:
-                        lost_packets = int(line.split("Verloren = ")[-1].split(" ")[0])
-                    elif "Minimum" in line:
-                        values = re.findall(r'\d+', line)
-                        values = list(map(int, values))
-                        if len(values) == 3:
-                            min_ping = values[0]
-                            max_ping = values[1]
-                            avg_ping = values[2]
-
-                if lost_packets != 0:
-                    loss_rate = lost_packets / self.amt_of_pings
-                #print(lost_packets)
-
-                self.time_data.append(time_in_sec)
-                self.ping_data.append(avg_ping)
-                self.jitter_data.append(max_ping - min_ping)
-                self.loss_data.append(loss_rate * 100)
-
-                self.writer.write(f"{time_in_sec};{avg_ping};{min_ping};{max_ping};{loss_rate}")
-
-                #if self.address == "23.94.198.153":
-                 #   print(len(self.ping_data))
-
-                if len(self.ping_data) > self.element_count:
-                    self.time_data.pop(0)
-                    self.ping_data.pop(0)
-                    self.jitter_data.pop(0)
-                    self.loss_data.pop(0)
-
-            except subprocess.CalledProcessError as e:
-                print(f"Ping failed with error: {e.output}")
-
-            time_taken = time.time() - time_in_sec
-            time_to_sleep = self.ping_delay
-            if time_taken > self.ping_delay:
-                time_to_sleep = 0
+        # one probe cycle, waiting for its result
+        time_in_sec = time.time()
+        # obtain data
+        with PROFILER.span("ping"):
+            result = self.prober.ping(self.address, *self.probe_plan())
+        self.record_probe(time_in_sec, result)
+
+    def start_probe(self):
+        # starts a probe cycle without waiting for it, returns a future of its PingResult for record_probe.
+        # the ProbeScheduler decides when the next one is due
+        return self.prober.submit(self.address, *self.probe_plan())
+
+    def record_probe(self, time_in_sec, result):
+        # extract data, the log keeps microseconds
+        min_ping = round(result.minimum, 3)
+        max_ping = round(result.maximum, 3)
+        avg_ping = round(result.average, 3)
+        loss_rate = 0.0
+        if result.lost != 0:
+            loss_rate = result.lost / result.sent
+        rtts = [round(rtt, 3) for rtt in result.rtts]
+        self.add_rtts(time_in_sec, rtts)
+        if self.cadence is not None:
+            self.cadence.update(time_in_sec, avg_ping, loss_rate)
+
+        self.samples.append(time=time_in_sec, avg=avg_ping, min=min_ping, max=max_ping,
+                            jitter=max_ping - min_ping, loss=loss_rate * 100, rfc_jitter=self.rfc_jitter)
+        # read once, shutdown may set it to None meanwhile
+        shared_slot = self.shared_slot
+        if shared_slot is not None:
+            shared_slot.publish(time=time_in_sec, avg=avg_ping, min=min_ping, max=max_ping,
+                                jitter=max_ping - min_ping, loss=loss_rate * 100, rfc_jitter=self.rfc_jitter)
+        self.lod.append(time_in_sec, avg=avg_ping, jitter=max_ping - min_ping, loss=loss_rate * 100)
+        self.ping_maximum.push(avg_ping)
+        self.jitter_maximum.push(max_ping - min_ping)
+        self.sequence += 1
+
+        if self.log_format == "binary":
+            self.write_log(BinaryLog.pack_record(time_in_sec, avg_ping, min_ping, max_ping, loss_rate,
+                                                 rtts[:self.rtt_count], self.binary_version, self.rtt_count),
+                           time_in_sec)
+        else:
+            line = (f"{time_in_sec};{BinaryLog.format_value(avg_ping)};{BinaryLog.format_value(min_ping)};"
+                    f"{BinaryLog.format_value(max_ping)};{loss_rate}")
+            if rtts:
+                line += ";" + BinaryLog.format_rtts(rtts)
+            self.write_log(line, time_in_sec)
+
+    def write_log(self, data, time_in_sec):
+        # a partitioned log needs the time of the line to pick its file
+        with PROFILER.span("log_write"):
+            if isinstance(self.writer, PartitionedWriter):
+                self.writer.write(data, time_in_sec)
             else:
-                time_to_sleep = self.ping_delay - time_taken
-            # print(f"time taken: {time_taken}    time to sleep: {time_to_sleep}")
-            time.sleep(time_to_sleep)
\ No newline at end of file
+                self.writer.write(data)
+
+    def add_rtts(self, time_in_sec, rtts):
+        # J += (|D| - J) / 16 with D the difference of consecutive rtts, lost echos are skipped
+        for rtt in rtts:
+            if self.previous_rtt is not None:
+                self.rfc_jitter += (abs(rtt - self.previous_rtt) - self.rfc_jitter) / 16
+            self.previous_rtt = rtt
+        hour = int(local_hour_keys(np.array([time_in_sec]))[0])
+        with self.sketch_lock:
+            sketch = self.sketch.copy() if hour == self.sketch_hour else RttSketch()
+            sketch.add(rtts)
+            self.sketch = sketch
+            self.sketch_hour = hour
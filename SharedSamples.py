@@ -0,0 +1,198 @@
+import os
+import sys
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# The latest samples of every server in a shared memory segment, so local viewers read live data without
+# touching the logs or a socket. Layout: a header, one slot per host and a ring of capacity records per host.
+# Every host has its own seqlock: the publisher makes the sequence odd, writes the record, and makes it even
+# again. A reader copies the ring and only trusts the copy if the sequence was even and didn't change meanwhile.
+# Each host is written by one thread at a time (the ProbeScheduler never probes a server twice at once).
+# The header names the pid of the publisher, a second publisher of the same name refuses while it runs.
+DEFAULT_NAME = "statmonitor_samples"
+MAGIC = b"NSMSHM"
+VERSION = 2
+HEADER_DTYPE = np.dtype([("magic", "S8"), ("version", "<u4"), ("hosts", "<u4"), ("capacity", "<u4"),
+                         ("record_size", "<u4"), ("owner", "<u8")])
+HOST_DTYPE = np.dtype([("sequence", "<u8"), ("written", "<u8"), ("address", "S64"), ("description", "S64"),
+                       ("color", "S16")])
+RECORD_DTYPE = np.dtype([("time", "<f8"), ("avg", "<f4"), ("min", "<f4"), ("max", "<f4"), ("jitter", "<f4"),
+                         ("loss", "<f4"), ("rfc_jitter", "<f4")])
+READ_ATTEMPTS = 1000
+
+
+class SharedSamplesError(Exception):
+    pass
+
+
+def segment_size(hosts, capacity):
+    return HEADER_DTYPE.itemsize + hosts * HOST_DTYPE.itemsize + hosts * capacity * RECORD_DTYPE.itemsize
+
+
+def map_segment(buffer, hosts, capacity):
+    # (header, host slots, records of shape (hosts, capacity)) as arrays on the shared buffer
+    header = np.ndarray(1, HEADER_DTYPE, buffer)[0]
+    slots = np.ndarray(hosts, HOST_DTYPE, buffer, offset=HEADER_DTYPE.itemsize)
+    records = np.ndarray((hosts, capacity), RECORD_DTYPE, buffer,
+                         offset=HEADER_DTYPE.itemsize + hosts * HOST_DTYPE.itemsize)
+    return header, slots, records
+
+
+def segment_owner(buffer):
+    # pid of the publisher of a segment, None if it isn't a (complete) segment of this version
+    if len(buffer) < HEADER_DTYPE.itemsize:
+        return None
+    header = np.ndarray(1, HEADER_DTYPE, buffer)[0]
+    if header["magic"] != MAGIC or header["version"] != VERSION:
+        return None
+    return int(header["owner"])
+
+
+def untrack(memory):
+    # attaching registers the segment with this process' resource tracker, which would unlink it when the
+    # process exits (python < 3.13). the publisher owns it, so the registration is undone
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(memory._name, "shared_memory")
+    except (ImportError, AttributeError):
+        pass
+
+
+def process_alive(pid):
+    if os.name == "nt":
+        # windows removes a segment with the last process that has it open, so an existing one has a live owner
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SharedSlot:
+    # what a Server publishes its samples through
+    def __init__(self, slot, records):
+        self.slot = slot
+        self.records = records
+        self.capacity = len(records)
+
+    def publish(self, **values):
+        written = int(self.slot["written"])
+        self.slot["sequence"] += 1
+        record = self.records[written % self.capacity]
+        for name, value in values.items():
+            record[name] = value
+        self.slot["written"] = written + 1
+        self.slot["sequence"] += 1
+
+
+class SharedSamplesPublisher:
+    def __init__(self, servers, capacity, name=DEFAULT_NAME):
+        self.name = name
+        size = segment_size(len(servers), capacity)
+        try:
+            self.memory = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            existing = shared_memory.SharedMemory(name)
+            owner = segment_owner(existing.buf)
+            if owner is not None and process_alive(owner):
+                untrack(existing)
+                existing.close()
+                raise SharedSamplesError(f"{name} is published by the running process {owner} already")
+            # left behind by a publisher that didn't shut down cleanly
+            existing.close()
+            existing.unlink()
+            self.memory = shared_memory.SharedMemory(name, create=True, size=size)
+        header, self.slots, self.records = map_segment(self.memory.buf, len(servers), capacity)
+        header["owner"] = os.getpid()
+        header["version"] = VERSION
+        header["hosts"] = len(servers)
+        header["capacity"] = capacity
+        header["record_size"] = RECORD_DTYPE.itemsize
+        for index, server in enumerate(servers):
+            self.slots[index]["address"] = server.address.encode()[:64]
+            self.slots[index]["description"] = server.description.encode()[:64]
+            self.slots[index]["color"] = server.color.encode()[:16]
+            server.shared_slot = SharedSlot(self.slots[index], self.records[index])
+        # readers check the magic last, so they never see a half initialized segment
+        header["magic"] = MAGIC
+        self.servers = servers
+
+    def close(self):
+        for server in self.servers:
+            server.shared_slot = None
+        self.slots = self.records = None
+        self.memory.close()
+        self.memory.unlink()
+
+
+class SharedSamplesReader:
+    def __init__(self, name=DEFAULT_NAME):
+        try:
+            self.memory = shared_memory.SharedMemory(name)
+        except FileNotFoundError:
+            raise SharedSamplesError(f"no shared samples named {name}, is the collector publishing them?")
+        untrack(self.memory)
+        header = np.ndarray(1, HEADER_DTYPE, self.memory.buf)[0]
+        if header["magic"] != MAGIC or header["version"] != VERSION or header["record_size"] != RECORD_DTYPE.itemsize:
+            self.memory.close()
+            raise SharedSamplesError(f"{name} isn't a version {VERSION} shared samples segment")
+        self.hosts = int(header["hosts"])
+        self.capacity = int(header["capacity"])
+        _, self.slots, self.records = map_segment(self.memory.buf, self.hosts, self.capacity)
+        self.slots.flags.writeable = False
+        self.records.flags.writeable = False
+
+    def host_info(self):
+        # [(address, description, color)] in slot order
+        return [(slot["address"].decode(), slot["description"].decode(), slot["color"].decode()) for slot in self.slots]
+
+    def index_of(self, address):
+        for index, (host_address, _, _) in enumerate(self.host_info()):
+            if host_address == address:
+                return index
+        raise KeyError(address)
+
+    def view(self, index):
+        # (records, written) without copying or consistency check: records[written % capacity] is the next slot
+        return self.records[index], int(self.slots[index]["written"])
+
+    def snapshot(self, index):
+        # consistent copy of the samples of a host, oldest first
+        slot = self.slots[index]
+        for attempt in range(READ_ATTEMPTS):
+            sequence = int(slot["sequence"])
+            if sequence % 2 == 0:
+                written = int(slot["written"])
+                ring = self.records[index].copy()
+                if int(slot["sequence"]) == sequence:
+                    if written <= self.capacity:
+                        return ring[:written]
+                    return np.roll(ring, -(written % self.capacity))
+            time.sleep(0)
+        raise SharedSamplesError(f"samples of host {index} kept changing while they were read")
+
+    def latest(self, index):
+        samples = self.snapshot(index)
+        return samples[-1] if len(samples) else None
+
+    def close(self):
+        self.slots = self.records = None
+        self.memory.close()
+
+
+if __name__ == '__main__':
+    # prints the latest sample of every host
+    reader = SharedSamplesReader(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_NAME)
+    for host, (address, description, _) in enumerate(reader.host_info()):
+        sample = reader.latest(host)
+        if sample is None:
+            print(f"{address:16} {description:20} no samples yet")
+        else:
+            print(f"{address:16} {description:20} {time.strftime('%H:%M:%S', time.localtime(sample['time']))} "
+                  f"avg {sample['avg']:.3f} ms  jitter {sample['jitter']:.3f} ms  loss {sample['loss']:.0f}%")
+    reader.close()
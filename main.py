@@ -1,18 +1,31 @@
 import datetime
+import functools
 import os
 import sys
-import psutil
-import threading
+import numpy as np
 import safe_exit
 from PyQt5 import QtWidgets, QtGui, QtCore
 import pyqtgraph as pg
-import time
-from Server import Server
+from CpuSampler import CpuSampler
+from Collector import SERVERS, SCHEDULER, PING_PLOT_ELEMENT_COUNT, SHUTDOWN_TIMEOUT_IN_SEC, process_servers_file, \
+    publish_samples, shutdown
+from Profiler import PROFILER, ENV_ENABLED
 
 COLLECT_LOOP_CPU_UTIL_DELAY_IN_SEC = 0.1
 COLLECT_LOOP_PING_DELAY_IN_SEC = 5.0
-PING_PLOT_ELEMENT_COUNT = 400
-SERVERS = []
+# rolling averages of every core kept by the CpuSampler, 0 keeps none
+CPU_HISTORY_LENGTH = 0
+# name of the shared memory segment the samples are published to (see SharedSamples.py), unset publishes none
+SHARED_SAMPLES_NAME = os.environ.get("STATMONITOR_SHARED_SAMPLES")
+
+
+def cpu_color(p):
+    return QtGui.QColor(0, int(255 * (1 - p / 100)), 0) if p <= 50 else \
+        QtGui.QColor(int(255 * (p / 100)), int(255 * (1 - p / 100)), 0)
+
+
+# bar colors of every whole percent, a bar takes the color of its rounded utilization
+CPU_COLORS = [cpu_color(p) for p in range(101)]
 
 def format_time(seconds):
     if seconds > 0:
@@ -26,54 +39,11 @@ class TimeAxisItem(pg.AxisItem):
         return [format_time(value) for value in values]
 
 
-# Validates whether a line follows the format: STRING;STRING;STRING;Number.
-def is_valid_server_entry(line):
-
-    parts = line.strip().split(';')
-    if len(parts) != 4:
-        return False
-    if not all(isinstance(part, str) for part in parts[:-1]):
-        return False
-    if not parts[-1].isdigit():
-        return False
-    return True
-
-
-def add_server(line):
-    print(f"Adding server: {line}")
-    parts = line.strip().split(';')
-    SERVERS.append(Server(parts[0], parts[1], parts[2], "", int(parts[3]), PING_PLOT_ELEMENT_COUNT))
-
-
-def set_default_servers():
-    default_servers = [
-        "google.com;google.com;#FF0000;5",
-    ]
-    with open('servers.txt', 'w') as f:
-        for server in default_servers:
-            f.write(server + '\n')
-    print("Default servers set.")
-
-
-def process_servers_file():
-    try:
-        if os.path.exists('servers.txt'):
-            with open('servers.txt', 'r') as f:
-                for line in f:
-                    if is_valid_server_entry(line):
-                        add_server(line)
-                    else:
-                        print(f"Invalid server entry: {line}")
-        else:
-            set_default_servers()
-    except Exception as e:
-        print(f"Encountered an error: {e}")
-        set_default_servers()
-
-
 class LiveGraph(QtWidgets.QWidget):
     def __init__(self):
         process_servers_file()
+        if SHARED_SAMPLES_NAME:
+            publish_samples(SHARED_SAMPLES_NAME)
         super().__init__()
         self.setWindowTitle('StatMonitor')
         self.setGeometry(100, 100, 800, 600)
@@ -118,11 +88,20 @@ class LiveGraph(QtWidgets.QWidget):
         self.cpu_plot.addItem(self.cpu_bar_graph)
         splitter.addWidget(self.cpu_plot)
 
+        # Legend clicks toggle the ping curve, the jitter and packetloss curves of the server follow it
+        for server in SERVERS:
+            server.curve.visibleChanged.connect(functools.partial(self.on_curve_visibility_changed, server))
+        self.drawn_state = {}
+        self.x_range = None
+        self.y_maxima = None
+
         # Set the default Sizing for the different plots attached to the splitter
         splitter.setSizes([900, 320, 260, 0])
 
-        # Data storage
-        self.cpu_data = [] * psutil.cpu_count()
+        # Per core utilization, sampled in the background
+        self.cpu_sampler = CpuSampler(COLLECT_LOOP_CPU_UTIL_DELAY_IN_SEC, history_length=CPU_HISTORY_LENGTH)
+        self.cpu_drawn_sequence = None
+        self.cpu_x = None
 
         # 10 fps updates for fast updates to the ui like the rolling average of the cpu utilization
         self.cpu_timer = QtCore.QTimer()
@@ -133,76 +112,122 @@ class LiveGraph(QtWidgets.QWidget):
         self.ping_timer.timeout.connect(self.update_graphs)
         self.ping_timer.start(2000)  # Update graphs every 2 seconds
 
-        # Start background thread for data collection
-        self.collect_cpu_util_thread = threading.Thread(target=self.collect_cpu_util_data)
-        self.collect_cpu_util_thread.daemon = True
-        self.collect_cpu_util_thread.start()
+        # Start probing the servers and the background thread for data collection
+        SCHEDULER.start()
+        self.cpu_sampler.start()
+
+        # CTRL + SHIFT + P writes the profiler summary (see Profiler.py)
+        profile_action = QtWidgets.QAction("Dump Profile", self)
+        profile_action.triggered.connect(self.dump_profile)
+        profile_action.setShortcut(QtCore.Qt.CTRL + QtCore.Qt.SHIFT + QtCore.Qt.Key_P)
+        self.addAction(profile_action)
+        self.cprofile = None
+
+    def dump_profile(self):
+        if not PROFILER.enabled:
+            print(f"[Profiler] profiling is off, start with {ENV_ENABLED}=1 to record a profile")
+            return
+        PROFILER.dump()
+        # cProfile only sees the thread it was enabled on, here the gui thread, and is stopped on it again
+        if PROFILER.mode == "cprofile" and PROFILER.window > 0 and self.cprofile is None:
+            self.cprofile = PROFILER.start_cprofile()
+            QtCore.QTimer.singleShot(int(PROFILER.window * 1000), self.finish_cprofile)
+
+    def finish_cprofile(self):
+        PROFILER.finish_cprofile(self.cprofile)
+        self.cprofile = None
 
     def fast_ui_updates(self):
         self.update_cpu_graph()
 
-        # toggle visibility
-        changed = False
-        for server in SERVERS:
-            if server.curve.isVisible() != server.jitter_curve.isVisible():
-                server.jitter_curve.setVisible(server.curve.isVisible())
-                server.packetloss_curve.setVisible(server.curve.isVisible())
-                changed = True
-        if changed:
-            self.update_graphs()
+    def on_curve_visibility_changed(self, server):
+        server.jitter_curve.setVisible(server.curve.isVisible())
+        server.packetloss_curve.setVisible(server.curve.isVisible())
+        self.update_y_ranges()
 
     def update_cpu_graph(self):
-        if self.cpu_data:
-            x = list(range(len(self.cpu_data)))
-            height = self.cpu_data
+        with PROFILER.span("update_cpu_graph"):
+            self.draw_cpu_graph()
+
+    def draw_cpu_graph(self):
+        # the sampler swaps in a new array with every sample, so this one can't change while it's drawn
+        sequence = self.cpu_sampler.sequence
+        height = self.cpu_sampler.latest
+        if len(height) == 0 or sequence == self.cpu_drawn_sequence:
+            return
+        self.cpu_drawn_sequence = sequence
+        if self.cpu_x is None or len(self.cpu_x) != len(height):
+            self.cpu_x = np.arange(len(height))
 
-            # Update bar colors based on CPU usage
-            brushes = [QtGui.QColor(0, int(255 * (1 - p / 100)), 0) if p <= 50 else
-                       QtGui.QColor(int(255 * (p / 100)), int(255 * (1 - p / 100)), 0) for p in height]
+        # Update bar colors based on CPU usage
+        percents = np.clip(np.rint(height), 0, 100).astype(np.intp)
+        brushes = [CPU_COLORS[p] for p in percents.tolist()]
 
-            self.cpu_bar_graph.setOpts(x=x, height=height, brushes=brushes)
+        self.cpu_bar_graph.setOpts(x=self.cpu_x, height=height, brushes=brushes)
 
     def update_graphs(self):
+        with PROFILER.span("update_graphs"):
+            self.draw_graphs()
+
+    def draw_graphs(self):
         # Set the X axis ranges to the last 30 minutes (if there is enough data) or next 30 minutes (if there is not)
-        x_data = []
+        x_data = None
         for server in SERVERS:
-            if server.ping_data:
-                if len(x_data) == 0:
-                    x_data = server.time_data
-                server.curve.setData(x=server.time_data, y=server.ping_data)
-            if server.jitter_data:
-                server.jitter_curve.setData(x=server.time_data, y=server.jitter_data)
-            if server.loss_data:
-                server.packetloss_curve.setData(x=server.time_data, y=server.loss_data)
-        if len(x_data) > 0:
-            timestamp = 0.0
+            if len(server.time_data) > 0:
+                x_data = server.time_data
+                break
+        if x_data is not None:
             if len(x_data) < PING_PLOT_ELEMENT_COUNT:
                 timestamp = x_data[0] + 1600
             else:
                 timestamp = x_data[len(x_data) - 1]
-            self.ping_plot.setXRange(x_data[0], timestamp)
-            self.jitter_plot.setXRange(x_data[0], timestamp)
-            self.packetloss_plot.setXRange(x_data[0], timestamp)
-
+            if self.x_range != (x_data[0], timestamp):
+                self.x_range = (x_data[0], timestamp)
+                self.ping_plot.setXRange(x_data[0], timestamp)
+                self.jitter_plot.setXRange(x_data[0], timestamp)
+                self.packetloss_plot.setXRange(x_data[0], timestamp)
+
+            # Draw every curve with about as many points as its plot is wide, long histories use the LOD levels.
+            # Only servers with new samples (or resized plots) are redrawn.
+            for server in SERVERS:
+                state = (server.sequence, self.ping_plot.width(), self.jitter_plot.width(), self.packetloss_plot.width())
+                if self.drawn_state.get(server) == state:
+                    continue
+                self.drawn_state[server] = state
+                time_data, ping_data, jitter_data, loss_data = server.samples.views("time", "avg", "jitter", "loss")
+                if len(time_data) == 0:
+                    continue
+                for curve, plot, name, values in ((server.curve, self.ping_plot, "avg", ping_data),
+                                                  (server.jitter_curve, self.jitter_plot, "jitter", jitter_data),
+                                                  (server.packetloss_curve, self.packetloss_plot, "loss", loss_data)):
+                    x, y = server.lod.curve(name, time_data, values, x_data[0], timestamp, max(100, plot.width()))
+                    curve.setData(x=x, y=y)
+
+        self.update_y_ranges()
+
+    def update_y_ranges(self):
         ###### PING PLOT ######
         # Adjust Y maximum depending on what graphs are visible
         ping_plot_y_axis_max = 0
         for server in SERVERS:
-            if server.curve is not None and server.curve.isVisible() and len(server.ping_data) > 0:
-                local_max = max(server.ping_data)
+            if server.curve is not None and server.curve.isVisible():
+                local_max = server.ping_maximum.maximum()
                 if local_max > ping_plot_y_axis_max:
                     ping_plot_y_axis_max = local_max
-        self.ping_plot.setYRange(0, ping_plot_y_axis_max + 10)
 
         ###### JITTER PLOT ######
         # Adjust Y maximum depending on what graphs are visible
         jitter_plot_y_axis_max = 22
         for server in SERVERS:
-            if server.jitter_curve is not None and server.jitter_curve.isVisible() and len(server.jitter_data) > 0:
-                local_max = max(server.jitter_data)
+            if server.jitter_curve is not None and server.jitter_curve.isVisible():
+                local_max = server.jitter_maximum.maximum()
                 if local_max > jitter_plot_y_axis_max:
                     jitter_plot_y_axis_max = local_max
-        self.jitter_plot.setYRange(0, jitter_plot_y_axis_max + 3)
+
+        if self.y_maxima != (ping_plot_y_axis_max, jitter_plot_y_axis_max):
+            self.y_maxima = (ping_plot_y_axis_max, jitter_plot_y_axis_max)
+            self.ping_plot.setYRange(0, ping_plot_y_axis_max + 10)
+            self.jitter_plot.setYRange(0, jitter_plot_y_axis_max + 3)
 
 
     def setColumnCount(self, legend, columnCount):
@@ -233,32 +258,18 @@ class LiveGraph(QtWidgets.QWidget):
             _addItemToLayout(legend, sample, label)
         legend.updateSize()
 
-    def collect_cpu_util_data(self):
-        initialised = 0
-        while True:
-            if initialised != 1:
-                initialised = 1
-                self.cpu_data = psutil.cpu_percent(percpu=True)
-            else:
-                # update cpu core usage as a rolling average
-                stability = 0.92
-                new_cpu_data = psutil.cpu_percent(percpu=True)
-                i = 0
-                for core_usage_percentage in new_cpu_data:
-                    self.cpu_data[i] = (stability * self.cpu_data[i]) + ((1 - stability) * core_usage_percentage)
-                    i = i + 1
-            time.sleep(COLLECT_LOOP_CPU_UTIL_DELAY_IN_SEC)
-
 
 def handle_exit():
     print("Shutdown signal received")
-    for server in SERVERS:
-        server.writer.flush()
+    # waits for the running probes, so none of them writes or publishes after the logs and segment are closed
+    shutdown(SHUTDOWN_TIMEOUT_IN_SEC)
     #sys.exit()
 
 
 if __name__ == '__main__':
     safe_exit.register(handle_exit)
+    if PROFILER.enabled:
+        PROFILER.install_signal_handler()
     app = QtWidgets.QApplication(sys.argv)
     live_graph = LiveGraph()
     live_graph.show()
@@ -0,0 +1,36 @@
+import pytest
+
+import BinaryLog
+
+
+def test_text_binary_round_trip_keeps_fractional_rtts(tmp_path):
+    lines = [
+        "1718000000.123456;12.346;0.046;30.5;0.0;0.046,12.346,30.5,6.837\n",
+        "1718000005.5;-1;-1;-1;1.0\n",
+        "1718000010.25;7;7;7;0.2;7.0,7.0,7.0,7.0\n",
+    ]
+    text = tmp_path / "a_log.txt"
+    text.write_text("".join(lines))
+    binary = tmp_path / "a_log.bin"
+    assert BinaryLog.text_to_binary(str(text), str(binary)) == len(lines)
+    back = tmp_path / "b_log.txt"
+    assert BinaryLog.binary_to_text(str(binary), str(back)) == len(lines)
+    assert back.read_text() == "".join(lines)
+
+
+def test_text_to_binary_keeps_every_rtt_of_long_cycles(tmp_path):
+    rtts = ",".join(f"{10 + index}.5" for index in range(12))
+    lines = [f"1718000000.5;15.5;10.5;21.5;0.0;{rtts}\n", "1718000005.5;7;7;7;0.5;7.0\n"]
+    text = tmp_path / "a_log.txt"
+    text.write_text("".join(lines))
+    binary = tmp_path / "a_log.bin"
+    BinaryLog.text_to_binary(str(text), str(binary))
+    assert BinaryLog.file_format(str(binary)) == (2, 12)
+    back = tmp_path / "b_log.txt"
+    BinaryLog.binary_to_text(str(binary), str(back))
+    assert back.read_text() == "".join(lines)
+
+
+def test_pack_record_rejects_more_rtts_than_fit():
+    with pytest.raises(BinaryLog.BinaryLogError):
+        BinaryLog.pack_record(1718000000.5, 1, 1, 1, 0, [1.0] * 9, rtt_count=8)
@@ -0,0 +1,40 @@
+import asyncio
+import socket
+import struct
+
+import IcmpProber
+
+
+def test_missing_ping_binary_counts_every_echo_as_lost(tmp_path, monkeypatch):
+    monkeypatch.setenv("PATH", str(tmp_path))
+    result = asyncio.run(IcmpProber.ping_subprocess("127.0.0.1", 5))
+    assert result.sent == 5
+    assert result.lost == 5
+    assert result.rtts == []
+    assert result.average == -1
+
+
+class ReplySocket:
+    def __init__(self, packets):
+        self.packets = packets
+
+    def recvfrom(self, size):
+        if not self.packets:
+            raise BlockingIOError
+        return self.packets.pop(0), ("10.0.0.1", 0)
+
+
+def test_datagram_replies_with_an_ip_header_are_matched():
+    # macOS/BSD datagram sockets deliver the ip header like raw sockets do
+    prober = IcmpProber.IcmpProber()
+    loop = asyncio.new_event_loop()
+    try:
+        future = loop.create_future()
+        prober.pending[7] = (future, "10.0.0.1")
+        ip_header = bytes([0x45]) + bytes(19)
+        reply = struct.pack("!BBHHH", IcmpProber.ICMP_ECHO_REPLY, 0, 0, 1234, 7) + bytes(8)
+        prober.sock, prober.socket_kind = ReplySocket([ip_header + reply]), socket.SOCK_DGRAM
+        prober.on_readable()
+        assert future.done()
+    finally:
+        loop.close()
@@ -0,0 +1,10 @@
+import pytest
+
+import PingParser
+
+
+@pytest.mark.parametrize("name", sorted(PingParser.FIXTURES))
+def test_fixture_parses(name):
+    output, expected = PingParser.FIXTURES[name]
+    parsed = PingParser.parse(output)
+    assert (parsed.rtts, parsed.sent, parsed.lost, parsed.minimum, parsed.average, parsed.maximum) == expected
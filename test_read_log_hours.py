@@ -0,0 +1,99 @@
+import math
+import time
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+import HeatmapData
+from RttSketch import bucket_indices
+
+# US eastern time as a POSIX rule, so no tz database is needed: dst starts 2026-03-08 07:00 utc, ends 2026-11-01 06:00 utc
+DST_TIMEZONE = "EST5EDT,M3.2.0,M11.1.0"
+MALFORMED_LINES = ["garbage", "", "1773000000;1;2", "x;1;1;1;0", "1773000000;1;1;1;0;2;3"]
+
+
+@pytest.fixture
+def dst_timezone(monkeypatch):
+    monkeypatch.setenv("TZ", DST_TIMEZONE)
+    monkeypatch.setattr(HeatmapData, "_utc_offset_cache", {})
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def log_lines(rng, start, count):
+    # one probe every 7 minutes, some failed, some with a broken rtt field, malformed lines in between
+    lines = []
+    for index in range(count):
+        time_in_sec = start + index * 420 + float(rng.uniform(0, 1))
+        if index % 11 == 5:
+            lines.append(f"{time_in_sec};-1;-1;-1;1.0")
+            continue
+        rtts = np.round(rng.uniform(5, 50, 5), 3)
+        loss = 0.2 if index % 7 == 3 else 0.0
+        if loss:
+            rtts = rtts[:4]
+        line = f"{time_in_sec};{rtts.mean():.3f};{rtts.min()};{rtts.max()};{loss};{','.join(map(str, rtts))}"
+        if index % 13 == 4:
+            line += ",abc"
+        lines.append(line)
+        if index % 17 == 8:
+            lines.append(MALFORMED_LINES[index % len(MALFORMED_LINES)])
+    return lines
+
+
+def reference_hours(lines):
+    # aggregates line by line: consecutive lines of the same local hour form one hour, the last one is still open
+    runs = []
+    for line in lines:
+        parts = line.strip().split(";")
+        if len(parts) not in (5, 6):
+            continue
+        try:
+            time_in_sec, avg, minimum, maximum, loss = (float(part) for part in parts[:5])
+        except ValueError:
+            continue
+        try:
+            rtts = [float(rtt) for rtt in parts[5].split(",")] if len(parts) == 6 else []
+        except ValueError:
+            rtts = []
+        local = datetime.fromtimestamp(math.floor(time_in_sec))
+        key = int((local - datetime(1970, 1, 1)).total_seconds()) // 3600
+        if not runs or runs[-1]["key"] != key:
+            runs.append({"key": key, "points": 0, "invalid": 0, "jitter": 0.0, "loss": 0.0, "rtts": []})
+        run = runs[-1]
+        run["points"] += 1
+        run["loss"] += loss
+        if avg == -1:
+            run["invalid"] += 1
+        else:
+            run["jitter"] += maximum - minimum
+        run["rtts"] += [rtt for rtt in rtts if math.isfinite(rtt) and rtt >= 0]
+    return runs[:-1]
+
+
+@pytest.mark.parametrize("start", [datetime(2026, 3, 7, 20), datetime(2026, 10, 31, 20)])
+def test_read_log_hours_matches_line_by_line_aggregation(tmp_path, dst_timezone, start):
+    lines = log_lines(np.random.default_rng(0), start.timestamp(), 200)
+    path = tmp_path / "10_0_0_1_log.txt"
+    path.write_text("\n".join(lines) + "\n")
+
+    (keys, jitters, losses, points), (offsets, buckets, counts) = HeatmapData.read_log_hours(str(path))
+    expected = reference_hours(lines)
+
+    assert keys.tolist() == [run["key"] for run in expected]
+    assert points.tolist() == [run["points"] for run in expected]
+    np.testing.assert_allclose(jitters, [run["jitter"] / max(1, run["points"] - run["invalid"]) for run in expected])
+    np.testing.assert_allclose(losses, [run["loss"] / run["points"] for run in expected])
+    for row, run in enumerate(expected):
+        expected_buckets, expected_counts = np.unique(bucket_indices(np.array(run["rtts"])), return_counts=True)
+        assert buckets[offsets[row]:offsets[row + 1]].tolist() == expected_buckets.tolist()
+        assert counts[offsets[row]:offsets[row + 1]].tolist() == expected_counts.tolist()
+    # the change of the clock is part of the data: the skipped hour in spring, the repeated one in autumn
+    steps = np.diff(keys)
+    if start.month == 3:
+        assert 2 in steps.tolist()
+    else:
+        assert points.max() > 1.5 * np.median(points)